@@ -0,0 +1,699 @@
+"""Evaluate the slapd ACLs without a server
+
+usage: aclengine.py [-f acl-file] requester-dn target-dn attribute [value]
+
+AclPolicy parses devslapd/slapd.conf.acls and decides access the way
+slapd does (see slapd.access(5)), against a DIT held in memory by
+ditmodel.DIT. This makes it cheap to ask the same question for every
+principal, entry and attribute in the test data, where the tests in
+test-ldap-acls.py can only try a few hand-picked cases against a running
+server.
+
+Supported in 'access to':
+	*, dn[.exact|.base|.onelevel|.subtree|.children|.regex]=
+	filter=, attrs= (including @objectclass attribute sets and the
+	entry and children pseudo-attributes)
+
+Supported in 'by':
+	*, anonymous, users, self, dn[.style]= (with $n from a dn.regex
+	target), group[/objectclass[/attribute]]=, set=
+	access levels, [self]{=|+|-}privileges and self-qualified levels
+	stop, continue, break
+
+Sets may use user, this, [literal], attribute steps, -n parent steps,
+& (intersection), | (union) and parentheses.
+
+From the command line this prints the privileges that the requester
+has, and the access and by clauses that decided them. An empty
+requester-dn means an anonymous user. The DIT holds the LDIF files
+loaded by devslapd/build plus the test suite fixtures.
+"""
+
+import os
+import re
+import sys
+import getopt
+from ldapfilter import parseFilter, normaliseDN, matchKey, And, Or, Not, Equality
+from ditmodel import DIT, Entry, parentDN, attrName, buildFiles
+
+testsuite_dir = os.path.dirname(os.path.abspath(__file__))
+acl_file = os.path.join(testsuite_dir, '..', 'devslapd', 'slapd.conf.acls')
+
+class AclError(ValueError):
+    pass
+
+########################################################################
+# Privileges
+########################################################################
+
+# Privileges are single letters as in slapd.access(5): m(anage), a(dd
+# values), z (delete values), r(ead), s(earch), c(ompare), (au)x, d(isclose).
+# 'w' (write) is not a privilege of its own: it means both a and z.
+privilege_order = 'mazrscxd'
+
+# Each level includes the privileges of the levels below it
+levels = {
+    'none':     '',
+    'disclose': 'd',
+    'auth':     'dx',
+    'compare':  'dxc',
+    'search':   'dxcs',
+    'read':     'dxcsr',
+    'add':      'dxcsra',
+    'delete':   'dxcsrz',
+    'write':    'dxcsraz',
+    'manage':   'dxcsrazm',
+}
+
+# The privilege that an operation needs at each level
+needed = {
+    'disclose': 'd',
+    'auth':     'x',
+    'compare':  'c',
+    'search':   's',
+    'read':     'r',
+    'add':      'a',
+    'delete':   'z',
+    'write':    'az',
+    'manage':   'm',
+}
+
+def privileges( letters ):
+    result = set()
+    for c in letters:
+        if c == 'w':
+            result.update('az')
+        elif c == '0':
+            continue
+        elif c in privilege_order:
+            result.add(c)
+        else:
+            raise AclError('unknown privilege %r' % c)
+    return frozenset(result)
+
+all_privileges = privileges(privilege_order)
+
+# Show a set of privileges the way slapd logs them, e.g. =wrscxd
+#
+def showMask( mask ):
+    text = ''.join( [ c for c in privilege_order if c in mask ] )
+    return '=' + (text.replace('az', 'w') or '0')
+
+########################################################################
+# Reading the ACL file
+########################################################################
+
+# Split a slapd.conf file into statements: a line starting in column 1
+# plus any following lines that start with white space.
+# Returns a list of (first line number, text).
+#
+def statements( filename ):
+    result = []
+    for number, line in enumerate(open(filename)):
+        line = line.rstrip('\n')
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        if line[:1] in (' ', '\t') and result:
+            result[-1][1].append(line.strip())
+        else:
+            result.append( (number + 1, [ line.strip() ]) )
+    return [ (number, ' '.join(lines)) for number, lines in result ]
+
+# Split a statement into words, keeping quoted strings together
+#
+def words( text ):
+    return re.findall(r'(?:[^\s"]+|"[^"]*")+', text)
+
+# Split a word like dn.exact="x" into ('dn', 'exact', 'x')
+#
+def keyValue( word ):
+    if '=' not in word:
+        return word, None, None
+    key, value = word.split('=', 1)
+    if value.startswith('"') and value.endswith('"'):
+        value = value[1:-1]
+    style = None
+    if '.' in key:
+        key, style = key.split('.', 1)
+    return key.lower(), style and style.lower(), value
+
+# Attribute lists from an objectclass definition, for @attrset
+#
+def objectClassAttrs( text ):
+    name = re.search(r"NAME\s+'([^']+)'", text)
+    attrs = set()
+    for keyword in ('MUST', 'MAY'):
+        match = re.search(keyword + r'\s+(\(([^)]*)\)|(\S+))', text)
+        if match:
+            attrs.update( [ a.strip().lower() for a in (match.group(2) or match.group(3)).split('$')
+                            if a.strip() ] )
+    return name and name.group(1).lower(), attrs
+
+dn_styles = {
+    'exact': 'exact', 'base': 'exact', 'baseobject': 'exact',
+    'one': 'onelevel', 'onelevel': 'onelevel',
+    'sub': 'subtree', 'subtree': 'subtree',
+    'children': 'children',
+    'regex': 'regex',
+}
+
+def dnStyle( style ):
+    if style is None:
+        return 'exact'
+    if style not in dn_styles:
+        raise AclError('unsupported DN style %r' % style)
+    return dn_styles[style]
+
+# Does ndn fall within pattern for the given (non-regex) style?
+#
+def dnMatch( style, pattern, ndn ):
+    if style == 'exact':
+        return ndn == pattern
+    if style == 'onelevel':
+        return ndn != '' and parentDN(ndn) == pattern
+    if style == 'subtree':
+        return pattern == '' or ndn == pattern or ndn.endswith(',' + pattern)
+    if style == 'children':
+        return ndn != pattern and (pattern == '' or ndn.endswith(',' + pattern))
+    raise AclError('unsupported DN style %r' % style)
+
+########################################################################
+# Sets
+########################################################################
+
+# A parsed set expression such as "user & this/owner/member".
+# Evaluates to a set of normalised values; the clause applies if it is
+# not empty.
+#
+class SetExpression:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = re.findall(r'\[[^\]]*\]|-\d+|[A-Za-z0-9;.-]+|[&|/()]', text)
+        self.pos = 0
+        self.tree = self.parseExpr()
+        if self.pos != len(self.tokens):
+            raise AclError('cannot parse set %r' % text)
+        del self.tokens
+
+    def next(self):
+        token = self.pos < len(self.tokens) and self.tokens[self.pos] or None
+        self.pos += 1
+        return token
+
+    def peek(self):
+        return self.pos < len(self.tokens) and self.tokens[self.pos] or None
+
+    def parseExpr(self):
+        tree = self.parseTerm()
+        while self.peek() in ('&', '|'):
+            op = self.next()
+            tree = (op, tree, self.parseTerm())
+        return tree
+
+    def parseTerm(self):
+        token = self.next()
+        if token == '(':
+            tree = self.parseExpr()
+            if self.next() != ')':
+                raise AclError('missing ) in set %r' % self.text)
+        elif token in ('user', 'this'):
+            tree = (token,)
+        elif token and token.startswith('['):
+            value = token[1:-1]
+            tree = ('literal', '=' in value and normaliseDN(value) or matchKey('', value))
+        else:
+            raise AclError('unexpected %r in set %r' % (token, self.text))
+        while self.peek() == '/':
+            self.next()
+            step = self.next()
+            if step is None or step in '&|()':
+                raise AclError('missing attribute in set %r' % self.text)
+            tree = ('step', tree, step.lower())
+        return tree
+
+    # this is the target (dn, entry) pair: the entry need not be in the DIT
+    #
+    def evaluate(self, dit, user, this):
+        return self.evaluateTree(self.tree, dit, user, this)
+
+    def evaluateTree(self, tree, dit, user, this):
+        kind = tree[0]
+        if kind == 'user':
+            return user and frozenset([ user ]) or frozenset()
+        if kind == 'this':
+            return frozenset([ this[0] ])
+        if kind == 'literal':
+            return frozenset([ tree[1] ])
+        if kind in ('&', '|'):
+            left = self.evaluateTree(tree[1], dit, user, this)
+            if kind == '&' and not left:
+                return left
+            right = self.evaluateTree(tree[2], dit, user, this)
+            if kind == '&':
+                return left & right
+            return left | right
+        # An attribute or parent step from every member of the set
+        members = self.evaluateTree(tree[1], dit, user, this)
+        step = tree[2]
+        result = set()
+        if step.startswith('-'):
+            for dn in members:
+                for n in range(int(step[1:])):
+                    dn = parentDN(dn)
+                result.add(dn)
+        else:
+            for dn in members:
+                if dn == this[0]:
+                    entry = this[1]
+                else:
+                    entry = dit.entries.get(dn)
+                if entry is not None:
+                    result.update( [ matchKey(step, value) for value in entry.get(step) ] )
+        return frozenset(result)
+
+########################################################################
+# Access statements
+########################################################################
+
+class By:
+    def __init__(self, policy, tokens, line):
+        self.line = line
+        self.text = ' '.join(tokens)
+        self.kind = None
+        self.style = None
+        self.pattern = None
+        self.group_class = 'groupofnames'
+        self.group_attr = 'member'
+        self.set = None
+
+        who, style, value = keyValue(tokens[0])
+        if value is None and who in ('*', 'anonymous', 'users', 'self'):
+            self.kind = who
+        elif who == 'dn':
+            self.kind = 'dn'
+            self.style = dnStyle(style)
+            self.pattern = value
+            if self.style != 'regex':
+                self.pattern = normaliseDN(value)
+        elif who.startswith('group'):
+            self.kind = 'group'
+            parts = who.split('/')
+            if len(parts) > 1:
+                self.group_class = parts[1].lower()
+            if len(parts) > 2:
+                self.group_attr = parts[2].lower()
+            self.pattern = normaliseDN(value)
+        elif who == 'set':
+            self.kind = 'set'
+            self.set = SetExpression(value)
+        else:
+            raise AclError('line %d: unsupported who clause %r' % (line, tokens[0]))
+
+        rest = tokens[1:]
+        self.control = 'stop'
+        if rest and rest[-1] in ('stop', 'continue', 'break'):
+            self.control = rest.pop()
+        if len(rest) > 1:
+            raise AclError('line %d: unsupported by clause %r' % (line, self.text))
+        if rest:
+            self.parseAccess(rest[0])
+        elif len(tokens) > 1:
+            # Only a control, as in 'by * break': no privileges are added
+            self.parseAccess('+0')
+        else:
+            self.parseAccess('none')
+
+    def parseAccess(self, text):
+        self.self_only = False
+        if text.startswith('self') and text != 'self':
+            self.self_only = True
+            text = text[4:]
+        if text in levels:
+            self.op = '='
+            self.privileges = privileges(levels[text])
+        elif text[:1] in ('=', '+', '-'):
+            self.op = text[0]
+            self.privileges = privileges(text[1:])
+        else:
+            raise AclError('line %d: unsupported access %r' % (self.line, text))
+
+    # Does this clause apply to the requester?
+    #
+    def applies(self, policy, dit, user, ndn, entry, captures, value):
+        if self.self_only and (value is None or user == '' or normaliseDN(value) != user):
+            return False
+        kind = self.kind
+        if kind == '*':
+            return True
+        if kind == 'anonymous':
+            return user == ''
+        if kind == 'users':
+            return user != ''
+        if kind == 'self':
+            return user != '' and user == ndn
+        if kind == 'dn':
+            if self.style == 'regex':
+                return policy.regex(substitute(self.pattern, captures)).match(user) is not None
+            return dnMatch(self.style, self.pattern, user)
+        if kind == 'group':
+            return user != '' and policy.isMember(dit, user, self.pattern,
+                                                  self.group_class, self.group_attr)
+        if kind == 'set':
+            return policy.evaluateSet(dit, self, user, ndn, entry)
+        return False
+
+    # Apply this clause's access to the privileges held so far
+    #
+    def apply(self, mask):
+        if self.op == '=':
+            return self.privileges
+        if self.op == '+':
+            return mask | self.privileges
+        return mask - self.privileges
+
+# Replace $n in a who pattern with text captured by a dn.regex target
+#
+def substitute( pattern, captures ):
+    def replace( match ):
+        if match.group(1) == '$':
+            return '$'
+        n = int(match.group(1))
+        return n < len(captures) and captures[n] or ''
+    return re.sub(r'\$(\$|\d)', replace, pattern)
+
+
+class Access:
+    def __init__(self, policy, line, text):
+        self.line = line
+        tokens = words(text)
+        if tokens[:2] != [ 'access', 'to' ]:
+            raise AclError('line %d: not an access statement' % line)
+        tokens = tokens[2:]
+        if 'by' not in tokens:
+            raise AclError('line %d: access with no by clauses' % line)
+        what = tokens[:tokens.index('by')]
+        self.description = 'access to ' + ' '.join(what)
+
+        self.dn_style = None
+        self.dn_pattern = None
+        self.dn_regex = None
+        self.filter = None
+        self.attrs = None
+        for word in what:
+            key, style, value = keyValue(word)
+            if key == '*' and value is None:
+                continue
+            elif key == 'dn':
+                self.dn_style = dnStyle(style)
+                if self.dn_style == 'regex':
+                    self.dn_regex = re.compile(value, re.IGNORECASE)
+                else:
+                    self.dn_pattern = normaliseDN(value)
+            elif key == 'filter':
+                self.filter = parseFilter(value)
+            elif key in ('attrs', 'attr'):
+                self.attrs = policy.expandAttrs(value, line)
+            else:
+                raise AclError('line %d: unsupported access target %r' % (line, word))
+
+        self.clauses = []
+        clause = None
+        for word in tokens[len(what):]:
+            if word == 'by':
+                if clause:
+                    self.clauses.append(By(policy, clause, line))
+                clause = []
+            else:
+                clause.append(word)
+        if not clause:
+            raise AclError('line %d: empty by clause' % line)
+        self.clauses.append(By(policy, clause, line))
+
+    # Does this statement cover the attribute of the entry?
+    # Returns the regex captures (possibly empty) or None.
+    #
+    def match(self, ndn, attr, entry):
+        if self.attrs is not None and attr not in self.attrs:
+            return None
+        captures = ()
+        if self.dn_regex is not None:
+            match = self.dn_regex.match(ndn)
+            if match is None:
+                return None
+            captures = (match.group(0),) + match.groups()
+        elif self.dn_style is not None and not dnMatch(self.dn_style, self.dn_pattern, ndn):
+            return None
+        if self.filter is not None and (entry is None or not self.filter.match(entry)):
+            return None
+        return captures
+
+########################################################################
+# The policy
+########################################################################
+
+class AclPolicy:
+    def __init__(self, filename=acl_file, rootDN=None):
+        self.filename = filename
+        self.rootDN = rootDN and normaliseDN(rootDN)
+        self.attrsets = {}
+        self.accesses = []
+        self.add_content_acl = False
+        self.regexes = {}
+        self.cache = {}
+        self.cache_key = None
+
+        for line, text in statements(filename):
+            keyword = text.split()[0].lower()
+            if keyword == 'access':
+                self.accesses.append(Access(self, line, text))
+            elif keyword == 'objectclass':
+                name, attrs = objectClassAttrs(text)
+                if name:
+                    self.attrsets[name] = attrs
+            elif keyword == 'add_content_acl':
+                self.add_content_acl = text.split()[1].lower() in ('on', 'yes', 'true')
+
+    def expandAttrs(self, text, line):
+        result = set()
+        for name in text.split(','):
+            name = name.strip().lower()
+            if name.startswith('@'):
+                if name[1:] not in self.attrsets:
+                    raise AclError('line %d: unknown attribute set %s' % (line, name))
+                result.update(self.attrsets[name[1:]])
+            elif name.startswith('!'):
+                raise AclError('line %d: negated attribute lists are not supported' % line)
+            elif name:
+                result.add(name)
+        return frozenset(result)
+
+    def regex(self, pattern):
+        compiled = self.regexes.get(pattern)
+        if compiled is None:
+            compiled = self.regexes[pattern] = re.compile(pattern, re.IGNORECASE)
+        return compiled
+
+    # Results of group and set lookups are kept until the DIT changes
+    #
+    def cached(self, dit, key):
+        if self.cache_key != (id(dit), dit.version):
+            self.cache = {}
+            self.cache_key = (id(dit), dit.version)
+        return self.cache.get(key)
+
+    def isMember(self, dit, user, group, group_class, group_attr):
+        key = ('group', user, group, group_class, group_attr)
+        result = self.cached(dit, key)
+        if result is None:
+            entry = dit.entries.get(group)
+            result = bool(entry is not None and
+                          group_class in [ c.lower() for c in entry.get('objectclass') ] and
+                          user in [ normaliseDN(v) for v in entry.get(group_attr) ])
+            self.cache[key] = result
+        return result
+
+    def evaluateSet(self, dit, by, user, ndn, entry):
+        if entry is not dit.entries.get(ndn):
+            # Not the entry in the DIT, so the answer cannot be cached
+            return bool(by.set.evaluate(dit, user, (ndn, entry)))
+        key = ('set', id(by), user, ndn)
+        result = self.cached(dit, key)
+        if result is None:
+            result = self.cache[key] = bool(by.set.evaluate(dit, user, (ndn, entry)))
+        return result
+
+    # The privileges that requester has on one attribute of an entry.
+    # value is the attribute value concerned, if any (it matters to
+    # self-qualified access). entry may be given for an entry that is
+    # not in the DIT, such as one about to be added.
+    # If trace is a list, the statements and clauses used are appended.
+    #
+    def mask(self, dit, requester, dn, attr, value=None, entry=None, trace=None):
+        user = requester and normaliseDN(requester) or ''
+        if self.rootDN and user == self.rootDN:
+            if trace is not None:
+                trace.append('rootDN has all privileges')
+            return all_privileges
+        ndn = normaliseDN(dn)
+        attr = attr.lower()
+        if entry is None:
+            entry = dit.entries.get(ndn)
+
+        mask = frozenset()
+        for access in self.accesses:
+            captures = access.match(ndn, attr, entry)
+            if captures is None:
+                continue
+            control = None
+            for by in access.clauses:
+                if not by.applies(self, dit, user, ndn, entry, captures, value):
+                    continue
+                mask = by.apply(mask)
+                control = by.control
+                if trace is not None:
+                    trace.append('line %d: %s by %s %s' % (access.line, access.description,
+                                                           by.text, showMask(mask)))
+                if control != 'continue':
+                    break
+            if control in (None, 'continue'):
+                # The implicit 'by * none' at the end of every statement
+                if trace is not None:
+                    trace.append('line %d: %s (no clause applies) =0' %
+                                 (access.line, access.description))
+                return frozenset()
+            if control == 'stop':
+                return mask
+        return mask
+
+    # Can requester exercise the given access level on the attribute?
+    #
+    def allowed(self, dit, requester, dn, attr, level, value=None, entry=None):
+        mask = self.mask(dit, requester, dn, attr, value, entry)
+        for c in needed[level]:
+            if c not in mask:
+                return False
+        return True
+
+    # Does a search filter match the entry for requester? As in slapd,
+    # an assertion about an attribute that requester cannot search is
+    # Undefined (None here), so hidden values cannot be found by guessing.
+    # Returns True, False or None.
+    #
+    def filterMatches(self, dit, requester, f, entry):
+        if isinstance(f, And) or isinstance(f, Or):
+            decisive = isinstance(f, Or)
+            result = not decisive
+            for part in f.parts:
+                matched = self.filterMatches(dit, requester, part, entry)
+                if matched is decisive:
+                    return decisive
+                if matched is None:
+                    result = None
+            return result
+        if isinstance(f, Not):
+            matched = self.filterMatches(dit, requester, f.part, entry)
+            if matched is None:
+                return None
+            return not matched
+        value = None
+        if isinstance(f, Equality):
+            value = f.value
+        if not self.allowed(dit, requester, entry.dn, f.attr, 'search', value, entry):
+            return None
+        return f.match(entry)
+
+    # The attributes and values of an entry that requester can read,
+    # or None if the entry itself cannot be read
+    #
+    def visible(self, dit, requester, dn):
+        entry = dit.get(dn)
+        if entry is None or not self.allowed(dit, requester, dn, 'entry', 'read'):
+            return None
+        result = {}
+        for key in entry.attrs.keys():
+            readable = [ v for v in entry.get(key)
+                         if self.allowed(dit, requester, dn, key, 'read', v) ]
+            if readable:
+                result[attrName(key)] = readable
+        return result
+
+    # The checks that slapd makes for an add operation.
+    # attrs is a dictionary of attribute name to values.
+    #
+    def canAdd(self, dit, requester, dn, attrs):
+        entry = Entry(dn, attrs)
+        if not self.allowed(dit, requester, parentDN(entry.ndn), 'children', 'add'):
+            return False
+        if not self.allowed(dit, requester, dn, 'entry', 'add', entry=entry):
+            return False
+        if self.add_content_acl:
+            for key in entry.attrs.keys():
+                for value in entry.get(key):
+                    if not self.allowed(dit, requester, dn, key, 'add', value, entry):
+                        return False
+        return True
+
+    def canDelete(self, dit, requester, dn):
+        ndn = normaliseDN(dn)
+        return (self.allowed(dit, requester, parentDN(ndn), 'children', 'delete') and
+                self.allowed(dit, requester, ndn, 'entry', 'delete'))
+
+    # The checks that slapd makes for a modify operation.
+    # modlist is a python-ldap style list of (op, attr, values) where op is
+    # 0 (add), 1 (delete) or 2 (replace).
+    #
+    def canModify(self, dit, requester, dn, modlist):
+        for op, attr, values in modlist:
+            if isinstance(values, str):
+                values = [ values ]
+            if op == 2 or (op == 1 and not values):
+                # Deleting or replacing the whole attribute
+                if not self.allowed(dit, requester, dn, attr, 'delete'):
+                    return False
+            if op == 1:
+                needed_level = 'delete'
+            else:
+                needed_level = 'add'
+            for value in values or []:
+                if not self.allowed(dit, requester, dn, attr, needed_level, value):
+                    return False
+        return True
+
+########################################################################
+# Command line
+########################################################################
+
+# The DIT as loaded on the development server, plus the test fixtures
+#
+def loadTestDIT():
+    dit = DIT()
+    dit.loadLdif(*buildFiles())
+    dit.loadLdif(os.path.join(testsuite_dir, 'setup.ldif'))
+    return dit
+
+def main():
+    filename = acl_file
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'f:')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-f':
+            filename = value
+    if len(args) not in (3, 4):
+        sys.stderr.write(__doc__)
+        return 2
+
+    policy = AclPolicy(filename)
+    dit = loadTestDIT()
+    trace = []
+    mask = policy.mask(dit, args[0], args[1], args[2], len(args) > 3 and args[3] or None,
+                       trace=trace)
+    for line in trace:
+        print line
+    print showMask(mask)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Several searches in flight on one connection
+
+The *_s methods of python-ldap wait for each search to finish before
+the next is sent, so a page that needs the user entry, the link entries
+beneath it and the tags it is in costs three round trips. A
+SearchPipeline sends all of the searches at once with search_ext() and
+sorts the replies out by message id as they come back with result3():
+
+	pipeline = SearchPipeline(conn)
+	user = pipeline.search(dn, ldap.SCOPE_BASE)
+	links = pipeline.search(dn, ldap.SCOPE_ONELEVEL, '(objectClass=mozilliansLink)')
+	pipeline.wait()
+	user.entries, links.entries
+
+Each search is a PendingSearch. Its entries (ldapresult.ResultEntry
+objects) build up as they arrive. A search that reaches a size limit
+keeps what it got and is marked truncated; any other error is kept in
+'error' and raised by result(). asCompleted() yields the searches in
+the order they finish.
+
+The pipeline does not block unless asked to: poll() picks up whatever
+has arrived, and fileno() is the connection's socket, so a select() or
+poll() based event loop can call poll() when the socket is readable.
+"""
+
+import select
+import ldap
+import ldap.filter
+from ldapresult import ResultEntry
+from pagedsearch import limit_errors
+
+tags_node = 'ou=tags,dc=mozillians,dc=org'
+
+class PendingSearch:
+    def __init__(self, msgid, base, scope, filterstr):
+        self.msgid = msgid
+        self.base = base
+        self.scope = scope
+        self.filterstr = filterstr
+        self.entries = []
+        self.controls = []
+        self.done = False
+        self.truncated = False
+        self.error = None
+
+    # The entries, or the exception that stopped the search
+    #
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.entries
+
+    def __repr__(self):
+        return '<PendingSearch %d %s %s%s>' % (self.msgid, self.base, self.filterstr,
+                                              self.done and ' done' or '')
+
+
+class SearchPipeline:
+    def __init__(self, conn):
+        self.conn = conn
+        self.pending = {}
+
+    def fileno(self):
+        return self.conn.get_option(ldap.OPT_DESC)
+
+    # Send a search and return its PendingSearch straight away
+    #
+    def search(self, base, scope=ldap.SCOPE_SUBTREE, filterstr='(objectClass=*)',
+               attrlist=None, serverctrls=None):
+        msgid = self.conn.search_ext(base, scope, filterstr, attrlist, serverctrls=serverctrls)
+        search = PendingSearch(msgid, base, scope, filterstr)
+        self.pending[msgid] = search
+        return search
+
+    # Take everything that has already arrived for one search.
+    # Returns True if anything did.
+    #
+    def drain(self, search):
+        progress = False
+        while not search.done:
+            try:
+                rtype, rdata, rmsgid, controls = self.conn.result3(search.msgid, 0, 0)
+            except limit_errors:
+                search.truncated = True
+                self.finish(search)
+                return True
+            except ldap.LDAPError, e:
+                search.error = e
+                self.finish(search)
+                return True
+            if rtype is None:
+                break
+            progress = True
+            if rtype == ldap.RES_SEARCH_ENTRY:
+                for dn, attrs in rdata:
+                    search.entries.append(ResultEntry(dn, attrs))
+            elif rtype == ldap.RES_SEARCH_RESULT:
+                search.controls = controls
+                self.finish(search)
+        return progress
+
+    def finish(self, search):
+        search.done = True
+        self.pending.pop(search.msgid, None)
+
+    # Pick up whatever has arrived, waiting up to timeout seconds for
+    # something to if nothing has. Returns the searches that finished.
+    #
+    def poll(self, timeout=0):
+        finished = []
+        progress = False
+        for search in self.pending.values():
+            progress = self.drain(search) or progress
+            if search.done:
+                finished.append(search)
+        if not progress and self.pending and timeout != 0:
+            # libldap has nothing queued for us, so the socket tells the truth
+            if timeout is None:
+                select.select([ self ], [], [])
+            else:
+                select.select([ self ], [], [], timeout)
+            for search in self.pending.values():
+                self.drain(search)
+                if search.done:
+                    finished.append(search)
+        return finished
+
+    # Yield searches as they finish: all pending ones unless some are given.
+    # Raises ValueError for an unfinished search that this pipeline did
+    # not send, as it would never finish here.
+    #
+    def asCompleted(self, searches=None):
+        if searches is None:
+            searches = self.pending.values()
+        waiting = list(searches)
+        for search in waiting:
+            if not search.done and self.pending.get(search.msgid) is not search:
+                raise ValueError('%r is not pending on this pipeline' % search)
+        for search in waiting[:]:
+            if search.done:
+                waiting.remove(search)
+                yield search
+        # Searches abandoned meanwhile leave pending without finishing
+        while waiting and self.pending:
+            for search in self.poll(None):
+                if search in waiting:
+                    waiting.remove(search)
+                    yield search
+
+    # Wait for searches to finish and return them in the order given
+    #
+    def wait(self, searches=None):
+        if searches is None:
+            searches = self.pending.values()
+        searches = list(searches)
+        for search in self.asCompleted(searches):
+            pass
+        return searches
+
+    # Give up on everything still in flight
+    #
+    def abandon(self):
+        for search in self.pending.values():
+            self.conn.abandon(search.msgid)
+            search.done = True
+        self.pending = {}
+
+########################################################################
+# Composed lookups
+########################################################################
+
+# Everything a profile page shows, in one round trip: the user entry,
+# their link entries and the tags they are in.
+# Returns { 'entry': ResultEntry or None, 'links': [...], 'tags': [...] }
+# with whatever the connection is allowed to see.
+#
+def fetchProfile( conn, dn, attrlist=None ):
+    pipeline = SearchPipeline(conn)
+    user = pipeline.search(dn, ldap.SCOPE_BASE, '(objectClass=*)', attrlist)
+    links = pipeline.search(dn, ldap.SCOPE_ONELEVEL, '(objectClass=mozilliansLink)')
+    tags = pipeline.search(tags_node, ldap.SCOPE_ONELEVEL,
+                           '(&(objectClass=mozilliansGroup)(member=%s))' %
+                           ldap.filter.escape_filter_chars(dn),
+                           [ 'cn', 'displayName', 'uniqueIdentifier' ])
+    pipeline.wait()
+    entries = user.result()
+    return {
+        'entry': entries and entries[0] or None,
+        'links': links.result(),
+        'tags': tags.result(),
+    }
@@ -0,0 +1,278 @@
+"""Find searches that slapd answers without an index
+
+usage: audit-indexes.py [-n clients] [-t seconds] [-p port] [-r repeats]
+                        [-d file.ldif]... [-q queries] [-k]
+       audit-indexes.py -l slapd.log
+
+When a search filter uses an attribute that has no suitable index, slapd
+logs a warning such as
+
+	<= hdb_equality_candidates: (mail) not indexed
+
+and has to look at every entry under the search base instead. This
+starts a private server with the devslapd configuration, loads the usual
+test data (or the LDIF files given with -d, such as a large DIT made by
+data/generate.py), and runs the ldapbench workload plus a set of probe
+searches that the site and the overlays make. It then reads the server's
+log and reports each attribute and kind of index that was missed, with
+an example operation, and proposes index lines for devslapd/slapd.conf.
+
+Each probe is timed (the median of -r runs, default 5), so with a big
+enough DIT the cost of a missing index shows up directly; run once
+before and once after changing the index lines to compare.
+
+The probes are listed in 'probes' below. More can be given with -q, one
+per line as base, scope (base, one or sub) and filter separated by tabs;
+%(dn)s, %(uid)s, %(mail)s, %(cn)s, %(tag)s and %(tagname)s are replaced
+by values from the loaded data.
+
+-l reads an existing slapd log (for instance the syslog of the
+development server, which logs at 'stats') instead of running anything.
+-k keeps the server's working directory.
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import getopt
+import tempfile
+import ldap
+import ldap.filter
+from slapdinstance import SlapdInstance
+from ditmodel import readConfig
+import ldapbench
+
+people_node = 'ou=people,dc=mozillians,dc=org'
+tags_node = 'ou=tags,dc=mozillians,dc=org'
+tables_node = 'ou=tables,dc=mozillians,dc=org'
+ldap_suffix = 'dc=mozillians,dc=org'
+
+scopes = { 'base': ldap.SCOPE_BASE, 'one': ldap.SCOPE_ONELEVEL, 'sub': ldap.SCOPE_SUBTREE }
+
+# Searches made by the site and by the overlays that the ldapbench
+# workload does not cover: (base, scope, filter template)
+probes = [
+    (people_node, 'sub', '(mail=%(mail)s)'),
+    (people_node, 'sub', '(mozilliansVouchedBy=%(dn)s)'),
+    (people_node, 'sub', '(&(objectClass=mozilliansPerson)(!(mozilliansVouchedBy=*)))'),
+    (people_node, 'sub', '(memberOf=%(tag)s)'),
+    (tags_node, 'one', '(owner=%(dn)s)'),
+    (tags_node, 'one', '(displayName=%(tagname)s)'),
+    (tags_node, 'one', '(displayName=*%(tagname)s*)'),
+    (tags_node, 'one', '(member=%(dn)s)'),
+    (ldap_suffix, 'sub', '(manager=%(dn)s)'),
+    (ldap_suffix, 'sub', '(uid=%(uid)s)'),
+    (tables_node, 'sub', '(textTableKey=%(cn)s)'),
+]
+
+# The kind of index each candidates function would have used.
+# Ordering (<= and >=) searches use the equality index.
+index_types = {
+    'equality': 'eq',
+    'inequality': 'eq',
+    'substring': 'sub',
+    'presence': 'pres',
+    'approx': 'approx',
+}
+
+# slapd reports a missing index as 'not indexed', or as index_param
+# failing with LDAP_INAPPROPRIATE_MATCHING (18) when the attribute has
+# indexes but not of the kind needed
+missing_re = re.compile(r'<= \w+?_(equality|inequality|substring|presence|approx)_candidates: '
+                        r'\(([^)]+)\) (?:not indexed|index_param (?:failed|returned)=? ?\(?18\)?)')
+# The operations logged at 'stats'. Adds and modifies matter because
+# the unique and memberof overlays search on their behalf.
+operation_re = re.compile(r'conn=\d+ op=\d+ (?:SRCH base="[^"]*" .*filter="(.*)"|(ADD|MOD) dn="(.*)")$')
+
+########################################################################
+# Reading the log
+########################################################################
+
+# Returns { (attribute, index type): [count, example filter] }
+# The example is the last operation logged before the warning, which is
+# the one that caused it unless the server was busy with others.
+#
+def scanLog( lines ):
+    missing = {}
+    last_operation = None
+    for line in lines:
+        match = operation_re.search(line.rstrip())
+        if match:
+            filterstr, op, dn = match.groups()
+            last_operation = filterstr or '%s %s' % (op, dn)
+            continue
+        match = missing_re.search(line)
+        if match:
+            key = (match.group(2), index_types[match.group(1)])
+            found = missing.setdefault(key, [0, None])
+            found[0] += 1
+            found[1] = last_operation
+    return missing
+
+# Index lines that would cover everything missing, given the indexes
+# already configured
+#
+def proposeIndexes( missing, indexes ):
+    wanted = {}
+    for attr, itype in missing:
+        wanted.setdefault(attr, set()).add(itype)
+    lines = []
+    for attr in sorted(wanted, key=str.lower):
+        have = indexes.get(attr.lower(), set())
+        types = have | wanted[attr]
+        if types != have:
+            order = [ t for t in ('pres', 'eq', 'approx', 'sub') if t in types ]
+            lines.append('index\t%s\t%s' % (attr, ','.join(order)))
+    return lines
+
+########################################################################
+# Running the probes
+########################################################################
+
+# Values to put into the probe filters, taken from the loaded data
+#
+def sampleValues( conn ):
+    values = { 'dn': '', 'uid': '', 'mail': '', 'cn': '', 'tag': '', 'tagname': '' }
+    people = conn.search_ext_s(people_node, ldap.SCOPE_ONELEVEL,
+                               '(&(objectClass=mozilliansPerson)(mail=*))',
+                               [ 'uid', 'mail', 'cn' ], sizelimit=1)
+    if people:
+        dn, attrs = people[0]
+        values.update(dn=dn, uid=attrs['uid'][0], mail=attrs['mail'][0], cn=attrs['cn'][0])
+    tags = conn.search_ext_s(tags_node, ldap.SCOPE_ONELEVEL, '(displayName=*)',
+                             [ 'displayName' ], sizelimit=1)
+    if tags:
+        values.update(tag=tags[0][0], tagname=tags[0][1]['displayName'][0])
+    for name in values:
+        values[name] = ldap.filter.escape_filter_chars(values[name])
+    return values
+
+def readQueries( filename ):
+    queries = []
+    for line in open(filename):
+        line = line.rstrip('\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        base, scope, filterstr = line.split('\t', 2)
+        queries.append( (base, scope, filterstr) )
+    return queries
+
+# Run each probe as the rootDN, so the size limits do not cut it short.
+# Returns [ (filter, median seconds or None, error) ]
+#
+def runProbes( conn, queries, repeats ):
+    values = sampleValues(conn)
+    timings = []
+    for base, scope, template in queries:
+        filterstr = template % values
+        times = []
+        error = None
+        for n in range(repeats):
+            started = time.time()
+            try:
+                conn.search_s(base, scopes[scope], filterstr, [ '1.1' ])
+            except ldap.NO_SUCH_OBJECT:
+                pass
+            except ldap.LDAPError, e:
+                error = e.__class__.__name__
+                break
+            times.append(time.time() - started)
+        times.sort()
+        timings.append( (filterstr, times and times[len(times) // 2] or None, error) )
+    return timings
+
+########################################################################
+# Reporting
+########################################################################
+
+def printReport( missing, timings=None, stream=sys.stdout ):
+    if timings:
+        stream.write('%9s  %s\n' % ('median ms', 'probe'))
+        for filterstr, median, error in timings:
+            stream.write('%9s  %s\n' % (median is None and error or '%.3f' % (median * 1000),
+                                       filterstr))
+        stream.write('\n')
+
+    if not missing:
+        stream.write('No searches went without an index\n')
+        return
+    stream.write('%-24s %-6s %8s  %s\n' % ('attribute', 'index', 'warnings', 'example'))
+    for (attr, itype), (count, example) in sorted(missing.items(),
+                                                  key=lambda item: -item[1][0]):
+        stream.write('%-24s %-6s %8d  %s\n' % (attr, itype, count, example or '-'))
+
+    indexes, memberof = readConfig()
+    lines = proposeIndexes(missing, indexes)
+    if lines:
+        stream.write('\nProposed index lines for devslapd/slapd.conf:\n\n')
+        for line in lines:
+            stream.write(line + '\n')
+
+def main():
+    clients = 4
+    duration = 10
+    port = 1460
+    repeats = 5
+    ldif_files = []
+    logfile = None
+    queries = list(probes)
+    keep = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'n:t:p:r:d:q:l:k')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-n':
+            clients = int(value)
+        elif opt == '-t':
+            duration = float(value)
+        elif opt == '-p':
+            port = int(value)
+        elif opt == '-r':
+            repeats = int(value)
+        elif opt == '-d':
+            ldif_files.append(value)
+        elif opt == '-q':
+            queries.extend(readQueries(value))
+        elif opt == '-l':
+            logfile = value
+        elif opt == '-k':
+            keep = True
+
+    if logfile:
+        printReport(scanLog(open(logfile)))
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix='index-audit-')
+    log = os.path.join(workdir, 'slapd.log')
+    server = SlapdInstance(os.path.join(workdir, 'server'), port, logfile=log)
+    try:
+        server.start()
+        sys.stderr.write('Loading data\n')
+        server.load()
+        if ldif_files:
+            server.load(ldif_files)
+        conn = server.connect(server.rootDN, server.rootPW)
+        sys.stderr.write('Running the probes\n')
+        timings = runProbes(conn, queries, repeats)
+        conn.unbind()
+        if duration:
+            sys.stderr.write('Running the ldapbench workload\n')
+            ldapbench.runBenchmark(server.url, clients, duration,
+                                   rootDN=server.rootDN, rootPW=server.rootPW)
+    finally:
+        server.stop()
+
+    printReport(scanLog(open(log)), timings)
+    if keep:
+        sys.stderr.write('Server files kept in %s\n' % workdir)
+    else:
+        shutil.rmtree(workdir, True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""Compare the hdb and mdb backends
+
+usage: bench-backends.py [-b backend,...] [-n clients] [-t seconds] [-p port]
+                         [-d file.ldif]... [-o results.json]
+
+For each backend (default hdb,mdb) this starts a private server using
+devslapd/slapd.conf with that backend, loads the usual LDIF files (the
+bulk test data among them) plus any given with -d, and measures:
+
+	load	entries added per second through ldapmodify
+	read	the ldapbench searches and logins
+	write	the ldapbench modify of the user's own entry
+	size	the space the database takes on disk
+
+The servers run one after the other on the same port, each with a fresh
+database. -o saves the figures as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import getopt
+import tempfile
+from slapdinstance import SlapdInstance
+from ditmodel import buildFiles
+import ldapbench
+
+write_mix = {
+    'applicant': { 'self-modify': 1 },
+    'mozillian': { 'self-modify': 1 },
+}
+
+def countEntries( files ):
+    count = 0
+    for filename in files:
+        for line in open(filename):
+            if line.lower().startswith('dn:'):
+                count += 1
+    return count
+
+def diskUsage( directory ):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for name in filenames:
+            # st_blocks, as the mdb file is sparse
+            total += os.stat(os.path.join(dirpath, name)).st_blocks * 512
+    return total
+
+def measure( workdir, port, backend, extra_files, clients, duration ):
+    server = SlapdInstance(workdir, port, backend=backend)
+    files = buildFiles() + extra_files
+    server.start()
+    try:
+        started = time.time()
+        server.load(files)
+        load_time = time.time() - started
+
+        reads = ldapbench.runBenchmark(server.url, clients, duration, mix=ldapbench.read_mix,
+                                       rootDN=server.rootDN, rootPW=server.rootPW)
+        writes = ldapbench.runBenchmark(server.url, clients, duration, mix=write_mix,
+                                        rootDN=server.rootDN, rootPW=server.rootPW)
+    finally:
+        server.stop()
+
+    entries = countEntries(files)
+    read_all = reads['results'].get('all', {})
+    write_all = writes['results'].get('all', {})
+    return {
+        'entries': entries,
+        'load_seconds': round(load_time, 2),
+        'load_per_sec': round(entries / load_time, 1),
+        'read_ops_per_sec': read_all.get('ops_per_sec', 0),
+        'read_p95_ms': read_all.get('p95_ms'),
+        'write_ops_per_sec': write_all.get('ops_per_sec', 0),
+        'write_p95_ms': write_all.get('p95_ms'),
+        'errors': read_all.get('errors', 0) + write_all.get('errors', 0),
+        'db_bytes': diskUsage(server.dbdir),
+        'read': reads['results'],
+        'write': writes['results'],
+    }
+
+def printComparison( results, stream=sys.stdout ):
+    backends = sorted(results)
+    rows = [ ('entries loaded', 'entries', '%d'),
+             ('load entries/sec', 'load_per_sec', '%.1f'),
+             ('read ops/sec', 'read_ops_per_sec', '%.1f'),
+             ('read p95 ms', 'read_p95_ms', '%s'),
+             ('write ops/sec', 'write_ops_per_sec', '%.1f'),
+             ('write p95 ms', 'write_p95_ms', '%s'),
+             ('errors', 'errors', '%d'),
+             ('database MB', 'db_bytes', None) ]
+    stream.write('%-18s' % '' + ''.join([ '%12s' % b for b in backends ]) + '\n')
+    for label, key, fmt in rows:
+        stream.write('%-18s' % label)
+        for backend in backends:
+            value = results[backend][key]
+            if fmt is None:
+                text = '%.1f' % (value / 1048576.0)
+            else:
+                text = fmt % value
+            stream.write('%12s' % text)
+        stream.write('\n')
+
+def main():
+    backends = [ 'hdb', 'mdb' ]
+    clients = 8
+    duration = 10
+    port = 1470
+    extra_files = []
+    output = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'b:n:t:p:d:o:')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-b':
+            backends = value.split(',')
+        elif opt == '-n':
+            clients = int(value)
+        elif opt == '-t':
+            duration = float(value)
+        elif opt == '-p':
+            port = int(value)
+        elif opt == '-d':
+            extra_files.append(os.path.abspath(value))
+        elif opt == '-o':
+            output = value
+
+    topdir = tempfile.mkdtemp(prefix='backend-bench-')
+    results = {}
+    try:
+        for backend in backends:
+            sys.stderr.write('Measuring %s\n' % backend)
+            results[backend] = measure(os.path.join(topdir, backend), port, backend,
+                                       extra_files, clients, duration)
+    finally:
+        shutil.rmtree(topdir, True)
+
+    printComparison(results)
+    if output:
+        json.dump(results, open(output, 'w'), indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""How tag membership operations scale with the size of the tag
+
+usage: bench-tags.py [-s size,...] [-r repeats] [-b batch] [-p port]
+                     [-d file.ldif]... [-o results.json]
+
+Starts a private server using devslapd/slapd.conf, loads the usual
+LDIF files plus any given with -d (use data/generate.py for a DIT with
+as many people as the biggest tag), and for each size (default
+10,100,1000,10000,100000) makes a tag with that many members. Then it
+times, taking the median of -r runs (default 20):
+
+	self-add	a user adding their own DN to the tag, as the
+			site does now (T10050)
+	self-remove	and removing it again (T10055)
+	batch-add	-b users (default 50) added through
+			tagmembers.MemberBatcher in one modify, per user
+	batch-remove	and removed again, per user
+	count		tagmembers.memberCount
+	first-page	the first 15 members, sorted by cn
+	middle-page	15 members from the middle of the list
+	is-member	tagmembers.isMember
+
+The members are the people in the loaded data, as many as there are;
+if the tag is bigger, the rest are DNs of people who do not exist (the
+memberof overlay ignores them). count and the pages only see the real
+people, so the figures for them are only meaningful up to the number of
+people loaded. The count and page searches are made as the rootDN,
+as 'limits users' refuses searches with more than 500 candidates.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import getopt
+import tempfile
+import ldap
+import ldap.controls
+from slapdinstance import SlapdInstance
+from ditmodel import buildFiles, DIT
+from tagmembers import MemberBatcher, AclCheck, memberCount, memberPages, isMember
+from tagmembers import permissive_modify_oid
+import ldapbench
+
+people_node = 'ou=people,dc=mozillians,dc=org'
+tags_node = 'ou=tags,dc=mozillians,dc=org'
+
+operations = [ 'self-add', 'self-remove', 'batch-add', 'batch-remove', 'count',
+               'first-page', 'middle-page', 'is-member' ]
+
+# Values per modify when filling a tag
+fill_chunk = 5000
+
+def median( values ):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def timed( function, *args ):
+    started = time.time()
+    function(*args)
+    return time.time() - started
+
+# Make a tag with size members: the given people first, then made-up DNs
+#
+def makeTag( conn, size, people ):
+    tag = 'uniqueIdentifier=bench-tag-%d,%s' % (size, tags_node)
+    conn.add_s(tag, [ ('objectClass', [ 'mozilliansGroup' ]),
+                      ('uniqueIdentifier', [ 'bench-tag-%d' % size ]),
+                      ('cn', [ 'bench tag %d' % size ]),
+                      ('displayName', [ 'Bench tag %d' % size ]) ])
+    members = people[:size]
+    members += [ 'uniqueIdentifier=bench-%07d,%s' % (n, people_node)
+                 for n in range(size - len(members)) ]
+    for start in range(0, len(members), fill_chunk):
+        conn.modify_s(tag, [ (ldap.MOD_ADD, 'member', members[start:start + fill_chunk]) ])
+    return tag
+
+def measureTag( server, root, tag, users, repeats, batch ):
+    times = dict( [ (op, []) for op in operations ] )
+
+    # The users taking part must not be in the tag already
+    root.modify_ext_s(tag, [ (ldap.MOD_DELETE, 'member', [ dn for dn, uid, cn in users ]) ],
+                      serverctrls=[ ldap.controls.RequestControl(permissive_modify_oid, True) ])
+
+    dn = users[0][0]
+    user = server.connect(dn, 'secret')
+    for n in range(repeats):
+        times['self-add'].append(timed(user.modify_s, tag, [ (ldap.MOD_ADD, 'member', dn) ]))
+        times['self-remove'].append(timed(user.modify_s, tag, [ (ldap.MOD_DELETE, 'member', dn) ]))
+    user.unbind_s()
+
+    # The batcher's ACL check needs to know whether the tag is controlled
+    dit = DIT()
+    for found, attrs in root.search_s(tag, ldap.SCOPE_BASE, '(objectClass=*)',
+                                      [ 'objectClass', 'manager', 'owner' ]):
+        dit.add(found, attrs)
+    batcher = MemberBatcher(root, AclCheck(dit), max_batch=batch)
+    for n in range(repeats):
+        for op, request in (('batch-add', batcher.add), ('batch-remove', batcher.remove)):
+            tickets = [ request(tag, member, member) for member, uid, cn in users[:batch] ]
+            elapsed = timed(batcher.flush)
+            for ticket in tickets:
+                ticket.wait(0)
+            times[op].append(elapsed / len(tickets))
+
+    count = memberCount(root, tag)
+    for n in range(repeats):
+        times['count'].append(timed(memberCount, root, tag))
+        view = memberPages(root, tag, [ 'cn' ])
+        times['first-page'].append(timed(view.page, 1))
+        times['middle-page'].append(timed(view.page, max(1, count // 2)))
+        times['is-member'].append(timed(isMember, root, tag, users[0][0]))
+
+    result = dict( [ (op, round(median(values) * 1000, 3)) for op, values in times.items() ] )
+    result['people_counted'] = count
+    return result
+
+def printTable( results, stream=sys.stdout ):
+    sizes = sorted(results, key=int)
+    stream.write('%-14s' % 'median ms' + ''.join([ '%10s' % s for s in sizes ]) + '\n')
+    for op in operations + [ 'people_counted' ]:
+        stream.write('%-14s' % op + ''.join([ '%10s' % results[s][op] for s in sizes ]) + '\n')
+
+def main():
+    sizes = [ 10, 100, 1000, 10000, 100000 ]
+    repeats = 20
+    batch = 50
+    port = 1480
+    extra_files = []
+    output = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 's:r:b:p:d:o:')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-s':
+            sizes = [ int(s) for s in value.split(',') ]
+        elif opt == '-r':
+            repeats = int(value)
+        elif opt == '-b':
+            batch = int(value)
+        elif opt == '-p':
+            port = int(value)
+        elif opt == '-d':
+            extra_files.append(os.path.abspath(value))
+        elif opt == '-o':
+            output = value
+
+    workdir = tempfile.mkdtemp(prefix='tag-bench-')
+    server = SlapdInstance(os.path.join(workdir, 'server'), port)
+    results = {}
+    try:
+        server.start()
+        sys.stderr.write('Loading data\n')
+        server.load(buildFiles() + extra_files)
+        root = server.connect(server.rootDN, server.rootPW)
+        people = [ dn for dn, attrs in root.search_s(people_node, ldap.SCOPE_ONELEVEL,
+                                                      '(objectClass=mozilliansPerson)',
+                                                      [ '1.1' ]) ]
+        principals = ldapbench.discover(server.url, server.rootDN, server.rootPW)
+        users = principals['people']['mozillian'] + principals['people']['applicant']
+        for size in sizes:
+            sys.stderr.write('Tag with %d members\n' % size)
+            tag = makeTag(root, size, people)
+            results[str(size)] = measureTag(server, root, tag, users, repeats, batch)
+        root.unbind_s()
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, True)
+
+    printTable(results)
+    if output:
+        json.dump(results, open(output, 'w'), indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
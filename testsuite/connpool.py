@@ -0,0 +1,407 @@
+"""Pools of bound connections for middleware
+
+The middleware binds to LDAP as the user it is acting for (see the
+Authentication section of docs/ldap-design.rst). Doing that with a new
+connection for every request costs a TCP handshake and an SSHA password
+check each time.
+
+BindPool keeps connections that are already bound, keyed by the DN they
+are bound as. A connection is taken out of the pool for the length of
+one request, so two threads never share one:
+
+	pool = BindPool('ldap://localhost:1389/')
+	with pool.connection(userDN, password) as conn:
+	    conn.search_s(...)
+
+A connection is only handed back for the password it was bound with;
+anything else gets a fresh bind, so a wrong password still fails. A
+password changed through one of the pool's connections (passwd_s(), or
+a modify of userPassword) drops the DN's pooled connections at once, as
+does a successful bind with a different password. A change made some
+other way is only noticed then, or when discard() is called: until then
+the old password can still get one of the old connections, for at most
+idle_timeout seconds after it was last used. At
+most 'size' idle connections are kept: the least recently used go first,
+and any idle for longer than idle_timeout seconds are unbound. A
+connection that fails with SERVER_DOWN or CONNECT_ERROR is not put back.
+
+ServicePool holds a few connections bound as one service account
+(regAgent or LDAPAdmin in migrations/02-accounts.ldif-dist) and shares
+them between threads. actingAs(dn) returns a connection that sends the
+Proxied Authorization control (RFC 4370) with every operation, so the
+server applies the ACLs for dn without a bind. Methods that it does not
+wrap raise AttributeError instead of running as the service account:
+
+	service = ServicePool(url, regAgentDN, 'secret')
+	service.actingAs(userDN).modify_s(userDN, modlist)
+
+The service account needs an authzTo value that covers dn; the server
+must have 'authz-policy to' (both are set up in devslapd).
+"""
+
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import ldap
+from ldap.controls.simple import ProxyAuthzControl
+from ldapfilter import normaliseDN
+
+# Errors that mean the connection itself is no use any more
+connection_errors = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR)
+
+# What we remember of a password: enough to tell if it has changed
+#
+def passwordDigest( password ):
+    return hashlib.sha1(password or '').digest()
+
+# Does a modify list change the password?
+#
+def changesPassword( modlist ):
+    return [ attr for op, attr, values in modlist
+             if attr.split(';', 1)[0].lower() == 'userpassword' ] != []
+
+
+# A connection from a BindPool, which tells the pool when it changes
+# the password of the DN it is bound as or of any other DN. Everything
+# else is passed straight through.
+#
+class PooledConnection:
+    def __init__(self, conn, pool, ndn, generation):
+        self.conn = conn
+        self.pool = pool
+        self.ndn = ndn
+        self.generation = generation
+
+    def passwd(self, user, oldpw, newpw, serverctrls=None, clientctrls=None):
+        self.pool.passwordChanged(user or self.ndn)
+        return self.conn.passwd(user, oldpw, newpw, serverctrls, clientctrls)
+
+    def passwd_s(self, user, oldpw, newpw, serverctrls=None, clientctrls=None):
+        result = self.conn.passwd_s(user, oldpw, newpw, serverctrls, clientctrls)
+        self.pool.passwordChanged(user or self.ndn)
+        return result
+
+    def modify_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        if changesPassword(modlist):
+            self.pool.passwordChanged(dn)
+        return self.conn.modify_ext(dn, modlist, serverctrls, clientctrls)
+
+    def modify_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        result = self.conn.modify_ext_s(dn, modlist, serverctrls, clientctrls)
+        if changesPassword(modlist):
+            self.pool.passwordChanged(dn)
+        return result
+
+    def modify(self, dn, modlist):
+        return self.modify_ext(dn, modlist)
+
+    def modify_s(self, dn, modlist):
+        return self.modify_ext_s(dn, modlist)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class BindPool:
+    def __init__(self, url, size=100, idle_timeout=300, factory=ldap.initialize,
+                 clock=time.time):
+        self.url = url
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.factory = factory
+        self.clock = clock
+        self.lock = threading.Lock()
+        # serial -> (normalised DN, connection, password digest, time returned)
+        # in order of use, least recent first
+        self.idle = OrderedDict()
+        # normalised DN -> serials of its idle connections, most recent last
+        self.byDN = {}
+        # normalised DN -> number of password changes seen; connections
+        # bound before the latest are not put back
+        self.generations = {}
+        self.serial = 0
+        # Statistics
+        self.requests = 0
+        self.binds = 0
+        self.evictions = 0
+        self.expired = 0
+
+    # Take a connection bound as dn out of the pool, binding a new one
+    # if there is none. Anonymous connections are requested with dn=None.
+    #
+    def get(self, dn, password=None):
+        ndn = normaliseDN(dn)
+        digest = passwordDigest(password)
+        with self.lock:
+            self.requests += 1
+            self.expire()
+            for serial in reversed(self.byDN.get(ndn, [])):
+                if self.idle[serial][2] == digest:
+                    return self.remove(serial)
+            generation = self.generations.get(ndn, 0)
+        conn = self.factory(self.url)
+        if dn:
+            try:
+                conn.simple_bind_s(dn, password)
+            except ldap.LDAPError:
+                self.close(conn)
+                raise
+        with self.lock:
+            self.binds += 1
+            # The password has changed since those were bound
+            if dn and [ serial for serial in self.byDN.get(ndn, [])
+                        if self.idle[serial][2] != digest ]:
+                self.forget(ndn)
+                generation = self.generations[ndn]
+        return PooledConnection(conn, self, ndn, generation)
+
+    # Give a connection back for the next request as the same DN
+    #
+    def put(self, conn, dn, password=None):
+        ndn = normaliseDN(dn)
+        with self.lock:
+            if getattr(conn, 'generation', 0) != self.generations.get(ndn, 0):
+                self.close(conn)
+                return
+            self.serial += 1
+            self.idle[self.serial] = (ndn, conn, passwordDigest(password), self.clock())
+            self.byDN.setdefault(ndn, []).append(self.serial)
+            while len(self.idle) > self.size:
+                self.close(self.remove(next(iter(self.idle))))
+                self.evictions += 1
+
+    # Take an idle connection out of both tables (the lock must be held)
+    #
+    def remove(self, serial):
+        ndn, conn, digest, returned = self.idle.pop(serial)
+        serials = self.byDN[ndn]
+        serials.remove(serial)
+        if not serials:
+            del self.byDN[ndn]
+        return conn
+
+    @contextmanager
+    def connection(self, dn, password=None):
+        conn = self.get(dn, password)
+        try:
+            yield conn
+        except connection_errors:
+            self.close(conn)
+            raise
+        except:
+            self.put(conn, dn, password)
+            raise
+        else:
+            self.put(conn, dn, password)
+
+    # Unbind connections that have been idle too long (the lock must be held).
+    # The oldest are at the front, so stop at the first that is not.
+    #
+    def expire(self):
+        limit = self.clock() - self.idle_timeout
+        while self.idle:
+            serial = next(iter(self.idle))
+            if self.idle[serial][3] > limit:
+                break
+            self.close(self.remove(serial))
+            self.expired += 1
+
+    # Forget any connections bound as dn, e.g. after its password changes
+    #
+    def discard(self, dn):
+        with self.lock:
+            for serial in list(self.byDN.get(normaliseDN(dn), [])):
+                self.close(self.remove(serial))
+
+    # The password of dn has changed: close its idle connections, and
+    # those in use when they are put back (the lock must be held)
+    #
+    def forget(self, ndn):
+        for serial in list(self.byDN.get(ndn, [])):
+            self.close(self.remove(serial))
+        self.generations[ndn] = self.generations.get(ndn, 0) + 1
+
+    def passwordChanged(self, dn):
+        with self.lock:
+            self.forget(normaliseDN(dn))
+
+    def close(self, conn):
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def closeAll(self):
+        with self.lock:
+            while self.idle:
+                self.close(self.remove(next(iter(self.idle))))
+
+    def report(self, stream=sys.stderr):
+        stream.write( "Bind pool: %d connections requested, %d binds done, "
+                      "%d evicted, %d expired, %d idle\n" %
+                      ( self.requests, self.binds, self.evictions, self.expired,
+                        len(self.idle) ) )
+
+
+########################################################################
+# Service connections with proxied authorization
+########################################################################
+
+# A connection that acts for authzId: every operation carries the
+# Proxied Authorization control. Only the methods below can be called;
+# anything else would run with the service account's own rights, so it
+# raises AttributeError rather than reaching the connection.
+#
+class ProxiedConnection:
+    # Methods that send no operation, passed straight through
+    passed = ('result', 'result2', 'result3', 'get_option', 'fileno')
+
+    def __init__(self, conn, authzId):
+        self.conn = conn
+        self.authzId = authzId
+
+    def controls(self, serverctrls):
+        return [ ProxyAuthzControl(True, self.authzId) ] + list(serverctrls or [])
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)', attrlist=None,
+                   attrsonly=0, serverctrls=None, clientctrls=None, timeout=-1, sizelimit=0):
+        return self.conn.search_ext(base, scope, filterstr, attrlist, attrsonly,
+                                    self.controls(serverctrls), clientctrls, timeout, sizelimit)
+
+    def search_ext_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None,
+                     attrsonly=0, serverctrls=None, clientctrls=None, timeout=-1, sizelimit=0):
+        return self.conn.search_ext_s(base, scope, filterstr, attrlist, attrsonly,
+                                      self.controls(serverctrls), clientctrls, timeout, sizelimit)
+
+    def search(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
+        return self.search_ext(base, scope, filterstr, attrlist, attrsonly)
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
+        return self.search_ext_s(base, scope, filterstr, attrlist, attrsonly)
+
+    def search_st(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0,
+                  timeout=-1):
+        return self.search_ext_s(base, scope, filterstr, attrlist, attrsonly, timeout=timeout)
+
+    def add_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self.conn.add_ext(dn, modlist, self.controls(serverctrls), clientctrls)
+
+    def add_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self.conn.add_ext_s(dn, modlist, self.controls(serverctrls), clientctrls)
+
+    def add(self, dn, modlist):
+        return self.add_ext(dn, modlist)
+
+    def add_s(self, dn, modlist, serverctrls=None):
+        return self.add_ext_s(dn, modlist, serverctrls)
+
+    def modify_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self.conn.modify_ext(dn, modlist, self.controls(serverctrls), clientctrls)
+
+    def modify_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self.conn.modify_ext_s(dn, modlist, self.controls(serverctrls), clientctrls)
+
+    def modify(self, dn, modlist):
+        return self.modify_ext(dn, modlist)
+
+    def modify_s(self, dn, modlist, serverctrls=None):
+        return self.modify_ext_s(dn, modlist, serverctrls)
+
+    def delete_ext(self, dn, serverctrls=None, clientctrls=None):
+        return self.conn.delete_ext(dn, self.controls(serverctrls), clientctrls)
+
+    def delete_ext_s(self, dn, serverctrls=None, clientctrls=None):
+        return self.conn.delete_ext_s(dn, self.controls(serverctrls), clientctrls)
+
+    def delete(self, dn):
+        return self.delete_ext(dn)
+
+    def delete_s(self, dn, serverctrls=None):
+        return self.delete_ext_s(dn, serverctrls)
+
+    def compare_ext(self, dn, attr, value, serverctrls=None, clientctrls=None):
+        return self.conn.compare_ext(dn, attr, value, self.controls(serverctrls), clientctrls)
+
+    def compare_ext_s(self, dn, attr, value, serverctrls=None, clientctrls=None):
+        return self.conn.compare_ext_s(dn, attr, value, self.controls(serverctrls), clientctrls)
+
+    def compare_s(self, dn, attr, value, serverctrls=None):
+        return self.compare_ext_s(dn, attr, value, serverctrls)
+
+    def rename(self, dn, newrdn, newsuperior=None, delold=1, serverctrls=None, clientctrls=None):
+        return self.conn.rename(dn, newrdn, newsuperior, delold, self.controls(serverctrls),
+                                clientctrls)
+
+    def rename_s(self, dn, newrdn, newsuperior=None, delold=1, serverctrls=None,
+                 clientctrls=None):
+        return self.conn.rename_s(dn, newrdn, newsuperior, delold, self.controls(serverctrls),
+                                  clientctrls)
+
+    def passwd(self, user, oldpw, newpw, serverctrls=None, clientctrls=None):
+        return self.conn.passwd(user, oldpw, newpw, self.controls(serverctrls), clientctrls)
+
+    def passwd_s(self, user, oldpw, newpw, serverctrls=None, clientctrls=None):
+        return self.conn.passwd_s(user, oldpw, newpw, self.controls(serverctrls), clientctrls)
+
+    def whoami_s(self, serverctrls=None, clientctrls=None):
+        return self.conn.whoami_s(self.controls(serverctrls), clientctrls)
+
+    def __getattr__(self, name):
+        if name in self.passed:
+            return getattr(self.conn, name)
+        raise AttributeError("%s cannot be sent with proxied authorization" % name)
+
+
+class ServicePool:
+    def __init__(self, url, dn, password, size=4, factory=ldap.initialize):
+        self.url = url
+        self.dn = dn
+        self.password = password
+        self.size = size
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.connections = []
+        self.next = 0
+
+    # One of the shared service connections, in turn.
+    # python-ldap serialises calls on a connection, so more than one
+    # lets several threads have operations in flight at once.
+    #
+    def get(self):
+        with self.lock:
+            if len(self.connections) < self.size:
+                conn = self.factory(self.url)
+                conn.simple_bind_s(self.dn, self.password)
+                self.connections.append(conn)
+                return conn
+            conn = self.connections[self.next % len(self.connections)]
+            self.next += 1
+            return conn
+
+    # The service connection acting as dn
+    #
+    def actingAs(self, dn):
+        return ProxiedConnection(self.get(), 'dn:' + dn)
+
+    # Replace a connection that has failed
+    #
+    def discard(self, conn):
+        with self.lock:
+            if conn in self.connections:
+                self.connections.remove(conn)
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def closeAll(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            try:
+                conn.unbind_s()
+            except ldap.LDAPError:
+                pass
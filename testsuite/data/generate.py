@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""Generate a Mozillians test DIT of any size
+
+usage: generate.py [options] [number] [peopleDN] [maildomain]
+
+	-o file		Write LDIF to file instead of names.ldif ('-' for stdout)
+	-s seed		Random seed (default 1): the same seed gives the same output
+	-t tags		Number of tags to create (default number/100)
+	-a alpha	Exponent of the power law for tag sizes (default 1.0)
+	-f fraction	Fraction of users in the biggest tag (default 0.2)
+	-l links	Average number of link entries per user (default 1)
+	-v fraction	Fraction of users who have been vouched for (default 0.67)
+	-p prefix	Prefix for uniqueIdentifier values (default 7f3a67)
+	-S		Write input for slapadd, which does not run overlays,
+			so users get the memberOf values that the overlay would add
+
+Like generate.pl this uses the given-names and surnames files. Users are
+written one at a time and nothing is kept about them once written, so the
+memory needed does not depend on the number of users.
+
+Vouching: the first user vouches for themself, and every other vouched
+user is vouched for by a vouched user who was created earlier. This
+gives chains of vouchers of realistic depth.
+
+Tags: tag t takes each user with probability fraction/(t+1)**alpha, so a
+few tags are huge and most are small. The members of each tag are drawn
+by a random number stream of its own, which skips from one member to the
+next, so the members can be produced again in order without being stored.
+"""
+
+import sys
+import math
+import heapq
+import base64
+import getopt
+import random
+
+########################################################################
+# Operating parameters defaults
+########################################################################
+
+howmany = 10
+people_dn = 'ou=people,dc=mozillians,dc=org'
+tags_dn = 'ou=tags,dc=mozillians,dc=org'
+mail_domain = 'mozillians.org'
+ldif_file = 'names.ldif'
+seed = 1
+tag_count = None
+alpha = 1.0
+top_fraction = 0.2
+mean_links = 1.0
+vouched_fraction = 0.67
+prefix = '7f3a67'
+slapadd = False
+
+# The password is 'secret'
+password_hash = '{SSHA}VpIyfHhUQI62WgjTanEzi+NRVHYbu4c+'
+
+# Services that users may have link entries for
+services = [
+    'irc://irc.mozilla.org/',
+    'https://bugzilla.mozilla.org/',
+    'https://github.com/',
+    'http://twitter.com/',
+    'https://wiki.mozilla.org/',
+]
+
+########################################################################
+# LDIF output
+########################################################################
+
+# Write one attribute value, base64-encoding it if LDIF requires that
+#
+def writeValue( out, attr, value ):
+    if value and (value[0] in ' :<' or value[-1] == ' ' or
+                  [ c for c in value if c in '\r\n\0' or ord(c) > 126 ]):
+        out.write('%s:: %s\n' % (attr, base64.b64encode(value)))
+    else:
+        out.write('%s: %s\n' % (attr, value))
+
+def writeEntry( out, dn, attrs ):
+    writeValue(out, 'dn', dn)
+    for attr, values in attrs:
+        if isinstance(values, str):
+            values = [ values ]
+        for value in values:
+            writeValue(out, attr, value)
+    out.write('\n')
+
+########################################################################
+# Deterministic choices
+########################################################################
+
+# A random number stream for one user.
+# Other users can rebuild it to find out what was decided for that user.
+#
+def userRandom( index ):
+    return random.Random(seed * 1000003 + index)
+
+def isVouched( index ):
+    return index == 0 or userRandom(index).random() < vouched_fraction
+
+def userId( index ):
+    return 'u%06d' % index
+
+def userDN( index ):
+    return 'uniqueIdentifier=%s%s,%s' % (prefix, userId(index), people_dn)
+
+def tagDN( tag ):
+    return 'uniqueIdentifier=%stag%06d,%s' % (prefix, tag, tags_dn)
+
+# Pick an earlier vouched user to be the voucher for this one
+#
+def voucherFor( index, rng ):
+    if index == 0:
+        return 0
+    for attempt in range(10):
+        candidate = rng.randrange(index)
+        if isVouched(candidate):
+            return candidate
+    return 0
+
+def tagProbability( tag ):
+    return min(1.0, top_fraction / (tag + 1) ** alpha)
+
+# Generate the members of a tag in increasing order.
+# The gaps between members are geometrically distributed, so the work
+# done is proportional to the size of the tag rather than the number of users.
+#
+def tagMembers( tag ):
+    p = tagProbability(tag)
+    if p <= 0:
+        # -f 0: nobody is in any tag
+        return
+    rng = random.Random(seed * 1000033 + tag + 1)
+    index = -1
+    while True:
+        if p >= 1.0:
+            index += 1
+        else:
+            index += 1 + int(math.log(1.0 - rng.random()) / math.log(1.0 - p))
+        if index >= howmany:
+            return
+        yield index
+
+########################################################################
+# Entries
+########################################################################
+
+def writeUser( out, index, given, surnames, member_of ):
+    rng = userRandom(index)
+    vouched = rng.random() < vouched_fraction or index == 0
+    first = rng.choice(given)
+    last = rng.choice(surnames)
+    uid = userId(index)
+    unique = prefix + uid
+
+    attrs = [
+        ('objectclass', [ 'inetOrgPerson', 'person', 'mozilliansPerson' ]),
+        ('displayName', '%s %s' % (first, last)),
+        ('cn', '%s %s' % (first, last)),
+        ('givenName', first),
+        ('sn', last),
+        ('uniqueIdentifier', unique),
+        ('uid', '%s@%s' % (uid, mail_domain)),
+        ('userPassword', password_hash),
+        ('mail', '%s@%s' % (uid, mail_domain)),
+        ('telephoneNumber', '+44 1234 %06d' % (index + 567000)),
+    ]
+    if vouched:
+        attrs.append( ('mozilliansVouchedBy', userDN(voucherFor(index, rng))) )
+    if member_of:
+        attrs.append( ('memberOf', [ tagDN(tag) for tag in member_of ]) )
+    writeEntry(out, userDN(index), attrs)
+
+    # Link entries go straight after their parent
+    links = int(rng.expovariate(1.0 / mean_links) + 0.5) if mean_links > 0 else 0
+    for n in range(links):
+        service = rng.choice(services)
+        writeEntry(out, 'uniqueIdentifier=%s.%d,%s' % (unique, n, userDN(index)), [
+            ('objectClass', 'mozilliansLink'),
+            ('uniqueIdentifier', '%s.%d' % (unique, n)),
+            ('mozilliansServiceURI', service),
+            ('mozilliansServiceID', uid),
+        ])
+
+def writeTag( out, tag ):
+    rng = random.Random(seed * 1000037 + tag)
+    name = 'Tag %06d' % tag
+    writeValue(out, 'dn', tagDN(tag))
+    writeValue(out, 'objectClass', 'mozilliansGroup')
+    writeValue(out, 'uniqueIdentifier', '%stag%06d' % (prefix, tag))
+    writeValue(out, 'cn', name)
+    writeValue(out, 'displayName', name)
+    writeValue(out, 'description', 'Generated tag with membership probability %.6f' % tagProbability(tag))
+    writeValue(out, 'owner', userDN(voucherFor(howmany, rng)))
+    # Members are written as they are generated
+    for index in tagMembers(tag):
+        writeValue(out, 'member', userDN(index))
+    out.write('\n')
+
+########################################################################
+# Main program
+########################################################################
+
+def readNames( filename ):
+    return [ line.strip() for line in open(filename) if line.strip() ]
+
+def main():
+    global howmany, people_dn, mail_domain, ldif_file, seed, tag_count
+    global alpha, top_fraction, mean_links, vouched_fraction, prefix, slapadd
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'o:s:t:a:f:l:v:p:S')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-o':
+            ldif_file = value
+        elif opt == '-s':
+            seed = int(value)
+        elif opt == '-t':
+            tag_count = int(value)
+        elif opt == '-a':
+            alpha = float(value)
+        elif opt == '-f':
+            top_fraction = float(value)
+        elif opt == '-l':
+            mean_links = float(value)
+        elif opt == '-v':
+            vouched_fraction = float(value)
+        elif opt == '-p':
+            prefix = value
+        elif opt == '-S':
+            slapadd = True
+
+    if len(args) > 0:
+        howmany = int(args[0])
+    if len(args) > 1:
+        people_dn = args[1]
+    if len(args) > 2:
+        mail_domain = args[2]
+    if tag_count is None:
+        tag_count = max(1, howmany // 100)
+
+    given = readNames('given-names')
+    surnames = readNames('surnames')
+
+    if ldif_file == '-':
+        out = sys.stdout
+    else:
+        out = open(ldif_file, 'w')
+
+    # For slapadd we need to know which tags each user is in as we write
+    # the user. Keep the next member of every tag in a heap: this needs
+    # memory for the tags but not for the users.
+    upcoming = []
+    if slapadd:
+        for tag in range(tag_count):
+            members = tagMembers(tag)
+            for index in members:
+                upcoming.append( (index, tag, members) )
+                break
+        heapq.heapify(upcoming)
+
+    for index in range(howmany):
+        member_of = []
+        while upcoming and upcoming[0][0] == index:
+            ignored, tag, members = upcoming[0]
+            member_of.append(tag)
+            for following in members:
+                heapq.heapreplace(upcoming, (following, tag, members))
+                break
+            else:
+                heapq.heappop(upcoming)
+        writeUser(out, index, given, surnames, sorted(member_of))
+
+    for tag in range(tag_count):
+        writeTag(out, tag)
+
+    if out is not sys.stdout:
+        out.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
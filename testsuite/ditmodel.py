@@ -0,0 +1,472 @@
+"""An in-memory copy of a Mozillians DIT
+
+The DIT class holds entries keyed by normalised DN, with enough
+structure (parents and children) for the offline tools to work out
+the same things slapd would: which entries exist, what their attributes
+are, what is beneath what, and what a search would find. Entries are
+loaded from the same LDIF files as the development server uses.
+
+Entries are kept compact so that the bulk test data and generated DITs
+fit comfortably in memory:
+
+	attribute names are lowercased and interned, and the name as first
+	seen is kept once for the whole process (attrName)
+
+	DNs are normalised once when the entry is added
+
+	base64 values of binary attributes such as jpegPhoto stay encoded
+	in the mapped LDIF file (see ldifreader) until something asks for
+	them
+
+The DIT keeps the indexes named by the 'index' lines in slapd.conf:
+eq and pres indexes are hash tables, and sub indexes are built from
+three-character pieces of the values, as slapd does. Searches use them
+to narrow down the candidates before the filter is applied, and fall
+back to walking the tree when they cannot. The memberof overlay
+settings are followed too, so (memberOf=...) finds the same entries
+that it would on the server.
+
+Nothing here talks to a server, so this module needs only the standard
+library.
+"""
+
+import os
+from ldapfilter import normaliseDN, splitDN, matchKey, parseFilter
+from ldapfilter import And, Or, Equality, Present, Substring
+from ldifreader import LdifReader, Base64Value
+
+# Where the development server configuration lives
+devslapd_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'devslapd')
+slapd_conf = os.path.join(devslapd_dir, 'slapd.conf')
+
+# Search scopes, with the same values as ldap.SCOPE_*
+SCOPE_BASE = 0
+SCOPE_ONELEVEL = 1
+SCOPE_SUBTREE = 2
+
+# Attributes whose base64 values are left encoded until used
+binary_attrs = frozenset([ 'jpegphoto', 'photo', 'audio', 'usercertificate',
+                           'cacertificate', 'certificaterevocationlist' ])
+
+class NoSuchObject(KeyError):
+    pass
+
+class AlreadyExists(KeyError):
+    pass
+
+class NotAllowedOnNonLeaf(ValueError):
+    pass
+
+# The LDIF files loaded by devslapd/build, in the order it loads them
+#
+def buildFiles( directory=devslapd_dir ):
+    files = []
+    for line in open(os.path.join(directory, 'ldif-files')):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            files.append(os.path.normpath(os.path.join(directory, line)))
+    return files
+
+# The index and memberof overlay settings in slapd.conf.
+# Returns ({ attr: set of index types }, (group class, member attr, memberOf attr))
+# where the second item is None if the overlay is not configured.
+#
+def readConfig( filename=slapd_conf ):
+    indexes = {}
+    memberof = {}
+    for line in open(filename):
+        words = line.split()
+        if not words or words[0].startswith('#'):
+            continue
+        keyword = words[0].lower()
+        if keyword == 'database' and indexes:
+            # Only the first (main) database is of interest
+            break
+        if keyword == 'index' and len(words) > 2:
+            for attr in words[1].split(','):
+                if attr.lower() != 'default':
+                    indexes.setdefault(attrKey(attr), set()).update(words[2].split(','))
+        elif keyword == 'overlay' and words[1:] == [ 'memberof' ]:
+            memberof = { 'group-oc': 'groupOfNames', 'member-ad': 'member',
+                         'memberof-ad': 'memberOf' }
+        elif keyword.startswith('memberof-') and memberof and len(words) > 1:
+            memberof[keyword[len('memberof-'):]] = words[1]
+    if memberof:
+        memberof = (memberof['group-oc'].lower(), attrKey(memberof['member-ad']),
+                    attrKey(memberof['memberof-ad']))
+    return indexes, memberof or None
+
+########################################################################
+# Attribute names and values
+########################################################################
+
+# Lowercased interned attribute names, and the names as first seen
+attr_keys = {}
+attr_names = {}
+
+def attrKey( name ):
+    key = attr_keys.get(name)
+    if key is None:
+        key = attr_keys[name] = intern(name.lower())
+        attr_names.setdefault(key, name)
+    return key
+
+def attrName( key ):
+    return attr_names.get(key, key)
+
+# The parent of a DN, or '' for a top-level entry
+#
+def parentDN( dn ):
+    return ','.join(splitDN(dn)[1:])
+
+########################################################################
+# Reading LDIF
+########################################################################
+
+# Read an LDIF file of entries as (dn, { attr: [values] }) pairs.
+# Attribute names keep the case of their first appearance.
+#
+def readLdif( filename ):
+    for record in LdifReader(filename):
+        if record.changetype != 'add':
+            raise ValueError('%s: %s is a %s record, not an entry' %
+                             (filename, record.dn, record.changetype))
+        yield record.dn, record.entry(binary_attrs)
+
+########################################################################
+# Entries
+########################################################################
+
+class Entry:
+    __slots__ = ('dn', 'ndn', 'attrs', 'eid')
+
+    def __init__(self, dn, attrs, eid=0):
+        self.dn = dn
+        self.ndn = normaliseDN(dn)
+        self.eid = eid
+        self.attrs = {}
+        for name, values in attrs.items():
+            if isinstance(values, (str, Base64Value)):
+                values = [ values ]
+            self.attrs.setdefault(attrKey(name), []).extend(values)
+
+    # The values of an attribute (an empty list if it has none)
+    #
+    def get(self, attr):
+        key = attr.lower()
+        values = self.attrs.get(key)
+        if values is None:
+            return []
+        if key in binary_attrs:
+            for n, value in enumerate(values):
+                if isinstance(value, Base64Value):
+                    values[n] = str(value)
+        return values
+
+    # The entry as a python-ldap style attribute dictionary,
+    # optionally with only the attributes in attrlist
+    #
+    def asDict(self, attrlist=None):
+        if attrlist is None or '*' in attrlist:
+            keys = self.attrs.keys()
+        else:
+            keys = [ key for key in map(str.lower, attrlist) if key in self.attrs ]
+        return dict( [ (attrName(key), list(self.get(key))) for key in keys ] )
+
+    def __repr__(self):
+        return '<Entry %s>' % self.dn
+
+# Three-character pieces of a value, for the sub index
+#
+def trigrams( key ):
+    return set( [ key[i:i + 3] for i in range(len(key) - 2) ] )
+
+########################################################################
+# The DIT
+########################################################################
+
+class DIT:
+    # indexes and memberof are as returned by readConfig(), which is
+    # used if they are not given. Pass {} and False to do without.
+    #
+    def __init__(self, indexes=None, memberof=None):
+        if indexes is None or memberof is None:
+            config_indexes, config_memberof = readConfig()
+            if indexes is None:
+                indexes = config_indexes
+            if memberof is None:
+                memberof = config_memberof
+        self.memberof = memberof or None
+        self.entries = {}
+        self.children = {}
+        self.next_eid = 1
+        # Bumped on every change so that cached results can be discarded
+        self.version = 0
+
+        self.eq_index = {}
+        self.pres_index = {}
+        self.sub_index = {}
+        for attr, kinds in indexes.items():
+            key = attrKey(attr)
+            if 'eq' in kinds:
+                self.eq_index[key] = {}
+            if 'pres' in kinds:
+                self.pres_index[key] = set()
+            if 'sub' in kinds:
+                self.sub_index[key] = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, dn):
+        return normaliseDN(dn) in self.entries
+
+    def get(self, dn):
+        return self.entries.get(normaliseDN(dn))
+
+    # Entries directly beneath dn
+    #
+    def childrenOf(self, dn):
+        return [ self.entries[ndn] for ndn in sorted(self.children.get(normaliseDN(dn), ())) ]
+
+    ####################################################################
+    # Index maintenance
+    ####################################################################
+
+    def indexValues(self, ndn, key, values, adding):
+        if key in self.pres_index:
+            if adding:
+                self.pres_index[key].add(ndn)
+            else:
+                self.pres_index[key].discard(ndn)
+        eq = self.eq_index.get(key)
+        sub = self.sub_index.get(key)
+        if eq is None and sub is None:
+            return
+        for value in values:
+            mkey = matchKey(key, value)
+            if eq is not None:
+                self.updateIndex(eq, mkey, ndn, adding)
+            if sub is not None:
+                for gram in trigrams(mkey):
+                    self.updateIndex(sub, gram, ndn, adding)
+
+    def updateIndex(self, index, key, ndn, adding):
+        if adding:
+            index.setdefault(key, set()).add(ndn)
+        else:
+            members = index.get(key)
+            if members is not None:
+                members.discard(ndn)
+                if not members:
+                    del index[key]
+
+    def indexEntry(self, entry, adding):
+        for key, values in entry.attrs.items():
+            self.indexValues(entry.ndn, key, values, adding)
+
+    ####################################################################
+    # Changes
+    ####################################################################
+
+    def add(self, dn, attrs):
+        entry = Entry(dn, attrs, self.next_eid)
+        if entry.ndn in self.entries:
+            raise AlreadyExists('entry already exists: %s' % dn)
+        self.next_eid += 1
+        self.entries[entry.ndn] = entry
+        self.children.setdefault(parentDN(entry.ndn), set()).add(entry.ndn)
+        self.indexEntry(entry, True)
+        self.version += 1
+        if self.isGroup(entry):
+            self.updateMemberOf(entry, entry.get(self.memberof[1]), [])
+        return entry
+
+    def delete(self, dn):
+        ndn = normaliseDN(dn)
+        entry = self.entries.get(ndn)
+        if entry is None:
+            raise NoSuchObject('no such entry: %s' % dn)
+        if self.children.get(ndn):
+            raise NotAllowedOnNonLeaf('entry has children: %s' % dn)
+        if self.isGroup(entry):
+            self.updateMemberOf(entry, [], entry.get(self.memberof[1]))
+        self.indexEntry(entry, False)
+        del self.entries[ndn]
+        self.children.pop(ndn, None)
+        self.children.get(parentDN(ndn), set()).discard(ndn)
+        self.version += 1
+
+    # Apply a python-ldap style modlist of (op, attr, values) where op is
+    # 0 (add), 1 (delete) or 2 (replace)
+    #
+    def modify(self, dn, modlist):
+        entry = self.entries.get(normaliseDN(dn))
+        if entry is None:
+            raise NoSuchObject('no such entry: %s' % dn)
+        group = self.isGroup(entry)
+        if group:
+            old_members = list(entry.get(self.memberof[1]))
+
+        for op, attr, values in modlist:
+            key = attrKey(attr)
+            if isinstance(values, str):
+                values = [ values ]
+            values = values or []
+            old = entry.get(key)
+            if op == 0:
+                new = old + [ v for v in values if v not in old ]
+            elif op == 1 and values:
+                keys = set( [ matchKey(key, v) for v in values ] )
+                new = [ v for v in old if matchKey(key, v) not in keys ]
+            else:
+                new = list(values)
+            self.indexValues(entry.ndn, key, old, False)
+            if new:
+                entry.attrs[key] = new
+                self.indexValues(entry.ndn, key, new, True)
+            else:
+                entry.attrs.pop(key, None)
+        self.version += 1
+
+        if group:
+            new_members = entry.get(self.memberof[1])
+            self.updateMemberOf(entry, [ m for m in new_members if m not in old_members ],
+                                [ m for m in old_members if m not in new_members ])
+
+    # Replace the values of one attribute (no values removes it)
+    #
+    def replace(self, dn, attr, values):
+        self.modify(dn, [ (2, attr, values) ])
+
+    ####################################################################
+    # The memberof overlay
+    ####################################################################
+
+    def isGroup(self, entry):
+        return bool(self.memberof and
+                    self.memberof[0] in [ c.lower() for c in entry.get('objectclass') ])
+
+    # Keep memberOf in the member entries in step with a group's members.
+    # As with the overlay, members that do not exist are ignored.
+    #
+    def updateMemberOf(self, group, added, removed):
+        memberof_key = self.memberof[2]
+        for members, op in ((added, 0), (removed, 1)):
+            for member in members:
+                entry = self.entries.get(normaliseDN(member))
+                if entry is not None:
+                    self.modify(entry.dn, [ (op, memberof_key, [ group.dn ]) ])
+
+    ####################################################################
+    # Searching
+    ####################################################################
+
+    # The entries that could match a filter according to the indexes,
+    # or None if the indexes cannot tell
+    #
+    def candidates(self, f):
+        if isinstance(f, And):
+            found = [ c for c in map(self.candidates, f.parts) if c is not None ]
+            if not found:
+                return None
+            found.sort(key=len)
+            result = found[0]
+            for c in found[1:]:
+                if not result:
+                    break
+                result = result & c
+            return result
+        if isinstance(f, Or):
+            result = set()
+            for part in f.parts:
+                c = self.candidates(part)
+                if c is None:
+                    return None
+                result = result | c
+            return result
+        if isinstance(f, Equality):
+            index = self.eq_index.get(f.attr)
+            if index is not None:
+                return index.get(f.key, frozenset())
+        elif isinstance(f, Present):
+            if f.attr in self.pres_index:
+                return self.pres_index[f.attr]
+        elif isinstance(f, Substring):
+            index = self.sub_index.get(f.attr)
+            if index is not None:
+                grams = set()
+                for piece in [ f.initial, f.final ] + f.any:
+                    if piece:
+                        grams.update(trigrams(matchKey(f.attr, piece)))
+                if grams:
+                    result = None
+                    for gram in grams:
+                        found = index.get(gram, frozenset())
+                        if result is None:
+                            result = found
+                        else:
+                            result = result & found
+                    return result
+        return None
+
+    # Every entry in scope beneath (and including) base
+    #
+    def walk(self, nbase, scope):
+        if scope == SCOPE_BASE:
+            return [ nbase ]
+        if scope == SCOPE_ONELEVEL:
+            return list(self.children.get(nbase, ()))
+        result = []
+        pending = [ nbase ]
+        while pending:
+            ndn = pending.pop()
+            if ndn in self.entries:
+                result.append(ndn)
+            pending.extend(self.children.get(ndn, ()))
+        return result
+
+    def inScope(self, ndn, nbase, scope):
+        if scope == SCOPE_BASE:
+            return ndn == nbase
+        if scope == SCOPE_ONELEVEL:
+            return parentDN(ndn) == nbase
+        return nbase == '' or ndn == nbase or ndn.endswith(',' + nbase)
+
+    # Search like ldap.search_s, returning Entry objects in the order
+    # they were added. filterstr may be a string or a parsed filter.
+    #
+    def search(self, base, scope=SCOPE_SUBTREE, filterstr='(objectClass=*)'):
+        nbase = normaliseDN(base)
+        if nbase not in self.entries and nbase != '':
+            raise NoSuchObject('no such entry: %s' % base)
+        if isinstance(filterstr, str):
+            f = parseFilter(filterstr)
+        else:
+            f = filterstr
+
+        found = None
+        if scope != SCOPE_BASE:
+            found = self.candidates(f)
+        if found is None:
+            found = self.walk(nbase, scope)
+        else:
+            found = [ ndn for ndn in found if self.inScope(ndn, nbase, scope) ]
+
+        result = []
+        for ndn in found:
+            entry = self.entries.get(ndn)
+            if entry is not None and f.match(entry):
+                result.append(entry)
+        result.sort(key=lambda entry: entry.eid)
+        return result
+
+    # Load every entry from LDIF files, in order
+    #
+    def loadLdif(self, *filenames):
+        count = 0
+        for filename in filenames:
+            for dn, attrs in readLdif(filename):
+                self.add(dn, attrs)
+                count += 1
+        return count
@@ -0,0 +1,77 @@
+"""Stand-ins for a server and a clock, for the tests that need neither
+
+AsyncConnection answers the asynchronous *_ext methods the way libldap
+does: each operation gets a message id and its replies are collected
+with result3(). A subclass queues each operation with a generator that
+makes its changes and yields its replies as (rtype, rdata) when polled;
+a search yields its entries before its result:
+
+	def delete_ext(self, dn, serverctrls=None, clientctrls=None):
+		def replies():
+			del self.entries[normaliseDN(dn)]
+			yield ldap.RES_DELETE, []
+		return self.queue('delete', dn, replies())
+
+An exception raised by the generator is raised by result3(), as the
+error result of that operation. fileno() for the connection is a pipe
+that is always readable, so callers that select() on it never wait.
+
+Clock can be given to anything that takes a clock function, and moved
+on by the test instead of sleeping.
+"""
+
+import os
+import ldap
+
+class AsyncConnection:
+    def __init__(self):
+        self.msgid = 0
+        # msgid: [polls left, kind, replies]
+        self.pending = {}
+        # (kind, dn) of every operation sent
+        self.sent = []
+        # The most writes that were in flight at once
+        self.most = 0
+        # A descriptor that is always readable, for callers to wait on
+        self.pipe = os.pipe()
+        os.write(self.pipe[1], 'x')
+
+    def get_option(self, option):
+        assert option == ldap.OPT_DESC
+        return self.pipe[0]
+
+    def close(self):
+        for fd in self.pipe:
+            os.close(fd)
+
+    # Send an operation, to be answered after the given number of polls
+    #
+    def queue(self, kind, dn, replies, polls=1):
+        self.msgid += 1
+        self.pending[self.msgid] = [ polls, kind, replies ]
+        self.sent.append( (kind, dn) )
+        self.most = max(self.most, len([ p for p in self.pending.values() if p[1] != 'search' ]))
+        return self.msgid
+
+    def result3(self, msgid, all=1, timeout=None):
+        waiting = self.pending[msgid]
+        waiting[0] -= 1
+        if waiting[0] > 0:
+            return None, None, None, None
+        waiting[0] = 1
+        try:
+            rtype, rdata = waiting[2].next()
+        except Exception:
+            del self.pending[msgid]
+            raise
+        if rtype != ldap.RES_SEARCH_ENTRY:
+            del self.pending[msgid]
+        return rtype, rdata, msgid, []
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,189 @@
+"""Logging in with a username and password
+
+The usual way for a client to log a user in (T0020 in the design doc)
+is to search anonymously for (uid=username) and then bind as the DN
+that comes back: two round trips, and the reason anon needs search
+access to uid at all.
+
+The dev server also accepts SASL PLAIN binds. slapd turns the SASL
+username into a DN itself with the authz-regexp rule in
+devslapd/slapd.conf and checks the password against that entry's
+userPassword, so the client sends the uid and password in one bind.
+
+Authenticator logs users in on a connection it is given and remembers
+the DN each uid turned out to belong to. The next login for that uid is
+a simple bind straight to the DN:
+
+	auth = Authenticator()
+	dn = auth.login(conn, 'alice', password)
+
+The first login for a uid costs the SASL bind plus a 'Who am I?' to
+learn the DN. If a cached DN refuses the password, an anonymous search
+finds out whether the uid has moved to another entry; only then is the
+cache corrected and the password tried on the new DN. Otherwise the
+login fails after the one bind, so a wrong password costs one failed
+bind towards the ppolicy lockout, as it would without the cache, and
+cannot push a good DN out of the cache. Entries are forgotten after ttl
+seconds, and at once when noteModify() or noteDelete() is told about a
+change to a uid.
+
+With mode='search' the Authenticator does the anonymous search instead
+of SASL, for servers without the PLAIN mechanism.
+"""
+
+import time
+import threading
+import ldap
+import ldap.sasl
+import ldap.filter
+from ldapfilter import normaliseDN
+
+people_node = 'ou=people,dc=mozillians,dc=org'
+
+# SASL PLAIN (RFC 4616).
+# python-ldap 2.4 only provides classes for DIGEST-MD5, GSSAPI and EXTERNAL.
+#
+class plain(ldap.sasl.sasl):
+    def __init__(self, authc_id, password, authz_id=''):
+        ldap.sasl.sasl.__init__(self, { ldap.sasl.CB_AUTHNAME: authc_id,
+                                        ldap.sasl.CB_PASS: password,
+                                        ldap.sasl.CB_USER: authz_id },
+                                'PLAIN')
+
+
+# Find the entry for a uid the way T0020 does: anonymously.
+# This looks where the authz-regexp rules in devslapd/slapd.conf do, so
+# SASL and search logins find the same entries.
+# Returns the DN, or None unless exactly one entry matched
+#
+def searchForUid( conn, uid, base=people_node ):
+    try:
+        res = conn.search_s(base, ldap.SCOPE_ONELEVEL,
+                            '(uid=%s)' % ldap.filter.escape_filter_chars(uid),
+                            [ 'uniqueIdentifier' ])
+    except ldap.SIZELIMIT_EXCEEDED:
+        return None
+    if len(res) != 1:
+        return None
+    return res[0][0]
+
+
+class Authenticator:
+    def __init__(self, mode='sasl', ttl=600, search_conn=None, clock=time.time):
+        if mode not in ('sasl', 'search'):
+            raise ValueError('mode must be sasl or search, not %r' % mode)
+        self.mode = mode
+        self.ttl = ttl
+        # Connection for the uid searches in 'search' mode
+        self.search_conn = search_conn
+        self.clock = clock
+        self.lock = threading.Lock()
+        # uid (lowercased) -> (DN, time learnt)
+        self.cache = {}
+        # Statistics
+        self.logins = 0
+        self.hits = 0
+        self.stale = 0
+
+    # Bind conn as the user whose uid is given.
+    # Returns the DN bound as; raises INVALID_CREDENTIALS if the
+    # uid is unknown or the password is wrong.
+    #
+    def login(self, conn, uid, password):
+        if not password:
+            # An empty password would be an unauthenticated bind, which succeeds
+            raise ldap.INVALID_CREDENTIALS({'desc': 'Invalid credentials'})
+        self.logins += 1
+        dn = self.lookup(uid)
+        if dn:
+            try:
+                conn.simple_bind_s(dn, password)
+                self.hits += 1
+                return dn
+            except ldap.INVALID_CREDENTIALS:
+                moved = self.moved(conn, uid, dn)
+                if moved is None:
+                    raise
+                self.stale += 1
+                self.forget(uid)
+                conn.simple_bind_s(moved, password)
+                with self.lock:
+                    self.cache[uid.lower()] = (moved, self.clock())
+                return moved
+
+        if self.mode == 'sasl':
+            conn.sasl_interactive_bind_s('', plain(uid, password))
+            authzid = conn.whoami_s() or ''
+            if not authzid.startswith('dn:'):
+                raise ldap.INVALID_CREDENTIALS({'desc': 'Invalid credentials'})
+            dn = authzid[3:]
+        else:
+            dn = searchForUid(self.search_conn or conn, uid)
+            if dn is None:
+                raise ldap.INVALID_CREDENTIALS({'desc': 'Invalid credentials'})
+            conn.simple_bind_s(dn, password)
+
+        with self.lock:
+            self.cache[uid.lower()] = (dn, self.clock())
+        return dn
+
+    # The DN that uid belongs to now if it is no longer dn, or None.
+    # The search is anonymous (a failed bind leaves conn anonymous), so
+    # it costs no bind. A uid that has gone is forgotten.
+    #
+    def moved(self, conn, uid, dn):
+        try:
+            found = searchForUid(self.search_conn or conn, uid)
+        except ldap.LDAPError:
+            return None
+        if found is None:
+            self.forget(uid)
+            return None
+        if normaliseDN(found) == normaliseDN(dn):
+            return None
+        return found
+
+    # The cached DN for a uid, or None
+    #
+    def lookup(self, uid):
+        with self.lock:
+            cached = self.cache.get(uid.lower())
+            if cached is None:
+                return None
+            if cached[1] + self.ttl < self.clock():
+                del self.cache[uid.lower()]
+                return None
+            return cached[0]
+
+    def forget(self, uid):
+        with self.lock:
+            self.cache.pop(uid.lower(), None)
+
+    # Forget every uid that maps to dn
+    #
+    def forgetDN(self, dn):
+        ndn = normaliseDN(dn)
+        with self.lock:
+            for uid, (cached_dn, learnt) in self.cache.items():
+                if normaliseDN(cached_dn) == ndn:
+                    del self.cache[uid]
+
+    # Call with each modify sent, so that a changed uid is not used
+    # to log in as the entry it used to belong to
+    #
+    def noteModify(self, dn, modlist):
+        for mod in modlist:
+            op, attr, values = mod
+            if attr.lower() != 'uid':
+                continue
+            self.forgetDN(dn)
+            if isinstance(values, basestring):
+                values = [ values ]
+            for value in values or []:
+                self.forget(value)
+
+    def noteDelete(self, dn):
+        self.forgetDN(dn)
+
+    def noteRename(self, dn):
+        self.forgetDN(dn)
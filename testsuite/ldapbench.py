@@ -0,0 +1,339 @@
+"""Load generator for the development LDAP server
+
+usage: ldapbench.py [-H url] [-n clients] [-t seconds] [-w password]
+                    [-o results.json] [-c previous.json]
+
+Runs a mix of the operations that the Mozillians site does, from many
+client processes at once, and reports latency percentiles and throughput
+for each kind of principal and operation:
+
+	anon		look up a user by uid and bind as them
+	applicant	cn substring search, tag read, modify own entry
+	mozillian	cn substring search, tag read, modify own entry
+
+The principals are taken from whatever is loaded in the server, so the
+bulk test data or a DIT made by data/generate.py both work. All users are
+expected to have the same password ('secret' in the test data).
+
+The modify changes the user's description. The values that were there
+before are put back when the run ends.
+
+Results can be saved as JSON with -o and a previous run given with -c to
+see how much things have changed.
+"""
+
+import sys
+import time
+import json
+import math
+import random
+import getopt
+import multiprocessing
+import ldap
+import ldap.filter
+from slapdinstance import readVars
+
+people_node = 'ou=people,dc=mozillians,dc=org'
+tags_node = 'ou=tags,dc=mozillians,dc=org'
+
+# Relative frequency of each operation for each kind of principal
+default_mix = {
+    'anon':      { 'login': 1 },
+    'applicant': { 'cn-search': 4, 'tag-read': 2, 'self-modify': 1 },
+    'mozillian': { 'cn-search': 4, 'tag-read': 2, 'self-modify': 1 },
+}
+
+# The same without writes, which replicas refer to the main server
+read_mix = {
+    'anon':      { 'login': 1 },
+    'applicant': { 'cn-search': 4, 'tag-read': 2 },
+    'mozillian': { 'cn-search': 4, 'tag-read': 2 },
+}
+
+########################################################################
+# Finding principals
+########################################################################
+
+# Collect the users and tags that the workload will use
+#
+def discover( url, rootDN, rootPW ):
+    conn = ldap.initialize(url)
+    conn.simple_bind_s(rootDN, rootPW)
+
+    people = { 'applicant': [], 'mozillian': [] }
+    # The descriptions that self-modify overwrites, to be put back afterwards
+    descriptions = {}
+    for dn, attrs in conn.search_s(people_node, ldap.SCOPE_ONELEVEL,
+                                   '(&(objectClass=mozilliansPerson)(uid=*))',
+                                   ['uid', 'cn', 'mozilliansVouchedBy', 'description']):
+        kind = attrs.get('mozilliansVouchedBy') and 'mozillian' or 'applicant'
+        people[kind].append( (dn, attrs['uid'][0], attrs.get('cn', [''])[0]) )
+        if attrs.get('description'):
+            descriptions[dn] = attrs['description']
+
+    tags = [ dn for dn, attrs in conn.search_s(tags_node, ldap.SCOPE_ONELEVEL,
+                                               '(objectClass=mozilliansGroup)', ['1.1']) ]
+    conn.unbind()
+    return { 'people': people, 'tags': tags, 'descriptions': descriptions }
+
+# Put back the descriptions of the entries that self-modify changed
+#
+def restoreDescriptions( url, rootDN, rootPW, dns, descriptions ):
+    if not dns:
+        return
+    conn = ldap.initialize(url)
+    conn.simple_bind_s(rootDN, rootPW)
+    for dn in sorted(set(dns)):
+        # Replacing with no values removes the attribute
+        conn.modify_s(dn, [ (ldap.MOD_REPLACE, 'description', descriptions.get(dn)) ])
+    conn.unbind()
+
+########################################################################
+# Operations
+########################################################################
+
+class Client:
+    def __init__(self, url, kind, principals, password, rng):
+        self.url = url
+        self.kind = kind
+        self.principals = principals
+        self.password = password
+        self.rng = rng
+        self.everyone = principals['people']['applicant'] + principals['people']['mozillian']
+        self.modified = False
+
+        if kind == 'anon':
+            self.conn = ldap.initialize(url)
+            # Logins rebind this one so we do not measure TCP setup
+            self.login_conn = ldap.initialize(url)
+        else:
+            self.dn, self.uid, self.cn = rng.choice(principals['people'][kind])
+            self.conn = ldap.initialize(url)
+            self.conn.simple_bind_s(self.dn, password)
+
+    def login(self):
+        dn, uid, cn = self.rng.choice(self.everyone)
+        res = self.conn.search_s(people_node, ldap.SCOPE_SUBTREE,
+                                 '(uid=%s)' % ldap.filter.escape_filter_chars(uid), ['1.1'])
+        if len(res) != 1:
+            raise ldap.NO_SUCH_OBJECT({ 'desc': 'uid lookup found %d entries' % len(res) })
+        self.login_conn.simple_bind_s(res[0][0], self.password)
+
+    def cnSearch(self):
+        dn, uid, cn = self.rng.choice(self.everyone)
+        # A fragment of someone's name, as typed into a search box
+        fragment = cn[:3] or 'a'
+        try:
+            self.conn.search_s(people_node, ldap.SCOPE_SUBTREE,
+                               '(cn=*%s*)' % ldap.filter.escape_filter_chars(fragment),
+                               ['cn', 'mail', 'uid'])
+        except ldap.SIZELIMIT_EXCEEDED:
+            # The server did the work: this is what the site sees too
+            pass
+
+    def tagRead(self):
+        if not self.principals['tags']:
+            return
+        self.conn.search_s(self.rng.choice(self.principals['tags']), ldap.SCOPE_BASE,
+                           '(objectClass=*)', ['cn', 'displayName', 'member'])
+
+    def selfModify(self):
+        self.modified = True
+        self.conn.modify_s(self.dn, [ (ldap.MOD_REPLACE, 'description',
+                                       'Benchmark %f' % time.time()) ])
+
+    operations = {
+        'login': login,
+        'cn-search': cnSearch,
+        'tag-read': tagRead,
+        'self-modify': selfModify,
+    }
+
+    def close(self):
+        self.conn.unbind()
+        if self.kind == 'anon':
+            self.login_conn.unbind()
+
+########################################################################
+# Running the load
+########################################################################
+
+# Pick operations according to their weights
+#
+def chooser( weights, rng ):
+    ops = []
+    for op, weight in sorted(weights.items()):
+        ops.extend( [ op ] * weight )
+    return lambda: rng.choice(ops)
+
+# Body of each client process.
+# Returns ({ 'kind/op': ([latencies], errors) }, DN whose description
+# was changed or None)
+#
+def runClient( args ):
+    url, kind, principals, password, mix, duration, seed = args
+    rng = random.Random(seed)
+    samples = {}
+    try:
+        client = Client(url, kind, principals, password, rng)
+    except ldap.LDAPError:
+        return { kind + '/connect': ([], 1) }, None
+
+    choose = chooser(mix[kind], rng)
+    deadline = time.time() + duration
+    while True:
+        op = choose()
+        started = time.time()
+        if started > deadline:
+            break
+        latencies, errors = samples.setdefault(kind + '/' + op, ([], [0]))
+        try:
+            Client.operations[op](client)
+            latencies.append(time.time() - started)
+        except ldap.LDAPError:
+            errors[0] += 1
+
+    client.close()
+    return (dict( [ (key, (latencies, errors[0])) for key, (latencies, errors) in samples.items() ] ),
+            client.modified and client.dn or None)
+
+# Nearest-rank percentile of a sorted list
+#
+def percentile( values, pct ):
+    if not values:
+        return None
+    rank = max(0, int(math.ceil(pct * len(values) / 100.0)) - 1)
+    return values[min(rank, len(values) - 1)]
+
+def summarise( latencies, errors, duration ):
+    latencies = sorted(latencies)
+    def ms( value ):
+        if value is None:
+            return None
+        return round(value * 1000, 3)
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'ops_per_sec': round(len(latencies) / float(duration), 1),
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+    }
+
+# Run the workload and return a summary for each kind/operation pair
+# and for each kind of principal as a whole.
+# url may be a list of servers holding the same data (replicas), in
+# which case the clients are shared out between them.
+#
+def runBenchmark( url, clients=8, duration=10, password='secret', mix=default_mix,
+                  rootDN=None, rootPW=None, seed=1 ):
+    settings = readVars()
+    urls = isinstance(url, basestring) and [ url ] or list(url)
+    rootDN = rootDN or settings['manager']
+    rootPW = rootPW or settings['password']
+    principals = discover(urls[0], rootDN, rootPW)
+
+    kinds = [ kind for kind in sorted(mix)
+              if kind == 'anon' or principals['people'].get(kind) ]
+    # Each server gets a run of clients of every kind
+    jobs = [ (urls[(n // len(kinds)) % len(urls)], kinds[n % len(kinds)], principals,
+              password, mix, duration, seed + n)
+             for n in range(clients) ]
+
+    pool = multiprocessing.Pool(clients)
+    try:
+        outcomes = pool.map(runClient, jobs, 1)
+    finally:
+        pool.close()
+        pool.join()
+    restoreDescriptions(urls[0], rootDN, rootPW, [ dn for outcome, dn in outcomes if dn ],
+                        principals['descriptions'])
+
+    merged = {}
+    for outcome, dn in outcomes:
+        for key, (latencies, errors) in outcome.items():
+            for name in (key, key.split('/')[0] + '/all', 'all'):
+                total = merged.setdefault(name, ([], [0]))
+                total[0].extend(latencies)
+                total[1][0] += errors
+
+    results = {}
+    for key, (latencies, errors) in merged.items():
+        results[key] = summarise(latencies, errors[0], duration)
+
+    return {
+        'config': {
+            'url': url,
+            'clients': clients,
+            'duration': duration,
+            'mix': mix,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+########################################################################
+# Reporting
+########################################################################
+
+def printSummary( summary, previous=None, stream=sys.stdout ):
+    stream.write('%-24s %8s %6s %9s %9s %9s %9s' %
+                 ('operation', 'count', 'errors', 'ops/sec', 'p50 ms', 'p95 ms', 'p99 ms'))
+    if previous:
+        stream.write(' %9s %9s' % ('ops/sec%', 'p95%'))
+    stream.write('\n')
+
+    for key in sorted(summary['results']):
+        r = summary['results'][key]
+        stream.write('%-24s %8d %6d %9.1f %9s %9s %9s' %
+                     (key, r['count'], r['errors'], r['ops_per_sec'],
+                      r['p50_ms'], r['p95_ms'], r['p99_ms']))
+        if previous:
+            old = previous['results'].get(key)
+            stream.write(' %9s %9s' % (change(old and old['ops_per_sec'], r['ops_per_sec']),
+                                       change(old and old['p95_ms'], r['p95_ms'])))
+        stream.write('\n')
+
+# Percentage change from old to new
+#
+def change( old, new ):
+    if not old or new is None:
+        return '-'
+    return '%+.1f' % ((new - old) * 100.0 / old)
+
+def main():
+    settings = readVars()
+    url = settings['serverurl']
+    clients = 8
+    duration = 10
+    password = 'secret'
+    output = None
+    previous = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'H:n:t:w:o:c:')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-H':
+            url = value
+        elif opt == '-n':
+            clients = int(value)
+        elif opt == '-t':
+            duration = float(value)
+        elif opt == '-w':
+            password = value
+        elif opt == '-o':
+            output = value
+        elif opt == '-c':
+            previous = json.load(open(value))
+
+    summary = runBenchmark(url, clients, duration, password)
+    printSummary(summary, previous)
+    if output:
+        json.dump(summary, open(output, 'w'), indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
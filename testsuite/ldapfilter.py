@@ -0,0 +1,231 @@
+"""LDAP search filters (RFC 4515) evaluated in Python
+
+parseFilter() turns a filter string into a tree of Filter objects, each
+of which can be matched against an entry. An entry is anything with a
+get(attr) method that returns the list of values for an attribute, with
+attribute names compared case-insensitively.
+
+Matching follows the rules of the attributes in the Mozillians schema
+closely enough for testing: values are compared case-insensitively,
+DN-valued attributes are compared as normalised DNs, and approximate
+matches are treated as equality. Extensible matches are not supported.
+"""
+
+import re
+
+# Attributes whose values are DNs
+dn_attrs = dict.fromkeys([
+    'member', 'owner', 'manager', 'memberof', 'mozilliansvouchedby',
+    'seealso', 'distinguishednametablekey', 'creatorsname', 'modifiersname',
+])
+
+class FilterError(ValueError):
+    pass
+
+# Lowercase a DN and remove insignificant spaces so that DNs can be compared.
+# None (an anonymous user) becomes ''.
+#
+def normaliseDN( dn ):
+    if not dn:
+        return ''
+    return ','.join( [ re.sub(r'\s*([=+])\s*', r'\1', rdn.strip())
+                       for rdn in splitDN(dn.lower()) ] )
+
+# Split a DN into RDN strings, honouring backslash escapes
+#
+def splitDN( dn ):
+    rdns = []
+    current = []
+    escaped = False
+    for c in dn:
+        if escaped:
+            current.append(c)
+            escaped = False
+        elif c == '\\':
+            current.append(c)
+            escaped = True
+        elif c in ',;':
+            rdns.append(''.join(current))
+            current = []
+        else:
+            current.append(c)
+    if current or rdns:
+        rdns.append(''.join(current))
+    return rdns
+
+# The form of a value used for comparisons
+#
+def matchKey( attr, value ):
+    if attr in dn_attrs:
+        return normaliseDN(value)
+    return ' '.join(value.lower().split())
+
+########################################################################
+# Filter components
+########################################################################
+
+class Filter:
+    def match(self, entry):
+        raise NotImplementedError
+
+class And(Filter):
+    def __init__(self, parts):
+        self.parts = parts
+    def match(self, entry):
+        for part in self.parts:
+            if not part.match(entry):
+                return False
+        return True
+    def __str__(self):
+        return '(&%s)' % ''.join(map(str, self.parts))
+
+class Or(Filter):
+    def __init__(self, parts):
+        self.parts = parts
+    def match(self, entry):
+        for part in self.parts:
+            if part.match(entry):
+                return True
+        return False
+    def __str__(self):
+        return '(|%s)' % ''.join(map(str, self.parts))
+
+class Not(Filter):
+    def __init__(self, part):
+        self.part = part
+    def match(self, entry):
+        return not self.part.match(entry)
+    def __str__(self):
+        return '(!%s)' % self.part
+
+class Present(Filter):
+    def __init__(self, attr):
+        self.attr = attr.lower()
+    def match(self, entry):
+        return len(entry.get(self.attr)) > 0
+    def __str__(self):
+        return '(%s=*)' % self.attr
+
+class Equality(Filter):
+    def __init__(self, attr, value):
+        self.attr = attr.lower()
+        self.value = value
+        self.key = matchKey(self.attr, value)
+    def match(self, entry):
+        for value in entry.get(self.attr):
+            if matchKey(self.attr, value) == self.key:
+                return True
+        return False
+    def __str__(self):
+        return '(%s=%s)' % (self.attr, escapeValue(self.value))
+
+class Ordering(Filter):
+    def __init__(self, attr, op, value):
+        self.attr = attr.lower()
+        self.op = op
+        self.key = matchKey(self.attr, value)
+    def match(self, entry):
+        for value in entry.get(self.attr):
+            key = matchKey(self.attr, value)
+            if (self.op == '>=' and key >= self.key) or (self.op == '<=' and key <= self.key):
+                return True
+        return False
+    def __str__(self):
+        return '(%s%s%s)' % (self.attr, self.op, escapeValue(self.key))
+
+class Substring(Filter):
+    def __init__(self, attr, initial, any, final):
+        self.attr = attr.lower()
+        self.initial = initial
+        self.any = any
+        self.final = final
+        pattern = ''
+        if initial is not None:
+            pattern += re.escape(matchKey(self.attr, initial))
+        pattern += '.*' + ''.join( [ re.escape(matchKey(self.attr, s)) + '.*' for s in any ] )
+        if final is not None:
+            pattern += re.escape(matchKey(self.attr, final))
+        self.regex = re.compile('^' + pattern + '$', re.DOTALL)
+    def match(self, entry):
+        for value in entry.get(self.attr):
+            if self.regex.match(matchKey(self.attr, value)):
+                return True
+        return False
+    def __str__(self):
+        parts = [ self.initial or '' ] + self.any + [ self.final or '' ]
+        return '(%s=%s)' % (self.attr, '*'.join(map(escapeValue, parts)))
+
+########################################################################
+# Parsing
+########################################################################
+
+def escapeValue( value ):
+    return ''.join( [ c in '*()\\\0' and '\\%02x' % ord(c) or c for c in value ] )
+
+def unescapeValue( value ):
+    return re.sub(r'\\([0-9a-fA-F]{2})', lambda m: chr(int(m.group(1), 16)), value)
+
+def parseFilter( text ):
+    text = text.strip()
+    # A bare item without parentheses is accepted, as ldapsearch does
+    if not text.startswith('('):
+        text = '(' + text + ')'
+    result, pos = parseItem(text, 0)
+    if pos != len(text):
+        raise FilterError('unexpected text after filter: %r' % text[pos:])
+    return result
+
+def parseItem( text, pos ):
+    if text[pos:pos + 1] != '(':
+        raise FilterError('expected ( at position %d in %r' % (pos, text))
+    pos += 1
+    op = text[pos:pos + 1]
+    if op in ('&', '|'):
+        parts = []
+        pos += 1
+        while text[pos:pos + 1] == '(':
+            part, pos = parseItem(text, pos)
+            parts.append(part)
+        result = op == '&' and And(parts) or Or(parts)
+    elif op == '!':
+        part, pos = parseItem(text, pos + 1)
+        result = Not(part)
+    else:
+        end = findClose(text, pos)
+        result = parseSimple(text[pos:end])
+        pos = end
+    if text[pos:pos + 1] != ')':
+        raise FilterError('expected ) at position %d in %r' % (pos, text))
+    return result, pos + 1
+
+# Find the ) that ends a simple item, skipping escaped characters
+#
+def findClose( text, pos ):
+    while pos < len(text):
+        if text[pos] == '\\':
+            pos += 3
+        elif text[pos] == ')':
+            return pos
+        elif text[pos] == '(':
+            break
+        else:
+            pos += 1
+    raise FilterError('unterminated item in %r' % text)
+
+def parseSimple( item ):
+    match = re.match(r'^([A-Za-z0-9][A-Za-z0-9;.-]*)(~=|>=|<=|:=|=)(.*)$', item, re.DOTALL)
+    if not match:
+        raise FilterError('cannot parse filter item %r' % item)
+    attr, op, value = match.groups()
+    if op == ':=' or ':' in attr:
+        raise FilterError('extensible matches are not supported: %r' % item)
+    if op in ('>=', '<='):
+        return Ordering(attr, op, unescapeValue(value))
+    if op == '~=':
+        return Equality(attr, unescapeValue(value))
+    if value == '*':
+        return Present(attr)
+    if '*' in value:
+        parts = [ unescapeValue(part) for part in value.split('*') ]
+        return Substring(attr, parts[0] or None, [ p for p in parts[1:-1] if p ], parts[-1] or None)
+    return Equality(attr, unescapeValue(value))
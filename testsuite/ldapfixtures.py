@@ -0,0 +1,323 @@
+"""Shared fixtures for the LDAP test suite
+
+Binding a fresh connection for every principal in every test costs a TCP
+handshake and an SSHA password check each time. The ConnectionCache here
+binds each principal once per run and hands the same connection back to
+every test that asks for it.
+
+A cached connection is only reused if the server still thinks it belongs
+to the principal it was bound as. Anything that changes that (a test that
+rebinds a shared connection, a dropped TCP session) is detected with a
+'Who am I?' extended operation, which is far cheaper than a bind, and the
+connection is replaced.
+
+Reloading every entry in setup.ldif for every test is similarly wasteful.
+The LdifSnapshot loads the fixture once and then puts back only the
+entries that a test actually touched. It finds out which those are from a
+ChangeJournal that the cached connections write to whenever they send an
+update. If the journal cannot be trusted the whole fixture is reloaded.
+
+Searches on the cached connections return ldapresult.ResultEntry objects,
+which look like the usual (dn, attrs) pairs but find attributes without
+regard to case in one lookup.
+"""
+
+import sys
+import ldap
+import ldap.modlist
+import ldap.ldapobject
+from ldifreader import readEntries
+from ldifload import PipelinedLoader, addOperations
+from subtreedelete import deleteSubtrees
+from ldapresult import resultEntries
+from ldapfilter import normaliseDN
+
+# Turn a bind DN into the authzId string returned by whoami_s()
+#
+def authzIdForDN( dn ):
+    if not dn:
+        return ''
+    return 'dn:' + normaliseDN(dn)
+
+
+########################################################################
+# Journal of the entries that a test has changed
+########################################################################
+
+class ChangeJournal:
+    def __init__(self):
+        self.recording = True
+        self.clear()
+
+    def clear(self):
+        # Normalised DN -> DN as given by the test
+        self.touched = {}
+        # Normalised DNs that were the target of an add
+        self.added = {}
+        # Set to False when we see something that we cannot undo selectively
+        self.complete = True
+
+    def record(self, op, dn):
+        if not self.recording:
+            return
+        if dn is None:
+            self.complete = False
+            return
+        ndn = normaliseDN(dn)
+        self.touched[ndn] = dn
+        if op == 'add':
+            self.added[ndn] = dn
+
+    # Renames move whole subtrees about so we do not try to track them
+    #
+    def invalidate(self):
+        if self.recording:
+            self.complete = False
+
+
+# An LDAP connection that reports every update it sends to a ChangeJournal
+# All the synchronous update methods call these asynchronous ones.
+#
+class JournalLDAPObject(ldap.ldapobject.SimpleLDAPObject):
+    journal = None
+
+    def add_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        if self.journal:
+            self.journal.record('add', dn)
+        return ldap.ldapobject.SimpleLDAPObject.add_ext(self, dn, modlist, serverctrls, clientctrls)
+
+    def modify_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        if self.journal:
+            self.journal.record('modify', dn)
+        return ldap.ldapobject.SimpleLDAPObject.modify_ext(self, dn, modlist, serverctrls, clientctrls)
+
+    def delete_ext(self, dn, serverctrls=None, clientctrls=None):
+        if self.journal:
+            self.journal.record('delete', dn)
+        return ldap.ldapobject.SimpleLDAPObject.delete_ext(self, dn, serverctrls, clientctrls)
+
+    def rename(self, dn, newrdn, newsuperior=None, delold=1, serverctrls=None, clientctrls=None):
+        if self.journal:
+            self.journal.invalidate()
+        return ldap.ldapobject.SimpleLDAPObject.rename(self, dn, newrdn, newsuperior, delold, serverctrls, clientctrls)
+
+    def passwd(self, user, oldpw, newpw, serverctrls=None, clientctrls=None):
+        if self.journal:
+            # A null user means 'whoever I am bound as'
+            self.journal.record('modify', user)
+        return ldap.ldapobject.SimpleLDAPObject.passwd(self, user, oldpw, newpw, serverctrls, clientctrls)
+
+    # Search results come back as ResultEntry objects, so the tests can
+    # look attributes up without scanning every key
+    #
+    def search_ext_s(self, *args, **kwargs):
+        return resultEntries(ldap.ldapobject.SimpleLDAPObject.search_ext_s(self, *args, **kwargs))
+
+
+# Return a function that makes connections which report to the given journal
+#
+def journalFactory( journal ):
+    def factory( url ):
+        conn = JournalLDAPObject(url)
+        conn.journal = journal
+        return conn
+    return factory
+
+
+########################################################################
+# Cache of bound connections
+########################################################################
+
+class ConnectionCache:
+    def __init__(self, url, factory=ldap.initialize):
+        self.url = url
+        self.factory = factory
+        # name -> (connection, DN, password)
+        self.connections = {}
+        # Statistics
+        self.requests = 0
+        self.bindRequests = 0
+        self.binds = 0
+        self.repairs = 0
+
+    # Return a connection bound as the given DN
+    # Anonymous connections are requested with dn=None
+    #
+    def get(self, name, dn=None, password=None):
+        self.requests += 1
+        if dn:
+            self.bindRequests += 1
+
+        cached = self.connections.get(name)
+        if cached:
+            conn, cached_dn, cached_pw = cached
+            if cached_dn == dn and cached_pw == password and self.check(conn, dn):
+                return conn
+            # The connection is no longer what we think it is
+            self.repairs += 1
+            self.discard(name)
+
+        conn = self.factory(self.url)
+        if dn:
+            conn.simple_bind_s(dn, password)
+            self.binds += 1
+        self.connections[name] = (conn, dn, password)
+        return conn
+
+    # Check that a connection is still alive and bound as the expected DN
+    #
+    def check(self, conn, dn):
+        try:
+            authzid = conn.whoami_s()
+        except ldap.LDAPError:
+            return False
+        return normaliseDN(authzid or '') == authzIdForDN(dn)
+
+    # Drop a connection from the cache so that the next get() rebinds it
+    #
+    def discard(self, name):
+        cached = self.connections.pop(name, None)
+        if cached:
+            try:
+                cached[0].unbind()
+            except ldap.LDAPError:
+                pass
+
+    def closeAll(self):
+        for name in self.connections.keys():
+            self.discard(name)
+
+    # Without the cache every request for a bound connection
+    # would have needed its own bind
+    #
+    def bindsSaved(self):
+        return self.bindRequests - self.binds
+
+    def report(self, stream=sys.stderr):
+        stream.write( "Connection cache: %d connections requested, %d binds done, "
+                      "%d binds saved, %d connections repaired\n" %
+                      ( self.requests, self.binds, self.bindsSaved(), self.repairs ) )
+
+
+########################################################################
+# Snapshot of an LDIF fixture
+########################################################################
+
+class LdifSnapshot:
+    def __init__(self, filename, journal):
+        self.journal = journal
+
+        # Entries in file order, which puts parents before children
+        self.entries = list(readEntries(filename))
+        self.baseline = {}
+        for dn, entry in self.entries:
+            self.baseline[normaliseDN(dn)] = (dn, entry)
+
+        # Entries that are members of fixture groups.
+        # If one of these has to be re-added then the memberOf overlay will
+        # not fill in its memberOf values, so we must reload the groups as well.
+        self.members = {}
+        for dn, entry in self.entries:
+            for attr, values in entry.items():
+                if attr.lower() == 'member':
+                    for value in values:
+                        self.members[normaliseDN(value)] = True
+
+        # Statistics
+        self.fullLoads = 0
+        self.restores = 0
+        self.entriesRestored = 0
+
+    # Delete and re-add everything, including any entries that the
+    # journal says were added since the last load.
+    # The adds (and the deletes) are pipelined on the one connection.
+    #
+    def load(self, conn):
+        self.unload(conn)
+        self.journal.recording = False
+        try:
+            self.pipeline(conn, addOperations(self.entries))
+        finally:
+            self.journal.recording = True
+        self.fullLoads += 1
+
+    # Remove the fixture and anything added to it or beneath it
+    #
+    def unload(self, conn):
+        self.journal.recording = False
+        try:
+            extra = self.journal.added.values()
+            deleteSubtrees(conn, extra + [ dn for dn, entry in self.entries ])
+        finally:
+            self.journal.recording = True
+        self.journal.clear()
+
+    # Carry out the operations, raising the first error as add_s would
+    #
+    def pipeline(self, conn, operations):
+        report = PipelinedLoader([ conn ]).load(operations)
+        if report['errors']:
+            kind, dn, error = report['errors'][0]
+            raise error
+
+    # Put back the entries touched since the last load or restore.
+    # extra_dns lists entries that the test says it added.
+    #
+    def restore(self, conn, extra_dns=[]):
+        for dn in extra_dns:
+            self.journal.record('add', dn)
+
+        if not self.journal.complete:
+            self.load(conn)
+            return
+
+        self.journal.recording = False
+        try:
+            try:
+                self.restoreTouched(conn)
+            except ldap.LDAPError:
+                # Something we did not expect: start again from scratch
+                self.journal.complete = False
+        finally:
+            self.journal.recording = True
+
+        if self.journal.complete:
+            self.journal.clear()
+            self.restores += 1
+        else:
+            self.load(conn)
+
+    def restoreTouched(self, conn):
+        # Remove new entries and anything beneath them
+        added = [ dn for ndn, dn in self.journal.touched.items()
+                  if ndn in self.journal.added and ndn not in self.baseline ]
+        if added:
+            report = deleteSubtrees(conn, added)
+            self.entriesRestored += report['counts'].get('delete', 0)
+
+        # Put fixture entries back as they were, parents first.
+        # Changes to entries outside the fixture are the test's own business.
+        for dn, entry in self.entries:
+            ndn = normaliseDN(dn)
+            if ndn not in self.journal.touched:
+                continue
+            try:
+                res = conn.search_s(dn, ldap.SCOPE_BASE, '(objectclass=*)', ['*'])
+            except ldap.NO_SUCH_OBJECT:
+                res = []
+            if res:
+                modlist = ldap.modlist.modifyModlist(res[0][1], entry)
+                if modlist:
+                    conn.modify_s(dn, modlist)
+                    self.entriesRestored += 1
+            elif ndn in self.members:
+                self.journal.complete = False
+                return
+            else:
+                conn.add_s(dn, ldap.modlist.addModlist(entry))
+                self.entriesRestored += 1
+
+    def report(self, stream=sys.stderr):
+        stream.write( "Fixture snapshot: %d full loads, %d selective restores, "
+                      "%d entries restored\n" %
+                      ( self.fullLoads, self.restores, self.entriesRestored ) )
@@ -0,0 +1,132 @@
+"""Search result entries with case-insensitive attribute lookup
+
+python-ldap returns each entry of a search result as a (dn, attrs) pair,
+where attrs is a dictionary keyed by attribute name exactly as the
+server sent it. Attribute names are not case-sensitive, so finding an
+attribute means comparing the lowercased name against every key.
+
+ResultEntry does that lowercasing once per entry. It still behaves like
+the (dn, attrs) pair, so it can be indexed and unpacked as before and
+compared with plain tuples:
+
+	entry = ResultEntry(dn, attrs)
+	dn, attrs = entry
+	entry.values('CN') == entry[1]['cn']
+
+The helper functions getAttrNames, getAttrValueList, getAttrValue and
+attrValueMatch accept either form. Given a ResultEntry each lookup costs
+one dictionary access. Patterns given to attrValueMatch are compiled
+once and kept.
+"""
+
+import re
+
+class ResultEntry(object):
+    __slots__ = ('dn', 'attrs', 'lower')
+
+    def __init__(self, dn, attrs):
+        self.dn = dn
+        self.attrs = attrs
+        self.lower = dict( [ (name.lower(), values) for name, values in attrs.items() ] )
+
+    # The (dn, attrs) pair interface
+    #
+    def __getitem__(self, index):
+        return (self.dn, self.attrs)[index]
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        return iter((self.dn, self.attrs))
+
+    # Equal to a (dn, attrs) pair in any form; anything else is left
+    # for the other object to decide
+    #
+    def __eq__(self, other):
+        if not isinstance(other, (ResultEntry, tuple, list)) or len(other) != 2:
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __repr__(self):
+        return repr((self.dn, self.attrs))
+
+    # Attribute names as the server sent them
+    #
+    def names(self):
+        return self.attrs.keys()
+
+    # All values of an attribute (an empty list if there are none)
+    #
+    def values(self, attrname):
+        return self.lower.get(attrname.lower(), [])
+
+    # The first value of an attribute, or None
+    #
+    def value(self, attrname):
+        values = self.lower.get(attrname.lower())
+        if not values:
+            return None
+        return values[0]
+
+    # Does any value of the attribute match the pattern?
+    # None if the attribute has no values.
+    #
+    def match(self, attrname, pattern):
+        values = self.lower.get(attrname.lower())
+        if not values:
+            return None
+        search = compiled(pattern).search
+        for val in values:
+            if search(val):
+                return True
+        return False
+
+# Compiled patterns for attrValueMatch
+patterns = {}
+
+def compiled( pattern ):
+    regex = patterns.get(pattern)
+    if regex is None:
+        regex = patterns[pattern] = re.compile(pattern)
+    return regex
+
+def resultEntry( ldap_result ):
+    if isinstance(ldap_result, ResultEntry):
+        return ldap_result
+    return ResultEntry(ldap_result[0], ldap_result[1])
+
+# Wrap every entry of a python-ldap search result
+#
+def resultEntries( ldap_results ):
+    return [ resultEntry(r) for r in ldap_results ]
+
+########################################################################
+# The helpers used by the tests
+########################################################################
+
+def getAttrNames( ldap_result ):
+    return resultEntry(ldap_result).names()
+
+# Get list of values for attribute
+# If there is no such attribute then we return an empty list
+#
+def getAttrValueList( ldap_result, attrname ):
+    return resultEntry(ldap_result).values(attrname)
+
+# Get the first value of an attribute
+# If there is no such attribute then we return None
+#
+def getAttrValue( ldap_result, attrname ):
+    return resultEntry(ldap_result).value(attrname)
+
+# Check for a value of an attribute that matches a given pattern
+#
+def attrValueMatch( ldap_result, attrname, pattern ):
+    return resultEntry(ldap_result).match(attrname, pattern)
@@ -0,0 +1,409 @@
+"""Load LDIF with many operations in flight at once
+
+usage: ldifload.py [-H url] [-D dn] [-w password] [-n connections]
+                   [-W window] [-r] [-c] [-q] file.ldif ...
+
+ldapmodify (and so x-load-ldif) sends one operation and waits for the
+answer before sending the next, so most of the time is spent waiting for
+the round trip and for slapd to finish each write. PipelinedLoader keeps
+up to 'window' operations outstanding on each of its connections and
+sends more as the answers come in, so slapd always has work queued and
+can use several threads.
+
+The order in the file still matters, and is kept where it must be: an
+operation is not sent until everything before it on the same entry or on
+its parent has been answered, and a delete waits for everything before
+it beneath the entry. So an entry is added before its mozilliansLink
+children, and a subtree listed children first is deleted children first.
+Unrelated entries go in any order.
+
+Errors are dealt with as ldapmodify -c would, and some are retried:
+
+	ALREADY_EXISTS	on an add: counted as existing, or with -r (replace)
+			turned into a modify that replaces each attribute
+	NO_SUCH_OBJECT	on a delete: counted as already absent
+			on an add, modify or rename: held back until an add
+			(or rename) makes the missing entry appear later in
+			the input, and failed at the end if none does
+
+Anything else is counted as failed and reported at the end with the
+entries per second. With -c the files are checked against the schema
+first (see schemacheck.py), and nothing is loaded if there are problems.
+The connections bind as the rootDN from ../devslapd/vars unless -D and
+-w are given.
+"""
+
+import sys
+import time
+import select
+import getopt
+import collections
+import ldap
+import ldap.modlist
+from ldapfilter import normaliseDN, splitDN
+from ldifreader import LdifReader
+
+# Operations held back for a missing entry are tried this many times more
+default_retries = 3
+
+def ancestors( ndn ):
+    rdns = splitDN(ndn)
+    return [ ','.join(rdns[n:]) for n in range(1, len(rdns)) ]
+
+########################################################################
+# Operations
+########################################################################
+
+class Operation:
+    def __init__(self, kind, dn, args=None):
+        # kind is add, delete, modify or modrdn; args is the modlist for
+        # add and modify and (newrdn, deleteoldrdn, newsuperior) for modrdn
+        self.kind = kind
+        self.dn = dn
+        self.args = args
+        self.ndn = normaliseDN(dn)
+        rdns = splitDN(self.ndn)
+        self.parent = ','.join(rdns[1:])
+        # Where a rename puts the entry
+        self.newdn = None
+        if kind == 'modrdn':
+            newrdn, delold, newsuperior = args
+            self.newdn = normaliseDN(','.join([ newrdn, newsuperior or self.parent ]))
+        # What is actually sent: the kind, or 'replace' for an add that
+        # found the entry already there
+        self.action = kind
+        # Controls to send with it, such as Tree Delete
+        self.serverctrls = None
+        self.waiting = 0
+        self.dependents = []
+        self.tries = 0
+        self.done = False
+
+    def __repr__(self):
+        return '<Operation %s %s>' % (self.kind, self.dn)
+
+def recordOperation( record ):
+    if record.changetype == 'add':
+        return Operation('add', record.dn, record.modlist())
+    if record.changetype == 'modify':
+        return Operation('modify', record.dn, record.changes())
+    if record.changetype in ('modrdn', 'moddn'):
+        return Operation('modrdn', record.dn, record.rename())
+    return Operation(record.changetype, record.dn)
+
+# The operations in LDIF files, read as they are needed
+#
+def fileOperations( files ):
+    for filename in files:
+        for record in LdifReader(filename):
+            yield recordOperation(record)
+
+def addOperations( entries ):
+    for dn, attrs in entries:
+        yield Operation('add', dn, ldap.modlist.addModlist(attrs))
+
+def deleteOperations( dns, serverctrls=None ):
+    for dn in dns:
+        op = Operation('delete', dn)
+        op.serverctrls = serverctrls
+        yield op
+
+########################################################################
+# The loader
+########################################################################
+
+class PipelinedLoader:
+    def __init__(self, conns, window=32, replace=False, retries=default_retries,
+                 clock=time.time):
+        # One (connection, { msgid: operation }) for each connection
+        self.channels = [ (conn, {}) for conn in conns ]
+        self.window = window
+        self.replace = replace
+        self.retries = retries
+        self.clock = clock
+        # How far to read ahead of the operations that can be sent
+        self.readahead = window * len(conns) * 4
+
+        # The last unanswered operation on each DN, and the unanswered
+        # operations beneath each DN
+        self.last = {}
+        self.beneath = {}
+        self.ready = collections.deque()
+        # Operations waiting for the DN they need to appear
+        self.orphans = {}
+        self.unfinished = 0
+        self.outstanding = 0
+
+        self.counts = collections.defaultdict(int)
+        self.errors = []
+
+    ####################################################################
+    # Ordering
+    ####################################################################
+
+    def admit(self, op):
+        needs = [ self.last.get(op.ndn), self.last.get(op.parent) ]
+        if op.newdn:
+            needs.append(self.last.get(op.newdn))
+            needs.append(self.last.get(','.join(splitDN(op.newdn)[1:])))
+        if op.kind in ('delete', 'modrdn'):
+            needs.extend(self.beneath.get(op.ndn, ()))
+        for need in set(needs):
+            if need is not None and not need.done:
+                need.dependents.append(op)
+                op.waiting += 1
+
+        self.last[op.ndn] = op
+        if op.newdn:
+            self.last[op.newdn] = op
+        for ancestor in ancestors(op.ndn):
+            self.beneath.setdefault(ancestor, set()).add(op)
+        self.unfinished += 1
+        if not op.waiting:
+            self.ready.append(op)
+
+    def finish(self, op):
+        op.done = True
+        self.unfinished -= 1
+        for ndn in (op.ndn, op.newdn):
+            if ndn and self.last.get(ndn) is op:
+                del self.last[ndn]
+        for ancestor in ancestors(op.ndn):
+            below = self.beneath.get(ancestor)
+            if below is not None:
+                below.discard(op)
+                if not below:
+                    del self.beneath[ancestor]
+        for dependent in op.dependents:
+            dependent.waiting -= 1
+            if not dependent.waiting:
+                self.ready.append(dependent)
+        op.dependents = []
+
+    # An entry now exists: send what was waiting for it
+    #
+    def appeared(self, ndn):
+        for op in self.orphans.pop(ndn, ()):
+            self.ready.append(op)
+
+    ####################################################################
+    # Sending and answers
+    ####################################################################
+
+    def send(self, op):
+        conn, pending = min(self.channels, key=lambda channel: len(channel[1]))
+        controls = op.serverctrls
+        if op.action == 'add':
+            msgid = conn.add_ext(op.dn, op.args, serverctrls=controls)
+        elif op.action == 'replace':
+            msgid = conn.modify_ext(op.dn, [ (ldap.MOD_REPLACE, attr, values)
+                                             for attr, values in op.args ],
+                                    serverctrls=controls)
+        elif op.action == 'modify':
+            msgid = conn.modify_ext(op.dn, op.args, serverctrls=controls)
+        elif op.action == 'delete':
+            msgid = conn.delete_ext(op.dn, serverctrls=controls)
+        elif op.action == 'modrdn':
+            newrdn, delold, newsuperior = op.args
+            msgid = conn.rename(op.dn, newrdn, newsuperior, delold and 1 or 0,
+                                serverctrls=controls)
+        else:
+            raise ValueError('%s: unknown changetype %s' % (op.dn, op.kind))
+        pending[msgid] = op
+        self.outstanding += 1
+
+    def room(self):
+        return min( [ len(pending) for conn, pending in self.channels ] ) < self.window
+
+    def succeeded(self, op):
+        self.counts[op.action == 'replace' and 'replaced' or op.kind] += 1
+        self.finish(op)
+        if op.action in ('add', 'replace'):
+            self.appeared(op.ndn)
+        elif op.newdn:
+            self.appeared(op.newdn)
+
+    def failed(self, op, error):
+        if isinstance(error, ldap.ALREADY_EXISTS) and op.action == 'add':
+            if self.replace:
+                op.action = 'replace'
+                self.ready.appendleft(op)
+                return
+            self.counts['existing'] += 1
+            self.finish(op)
+            self.appeared(op.ndn)
+            return
+        if isinstance(error, ldap.NO_SUCH_OBJECT):
+            if op.kind == 'delete':
+                self.counts['absent'] += 1
+                self.finish(op)
+                return
+            if op.tries < self.retries:
+                op.tries += 1
+                self.counts['retried'] += 1
+                missing = op.kind == 'add' and op.parent or op.ndn
+                self.orphans.setdefault(missing, []).append(op)
+                return
+        self.counts['failed'] += 1
+        self.errors.append( (op.kind, op.dn, error) )
+        self.finish(op)
+
+    # Take whatever answers have arrived, waiting up to timeout seconds
+    # for one if none has
+    #
+    def collect(self, timeout=1.0):
+        progress = False
+        for conn, pending in self.channels:
+            for msgid, op in pending.items():
+                try:
+                    rtype, rdata, rmsgid, controls = conn.result3(msgid, 1, 0)
+                except ldap.LDAPError, e:
+                    del pending[msgid]
+                    self.outstanding -= 1
+                    self.failed(op, e)
+                    progress = True
+                    continue
+                if rtype is None:
+                    continue
+                del pending[msgid]
+                self.outstanding -= 1
+                self.succeeded(op)
+                progress = True
+        if not progress:
+            waiting = [ conn.get_option(ldap.OPT_DESC) for conn, pending in self.channels if pending ]
+            select.select(waiting, [], [], timeout)
+        return progress
+
+    # Give up on the operations still waiting for an entry to appear
+    #
+    def abandonOrphans(self):
+        orphans = self.orphans
+        self.orphans = {}
+        for ops in orphans.values():
+            for op in ops:
+                self.counts['failed'] += 1
+                self.errors.append( (op.kind, op.dn, ldap.NO_SUCH_OBJECT({ 'desc': 'No such object' })) )
+                self.finish(op)
+
+    ####################################################################
+    # Loading
+    ####################################################################
+
+    # Carry out the operations, in order where it matters.
+    # Returns a report (see report()).
+    #
+    def load(self, operations):
+        started = self.clock()
+        source = iter(operations)
+        exhausted = False
+        while True:
+            # Read ahead, and read on regardless when nothing can be sent
+            while not exhausted and (self.unfinished < self.readahead or
+                                     not (self.ready or self.outstanding)):
+                try:
+                    self.admit(source.next())
+                except StopIteration:
+                    exhausted = True
+            while self.ready and self.room():
+                self.send(self.ready.popleft())
+            if self.outstanding:
+                self.collect()
+            elif not self.ready:
+                if self.orphans:
+                    self.abandonOrphans()
+                elif exhausted:
+                    break
+        return self.report(self.clock() - started)
+
+    def loadFiles(self, files):
+        return self.load(fileOperations(files))
+
+    def report(self, seconds):
+        done = sum( [ count for name, count in self.counts.items() if name != 'retried' ] )
+        return {
+            'operations': done,
+            'seconds': round(seconds, 3),
+            'per_second': seconds and round(done / seconds, 1) or None,
+            'counts': dict(self.counts),
+            'errors': self.errors,
+        }
+
+# Load LDIF files into a server as ldapmodify -c would, but faster
+#
+def loadFiles( url, dn, password, files, connections=2, window=32, replace=False ):
+    conns = []
+    for n in range(connections):
+        conn = ldap.initialize(url)
+        conn.simple_bind_s(dn, password)
+        conns.append(conn)
+    try:
+        return PipelinedLoader(conns, window, replace).loadFiles(files)
+    finally:
+        for conn in conns:
+            conn.unbind_s()
+
+def printReport( report, stream=sys.stdout ):
+    stream.write('%d operations in %.2f seconds (%s per second)\n' %
+                 (report['operations'], report['seconds'], report['per_second']))
+    for name in sorted(report['counts']):
+        stream.write('\t%-10s %d\n' % (name, report['counts'][name]))
+    for kind, dn, error in report['errors'][:20]:
+        stream.write('%s %s: %s\n' % (kind, dn, error.args and error.args[0].get('desc') or error))
+    if len(report['errors']) > 20:
+        stream.write('... and %d more errors\n' % (len(report['errors']) - 20))
+
+def main():
+    # slapdinstance loads through this module
+    from slapdinstance import readVars
+    settings = readVars()
+    url = settings['serverurl']
+    dn = settings['manager']
+    password = settings['password']
+    connections = 2
+    window = 32
+    replace = False
+    check = False
+    quiet = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'H:D:w:n:W:rcq')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-H':
+            url = value
+        elif opt == '-D':
+            dn = value
+        elif opt == '-w':
+            password = value
+        elif opt == '-n':
+            connections = int(value)
+        elif opt == '-W':
+            window = int(value)
+        elif opt == '-r':
+            replace = True
+        elif opt == '-c':
+            check = True
+        elif opt == '-q':
+            quiet = True
+    if not args:
+        sys.stderr.write(__doc__)
+        return 2
+
+    if check:
+        import schemacheck
+        count, problems = schemacheck.checkFiles(args)
+        for filename, offset, entry_dn, message in problems:
+            sys.stdout.write('%s:%d: %s: %s\n' % (filename, offset, entry_dn, message))
+        if problems:
+            sys.stderr.write('%d schema problems: nothing loaded\n' % len(problems))
+            return 1
+
+    report = loadFiles(url, dn, password, args, connections, window, replace)
+    if not quiet or report['errors']:
+        printReport(report)
+    return report['errors'] and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
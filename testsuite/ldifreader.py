@@ -0,0 +1,340 @@
+"""Read LDIF files without copying them
+
+LdifReader maps an LDIF file into memory and yields one LdifRecord for
+each record in it, in order. A record holds only the offsets of its
+first and last bytes and its DN; its attribute lines are only looked at
+when asked for, and base64 values (such as the jpegPhoto values in the
+sample data) stay encoded until they are used:
+
+	for record in LdifReader('mozillians-sample-data.ldif'):
+	    if record.changetype == 'add':
+	        conn.add_s(record.dn, record.modlist())
+
+This works for the fixtures and devslapd files, for generated DITs and
+for slapcat output alike: comments, folded lines, 'version: 1', dn::
+and base64 values, and file:// URLs (attr:< file:///path) are all
+understood. Content records (no changetype line) have changetype 'add'.
+Change records can be
+
+	add		entry() and modlist() give the attributes
+	delete		nothing more
+	modify		changes() gives a python-ldap modlist of
+			(MOD_ADD/MOD_DELETE/MOD_REPLACE, attr, values)
+	modrdn, moddn	rename() gives (newrdn, deleteoldrdn, newsuperior)
+
+'control:' lines are skipped.
+
+entry() returns { attr: [values] } with the attribute names as first
+written. Values are strings, except that the base64 values of the
+attributes named in 'lazy' are returned as Base64Value objects:
+encoded() gives the base64 text as a buffer onto the mapped file
+(without copying it, unless the line was folded) and decode() gives a
+memoryview of the decoded bytes. str() of one gives the decoded bytes.
+
+Records and values refer to the mapping, so they stay usable for as
+long as the reader is open. boundaries(n) splits the file into n runs of
+whole records that records(start, stop) reads, so that several
+processes can share a big file.
+"""
+
+import os
+import re
+import mmap
+import binascii
+import urllib
+
+# One or more empty lines end a record
+separator_re = re.compile(r'\r?\n(?:\r?\n)+')
+
+# python-ldap's modify operations, by the name used in LDIF
+modify_ops = { 'add': 0, 'delete': 1, 'replace': 2 }
+
+class LdifError(ValueError):
+    pass
+
+########################################################################
+# Values
+########################################################################
+
+# A base64 value, as the offsets of its pieces in the file
+#
+class Base64Value:
+    __slots__ = ('data', 'spans')
+
+    def __init__(self, data, spans):
+        self.data = data
+        self.spans = spans
+
+    # The base64 text
+    #
+    def encoded(self):
+        if len(self.spans) == 1:
+            start, end = self.spans[0]
+            return buffer(self.data, start, end - start)
+        return ''.join( [ self.data[start:end] for start, end in self.spans ] )
+
+    def decode(self):
+        try:
+            return memoryview(binascii.a2b_base64(self.encoded()))
+        except binascii.Error, e:
+            raise LdifError('bad base64 value: %s' % e)
+
+    def __str__(self):
+        return self.decode().tobytes()
+
+    def __len__(self):
+        return len(self.decode())
+
+    def __repr__(self):
+        return '<Base64Value of %d characters>' % sum( [ end - start for start, end in self.spans ] )
+
+########################################################################
+# Records
+########################################################################
+
+class LdifRecord:
+    __slots__ = ('data', 'start', 'end', 'dn', 'changetype', 'body')
+
+    def __init__(self, data, start, end, dn, changetype, body):
+        self.data = data
+        self.start = start
+        self.end = end
+        self.dn = dn
+        self.changetype = changetype
+        # Where the lines after dn: and changetype: start
+        self.body = body
+
+    # The logical lines after the DN and changetype, as
+    # (attribute, kind, spans) where kind is ':', '::' or ':<'
+    #
+    def lines(self):
+        return logicalLines(self.data, self.body, self.end)
+
+    def value(self, kind, spans, lazy=False):
+        return lineValue(self.data, kind, spans, lazy)
+
+    # The attributes of an add record as { attr: [values] }.
+    # Base64 values of attributes in lazy (lower case) stay encoded.
+    #
+    def entry(self, lazy=frozenset()):
+        if self.changetype != 'add':
+            raise LdifError('%s: not an add record (changetype %s)' % (self.dn, self.changetype))
+        attrs = {}
+        names = {}
+        for attr, kind, spans in self.lines():
+            key = attr.lower()
+            if key == 'control':
+                continue
+            name = names.setdefault(key, attr)
+            attrs.setdefault(name, []).append(self.value(kind, spans, key in lazy))
+        return attrs
+
+    # The entry as a modlist for add_s()
+    #
+    def modlist(self):
+        return self.entry().items()
+
+    # The changes of a modify record as a python-ldap modlist
+    #
+    def changes(self):
+        if self.changetype != 'modify':
+            raise LdifError('%s: not a modify record (changetype %s)' % (self.dn, self.changetype))
+        modlist = []
+        current = None
+        for attr, kind, spans in self.lines():
+            key = attr.lower()
+            if attr == '-':
+                current = None
+            elif current is None:
+                if key == 'control':
+                    continue
+                if key not in modify_ops:
+                    raise LdifError('%s: unknown modify operation %r' % (self.dn, attr))
+                current = (modify_ops[key], self.value(kind, spans), [])
+                modlist.append(current)
+            elif key != current[1].lower():
+                raise LdifError('%s: %s value in a change to %s' % (self.dn, attr, current[1]))
+            else:
+                current[2].append(self.value(kind, spans))
+        return [ (op, attr, values or None) for op, attr, values in modlist ]
+
+    # (newrdn, deleteoldrdn, newsuperior or None) of a modrdn record
+    #
+    def rename(self):
+        if self.changetype not in ('modrdn', 'moddn'):
+            raise LdifError('%s: not a modrdn record (changetype %s)' % (self.dn, self.changetype))
+        found = {}
+        for attr, kind, spans in self.lines():
+            found[attr.lower()] = self.value(kind, spans)
+        if 'newrdn' not in found:
+            raise LdifError('%s: modrdn without newrdn' % self.dn)
+        return (found['newrdn'], found.get('deleteoldrdn', '1') != '0',
+                found.get('newsuperior'))
+
+    def __repr__(self):
+        return '<LdifRecord %s %s>' % (self.changetype, self.dn)
+
+########################################################################
+# Parsing
+########################################################################
+
+# Yield (attribute, kind, spans) for each logical line between start
+# and end, joining folded lines and skipping comments
+#
+def logicalLines( data, start, end ):
+    current = None
+    comment = False
+    pos = start
+    while pos < end:
+        eol = data.find('\n', pos, end)
+        if eol < 0:
+            eol = end
+        stop = eol
+        if stop > pos and data[stop - 1] == '\r':
+            stop -= 1
+        first = data[pos] if pos < stop else ''
+        if first == ' ':
+            # A continuation of the line before, which may be a comment
+            if comment:
+                pass
+            elif current is not None:
+                current[2].append( (pos + 1, stop) )
+            else:
+                raise LdifError('continuation line with nothing to continue at offset %d' % pos)
+        elif first == '#':
+            comment = True
+        elif first:
+            comment = False
+            if current is not None:
+                yield current
+            current = splitLine(data, pos, stop)
+        pos = eol + 1
+    if current is not None:
+        yield current
+
+# Split one line into (attribute, kind, [span of the value])
+#
+def splitLine( data, start, stop ):
+    colon = data.find(':', start, stop)
+    if colon < 0:
+        if data[start:stop] == '-':
+            return ('-', ':', [])
+        raise LdifError('no colon in line at offset %d: %r' % (start, data[start:stop][:40]))
+    attr = data[start:colon]
+    kind = ':'
+    value = colon + 1
+    if value < stop and data[value] in ':<':
+        kind += data[value]
+        value += 1
+    while value < stop and data[value] == ' ':
+        value += 1
+    return (attr, kind, [ (value, stop) ])
+
+def lineValue( data, kind, spans, lazy=False ):
+    if kind == '::':
+        value = Base64Value(data, spans)
+        if lazy:
+            return value
+        return str(value)
+    text = ''.join( [ data[start:end] for start, end in spans ] )
+    if kind == ':<':
+        if not text.startswith('file://'):
+            raise LdifError('only file:// URLs are supported: %s' % text)
+        return open(urllib.url2pathname(text[len('file://'):]), 'rb').read()
+    return text
+
+
+class LdifReader:
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        if os.fstat(self.file.fileno()).st_size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # An empty file cannot be mapped
+            self.data = ''
+
+    def __iter__(self):
+        return self.records()
+
+    # The records starting at or after offset start and before stop,
+    # which should be offsets from boundaries()
+    #
+    def records(self, start=0, stop=None):
+        data = self.data
+        size = len(data)
+        if stop is None or stop > size:
+            stop = size
+        pos = start
+        while pos < stop:
+            match = separator_re.search(data, pos)
+            if match:
+                end, following = match.start(), match.end()
+            else:
+                end = following = size
+            record = self.record(pos, end, pos == 0)
+            pos = following
+            if record is not None:
+                yield record
+
+    # Offsets that divide the file into about 'parts' pieces of whole
+    # records, from 0 to the size of the file, for reading in parallel
+    #
+    def boundaries(self, parts):
+        size = len(self.data)
+        offsets = [ 0 ]
+        for n in range(1, parts):
+            match = separator_re.search(self.data, max(offsets[-1], size * n // parts))
+            if not match:
+                break
+            if match.end() > offsets[-1]:
+                offsets.append(match.end())
+        if offsets[-1] < size:
+            offsets.append(size)
+        return offsets
+
+    # Make the record between start and end, or None if it holds
+    # nothing but comments or the version line
+    #
+    def record(self, start, end, first):
+        lines = logicalLines(self.data, start, end)
+        dn = changetype = None
+        body = end
+        for attr, kind, spans in lines:
+            key = attr.lower()
+            if first and dn is None and key == 'version':
+                continue
+            if dn is None:
+                if key != 'dn':
+                    raise LdifError('%s: record at offset %d does not start with dn: %r' %
+                                    (self.filename, start, attr))
+                dn = lineValue(self.data, kind, spans)
+                body = self.after(spans, end)
+                continue
+            if key == 'control':
+                body = self.after(spans, end)
+                continue
+            if key == 'changetype':
+                changetype = lineValue(self.data, kind, spans).strip().lower()
+                body = self.after(spans, end)
+            break
+        if dn is None:
+            return None
+        return LdifRecord(self.data, start, end, dn, changetype or 'add', body)
+
+    # The offset of the line after the one that ends with spans
+    #
+    def after(self, spans, end):
+        eol = self.data.find('\n', spans[-1][1], end)
+        return eol < 0 and end or eol + 1
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+# Read the entries of a file of content records as (dn, { attr: [values] })
+#
+def readEntries( filename, lazy=frozenset() ):
+    for record in LdifReader(filename):
+        yield record.dn, record.entry(lazy)
@@ -0,0 +1,324 @@
+"""Collect slapd's cn=Monitor statistics as metrics
+
+usage: monitorscrape.py [-H url]... [-D dn] [-w password] [-i seconds]
+                        [-c count] [-m metrics.txt] [-j samples.json] [-k keep]
+
+Binds to each server as the monitor account (a member of
+cn=monitors,ou=groups,ou=system, which the monitor database's ACL lets
+read everything) and reads cn=Monitor every -i seconds (default 10),
+-c times or until interrupted. Each scrape is one subtree search that
+asks only for the entries and attributes used here, on a connection that
+stays bound, so it costs the server little.
+
+From each scrape it takes:
+
+	operations initiated and completed, for each kind of operation
+	connections: total accepted and currently open
+	threads: open, active, pending, backload and the maximum
+	waiters: connections waiting to read and to write
+	statistics: bytes, PDUs, entries and referrals sent
+	databases: entries in the hdb entry, DN and IDL caches, or
+		   the mdb map pages used and readers in use
+
+cn=Monitor does not publish cache hit ratios; the cache counts show
+how full the hdb caches are, and mdb has no cache of its own (it relies
+on the operating system's page cache), so map use is given instead.
+
+Counters are turned into rates per second between one scrape and the
+next. -m writes the latest values and rates in OpenMetrics text format
+(rewritten after each scrape, for a collector to pick up) and -j keeps
+the last -k scrapes (default 360) in a JSON file. With neither, the
+OpenMetrics text is printed.
+"""
+
+import os
+import sys
+import time
+import json
+import getopt
+import ldap
+from slapdinstance import readVars
+
+monitor_suffix = 'cn=Monitor'
+monitor_dn = 'uid=monitor,ou=accounts,ou=system,dc=mozillians,dc=org'
+
+# The entries of interest, and only the attributes we read from them
+monitor_filter = ('(|(objectClass=monitorOperation)(objectClass=monitorCounterObject)'
+                  '(objectClass=monitoredObject)(objectClass=olmBDBDatabase)'
+                  '(objectClass=olmMDBDatabase))')
+monitor_attrs = [ 'monitorOpInitiated', 'monitorOpCompleted', 'monitorCounter',
+                  'monitoredInfo', 'namingContexts',
+                  'olmBDBEntryCache', 'olmBDBDNCache', 'olmBDBIDLCache',
+                  'olmMDBPagesMax', 'olmMDBPagesUsed', 'olmMDBReadersMax',
+                  'olmMDBReadersUsed', 'olmMDBEntries' ]
+
+# The numeric thread figures; cn=State, cn=Runqueue and cn=Tasklist are text
+thread_states = ('max', 'max pending', 'open', 'starting', 'active', 'pending', 'backload')
+
+# Database attribute -> (metric, description)
+database_metrics = {
+    'olmbdbentrycache': ('slapd_db_entry_cache_entries', 'Entries in the entry cache'),
+    'olmbdbdncache': ('slapd_db_dn_cache_entries', 'Entries in the DN cache'),
+    'olmbdbidlcache': ('slapd_db_idl_cache_entries', 'Entries in the IDL cache'),
+    'olmmdbpagesmax': ('slapd_db_map_pages', 'Pages in the mdb map'),
+    'olmmdbpagesused': ('slapd_db_map_pages_used', 'Pages of the mdb map in use'),
+    'olmmdbreadersmax': ('slapd_db_readers', 'Reader slots'),
+    'olmmdbreadersused': ('slapd_db_readers_used', 'Reader slots in use'),
+    'olmmdbentries': ('slapd_db_entries', 'Entries in the database'),
+}
+
+# Metric name -> (type, description). Counters end in _total.
+metric_info = {
+    'slapd_operations_initiated_total': ('counter', 'Operations started'),
+    'slapd_operations_completed_total': ('counter', 'Operations finished'),
+    'slapd_connections_total': ('counter', 'Connections accepted'),
+    'slapd_connections_open': ('gauge', 'Connections open'),
+    'slapd_threads': ('gauge', 'Worker threads by state'),
+    'slapd_waiters': ('gauge', 'Connections waiting to read or write'),
+    'slapd_sent_total': ('counter', 'Bytes, PDUs, entries and referrals sent'),
+}
+for name, description in database_metrics.values():
+    metric_info[name] = ('gauge', description)
+
+########################################################################
+# Scraping
+########################################################################
+
+# Turn the cn=Monitor entries into { (metric name, labels): value }
+# where labels is a tuple of (label, value) pairs
+#
+def parseMonitor( entries ):
+    values = {}
+    for dn, attrs in entries:
+        lower = dict( [ (name.lower(), vals) for name, vals in attrs.items() ] )
+        rdns = [ rdn.split('=', 1)[1] for rdn in dn.split(',') ]
+        if len(rdns) != 3:
+            # Only the entries one level below the cn=Monitor children
+            continue
+        name, group = rdns[0], rdns[1].lower()
+        if group == 'operations':
+            labels = (('op', name.lower()),)
+            for attr, metric in (('monitoropinitiated', 'slapd_operations_initiated_total'),
+                                 ('monitoropcompleted', 'slapd_operations_completed_total')):
+                if attr in lower:
+                    values[(metric, labels)] = int(lower[attr][0])
+        elif group == 'connections' and 'monitorcounter' in lower:
+            if name.lower() == 'total':
+                values[('slapd_connections_total', ())] = int(lower['monitorcounter'][0])
+            elif name.lower() == 'current':
+                values[('slapd_connections_open', ())] = int(lower['monitorcounter'][0])
+        elif group == 'threads' and name.lower() in thread_states and 'monitoredinfo' in lower:
+            try:
+                values[('slapd_threads', (('state', name.lower()),))] = int(lower['monitoredinfo'][0])
+            except ValueError:
+                pass
+        elif group == 'waiters' and 'monitorcounter' in lower:
+            values[('slapd_waiters', (('type', name.lower()),))] = int(lower['monitorcounter'][0])
+        elif group == 'statistics' and 'monitorcounter' in lower:
+            values[('slapd_sent_total', (('kind', name.lower()),))] = int(lower['monitorcounter'][0])
+        elif group == 'databases':
+            suffix = lower.get('namingcontexts', [ name ])[0]
+            labels = (('database', suffix),)
+            for attr, (metric, description) in database_metrics.items():
+                if attr in lower:
+                    values[(metric, labels)] = int(lower[attr][0])
+    return values
+
+
+class Scraper:
+    def __init__(self, url, dn=monitor_dn, password='secret', base=monitor_suffix):
+        self.url = url
+        self.dn = dn
+        self.password = password
+        self.base = base
+        self.conn = None
+        self.previous = None
+
+    def connect(self):
+        conn = ldap.initialize(self.url)
+        conn.simple_bind_s(self.dn, self.password)
+        return conn
+
+    # Read cn=Monitor once. Returns { 'time', 'server', 'values', 'rates' }
+    # where rates has the per-second change of each counter since the
+    # last scrape (empty the first time).
+    #
+    def scrape(self):
+        if self.conn is None:
+            self.conn = self.connect()
+        try:
+            entries = self.conn.search_s(self.base, ldap.SCOPE_SUBTREE, monitor_filter,
+                                         monitor_attrs)
+        except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR):
+            # Reconnect once: slapd may have been restarted
+            self.conn = self.connect()
+            entries = self.conn.search_s(self.base, ldap.SCOPE_SUBTREE, monitor_filter,
+                                         monitor_attrs)
+        sample = { 'time': time.time(), 'server': self.url,
+                   'values': parseMonitor(entries), 'rates': {} }
+        if self.previous:
+            sample['rates'] = rates(self.previous, sample)
+        self.previous = sample
+        return sample
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.unbind_s()
+            except ldap.LDAPError:
+                pass
+            self.conn = None
+
+# Change per second in each counter between two samples.
+# A counter that went down means slapd restarted, so it counted from 0.
+#
+def rates( before, after ):
+    elapsed = after['time'] - before['time']
+    result = {}
+    if elapsed <= 0:
+        return result
+    for key, value in after['values'].items():
+        if not key[0].endswith('_total') or key not in before['values']:
+            continue
+        delta = value - before['values'][key]
+        if delta < 0:
+            delta = value
+        result[key] = delta / elapsed
+    return result
+
+########################################################################
+# Output
+########################################################################
+
+def labelText( labels ):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join( [ '%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"'))
+                                for name, value in labels ] )
+
+# OpenMetrics text for the latest sample from each server.
+# Rates appear as gauges named after the counter with _per_second
+# in place of _total.
+#
+def openMetrics( samples ):
+    families = {}
+    for sample in samples:
+        server = (('server', sample['server']),)
+        for (name, labels), value in sample['values'].items():
+            families.setdefault(name, []).append( (server + labels, value) )
+        for (name, labels), value in sample['rates'].items():
+            families.setdefault(name[:-len('_total')] + '_per_second', []).append(
+                (server + labels, value) )
+
+    lines = []
+    for name in sorted(families):
+        if name.endswith('_per_second'):
+            mtype = 'gauge'
+            description = 'Rate of ' + metric_info[name[:-len('_per_second')] + '_total'][1].lower()
+        else:
+            mtype, description = metric_info[name]
+        # Counter families are named without the _total suffix
+        family = mtype == 'counter' and name[:-len('_total')] or name
+        lines.append('# TYPE %s %s' % (family, mtype))
+        lines.append('# HELP %s %s' % (family, description))
+        for labels, value in sorted(families[name]):
+            if isinstance(value, float):
+                text = '%.6g' % value
+            else:
+                text = str(value)
+            lines.append('%s%s %s' % (name, labelText(labels), text))
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+# A sample as JSON: the keys become 'name{labels}' strings
+#
+def jsonSample( sample ):
+    def flatten( values ):
+        return dict( [ (name + labelText(labels), value)
+                       for (name, labels), value in values.items() ] )
+    return { 'time': round(sample['time'], 3), 'server': sample['server'],
+             'values': flatten(sample['values']), 'rates': flatten(sample['rates']) }
+
+# Write a file so that readers never see it half written
+#
+def replaceFile( filename, text ):
+    temp = filename + '.tmp'
+    out = open(temp, 'w')
+    out.write(text)
+    out.close()
+    os.rename(temp, filename)
+
+# Add samples to the rolling JSON file, keeping the last 'keep'
+#
+def appendJson( filename, samples, keep ):
+    try:
+        history = json.load(open(filename))
+    except (IOError, ValueError):
+        history = []
+    history.extend( [ jsonSample(sample) for sample in samples ] )
+    replaceFile(filename, json.dumps(history[-keep:], indent=1, sort_keys=True))
+
+def main():
+    settings = readVars()
+    urls = []
+    dn = monitor_dn
+    password = 'secret'
+    interval = 10.0
+    count = None
+    metrics_file = None
+    json_file = None
+    keep = 360
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'H:D:w:i:c:m:j:k:')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-H':
+            urls.append(value)
+        elif opt == '-D':
+            dn = value
+        elif opt == '-w':
+            password = value
+        elif opt == '-i':
+            interval = float(value)
+        elif opt == '-c':
+            count = int(value)
+        elif opt == '-m':
+            metrics_file = value
+        elif opt == '-j':
+            json_file = value
+        elif opt == '-k':
+            keep = int(value)
+
+    scrapers = [ Scraper(url, dn, password) for url in urls or [ settings['serverurl'] ] ]
+    done = 0
+    try:
+        while count is None or done < count:
+            started = time.time()
+            samples = []
+            for scraper in scrapers:
+                try:
+                    samples.append(scraper.scrape())
+                except ldap.LDAPError, e:
+                    sys.stderr.write('%s: %s\n' % (scraper.url, e))
+                    scraper.close()
+            if metrics_file:
+                replaceFile(metrics_file, openMetrics(samples))
+            if json_file:
+                appendJson(json_file, samples, keep)
+            if not metrics_file and not json_file:
+                sys.stdout.write(openMetrics(samples))
+                sys.stdout.flush()
+            done += 1
+            if count is None or done < count:
+                time.sleep(max(0, interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        pass
+    for scraper in scrapers:
+        scraper.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,372 @@
+"""Searches that keep the entries they have been sent
+
+ldap's search_s() raises SIZELIMIT_EXCEEDED when a search matches more
+entries than the server's limits allow (see the 'limits' lines in
+devslapd/slapd.conf and the Search Limits section of the design doc),
+and the entries that the server did send are thrown away with it.
+
+PagedSearch reads the results one entry at a time instead, and asks for
+them a page at a time with the Simple Paged Results control (RFC 2696)
+unless page_size is 0. Iterating over it yields each entry as it
+arrives. A limit being reached ends the iteration without an exception,
+and 'truncated' says that it happened:
+
+	search = PagedSearch(conn, people_node, ldap.SCOPE_SUBTREE, '(cn=*smith*)')
+	for dn, attrs in search:
+	    ...
+	if search.truncated:
+	    ...
+
+Every entry fetched is kept, so iterating again (or calling entries())
+replays them from memory and carries on from where the server left off.
+Adding sort=[ 'cn:caseIgnoreOrderingMatch' ] sorts on the server
+(RFC 2891); this needs the sssvlv overlay. The ordering rule has to be
+given for attributes such as cn whose schema does not define one.
+
+VirtualListView is for browsing a long sorted list a screenful at a time
+with the Virtual List View control. page(offset) returns the entries at
+that position (counting from 1), and pageAt(value) jumps to the first
+entry that sorts at or after value. Windows already fetched are
+remembered, so moving back and forth does not ask the server again
+until refresh() is called.
+
+The sort and VLV controls are encoded here because not all python-ldap
+2.4 releases provide them.
+"""
+
+import ldap
+import ldap.controls
+from ldapresult import ResultEntry
+
+# Result codes that end a search early but leave the entries already sent valid
+limit_errors = (ldap.SIZELIMIT_EXCEEDED, ldap.ADMINLIMIT_EXCEEDED, ldap.TIMELIMIT_EXCEEDED)
+
+########################################################################
+# BER encoding for the controls
+########################################################################
+
+def berLength( n ):
+    if n < 0x80:
+        return chr(n)
+    octets = ''
+    while n:
+        octets = chr(n & 0xff) + octets
+        n >>= 8
+    return chr(0x80 | len(octets)) + octets
+
+def ber( tag, content ):
+    return chr(tag) + berLength(len(content)) + content
+
+def berInteger( n, tag=0x02 ):
+    octets = ''
+    while True:
+        octets = chr(n & 0xff) + octets
+        n >>= 8
+        if (n == 0 and not ord(octets[0]) & 0x80) or (n == -1 and ord(octets[0]) & 0x80):
+            break
+    return ber(tag, octets)
+
+# Split encoded content into a list of (tag, content)
+#
+def berItems( data ):
+    items = []
+    pos = 0
+    while pos < len(data):
+        tag = ord(data[pos])
+        length = ord(data[pos + 1])
+        pos += 2
+        if length & 0x80:
+            count = length & 0x7f
+            length = 0
+            for c in data[pos:pos + count]:
+                length = (length << 8) | ord(c)
+            pos += count
+        items.append( (tag, data[pos:pos + length]) )
+        pos += length
+    return items
+
+def berDecodeInteger( octets ):
+    n = 0
+    for c in octets:
+        n = (n << 8) | ord(c)
+    if octets and ord(octets[0]) & 0x80:
+        n -= 1 << (8 * len(octets))
+    return n
+
+# The contents of the SEQUENCE that a control value consists of
+#
+def berSequence( encoded ):
+    items = berItems(encoded)
+    if len(items) != 1 or items[0][0] != 0x30:
+        raise ValueError('control value is not a SEQUENCE')
+    return berItems(items[0][1])
+
+########################################################################
+# Controls
+########################################################################
+
+# Server side sorting request (RFC 2891).
+# keys are attribute names, with - in front to reverse the order and
+# :rule after to name an ordering rule, e.g. [ '-cn:caseIgnoreOrderingMatch' ]
+#
+class SortRequestControl(ldap.controls.RequestControl):
+    controlType = '1.2.840.113556.1.4.473'
+
+    def __init__(self, keys, criticality=True):
+        ldap.controls.RequestControl.__init__(self, self.controlType, criticality)
+        self.keys = keys
+
+    def encodeControlValue(self):
+        encoded = ''
+        for key in self.keys:
+            reverse = key.startswith('-')
+            attr = key.lstrip('-')
+            rule = None
+            if ':' in attr:
+                attr, rule = attr.split(':', 1)
+            item = ber(0x04, attr)
+            if rule:
+                item += ber(0x80, rule)
+            if reverse:
+                item += ber(0x81, '\xff')
+            encoded += ber(0x30, item)
+        return ber(0x30, encoded)
+
+
+class SortResponseControl(ldap.controls.ResponseControl):
+    controlType = '1.2.840.113556.1.4.474'
+
+    def decodeControlValue(self, encodedControlValue):
+        items = berSequence(encodedControlValue)
+        self.result = berDecodeInteger(items[0][1])
+        self.attributeType = len(items) > 1 and items[1][1] or None
+
+
+# Virtual List View request.
+# Either offset/count or value gives the target entry; before and after
+# say how many entries around it are wanted.
+#
+class VLVRequestControl(ldap.controls.RequestControl):
+    controlType = '2.16.840.1.113730.3.4.9'
+
+    def __init__(self, before=0, after=0, offset=None, count=0, value=None,
+                 context_id=None, criticality=True):
+        ldap.controls.RequestControl.__init__(self, self.controlType, criticality)
+        self.before = before
+        self.after = after
+        self.offset = offset
+        self.count = count
+        self.value = value
+        self.context_id = context_id
+
+    def encodeControlValue(self):
+        encoded = berInteger(self.before) + berInteger(self.after)
+        if self.value is not None:
+            encoded += ber(0x81, self.value)
+        else:
+            encoded += ber(0xa0, berInteger(self.offset) + berInteger(self.count))
+        if self.context_id:
+            encoded += ber(0x04, self.context_id)
+        return ber(0x30, encoded)
+
+
+class VLVResponseControl(ldap.controls.ResponseControl):
+    controlType = '2.16.840.1.113730.3.4.10'
+
+    def decodeControlValue(self, encodedControlValue):
+        items = berSequence(encodedControlValue)
+        self.targetPosition = berDecodeInteger(items[0][1])
+        self.contentCount = berDecodeInteger(items[1][1])
+        self.result = berDecodeInteger(items[2][1])
+        self.contextID = len(items) > 3 and items[3][1] or None
+
+
+for control in (SortResponseControl, VLVResponseControl):
+    ldap.controls.KNOWN_RESPONSE_CONTROLS[control.controlType] = control
+
+def findControl( controls, controlType ):
+    for control in controls or []:
+        if control.controlType == controlType:
+            return control
+    return None
+
+########################################################################
+# Reading results
+########################################################################
+
+# Read the results of one search request a message at a time.
+# Yields ('entry', ResultEntry) for each entry and finally ('done', controls)
+# or ('truncated', exception) if a limit was reached.
+#
+def readResults( conn, msgid, timeout=-1 ):
+    while True:
+        try:
+            rtype, rdata, rmsgid, controls = conn.result3(msgid, 0, timeout)
+        except limit_errors, e:
+            yield 'truncated', e
+            return
+        if rtype == ldap.RES_SEARCH_ENTRY:
+            for dn, attrs in rdata:
+                yield 'entry', ResultEntry(dn, attrs)
+        elif rtype == ldap.RES_SEARCH_RESULT:
+            yield 'done', controls
+            return
+
+
+class PagedSearch:
+    def __init__(self, conn, base, scope=ldap.SCOPE_SUBTREE, filterstr='(objectClass=*)',
+                 attrlist=None, page_size=10, sort=None, serverctrls=None, timeout=-1):
+        self.conn = conn
+        self.base = base
+        self.scope = scope
+        self.filterstr = filterstr
+        self.attrlist = attrlist
+        self.page_size = page_size
+        self.sort = sort
+        self.serverctrls = serverctrls or []
+        self.timeout = timeout
+
+        self.fetched = []
+        self.cookie = ''
+        self.results = None
+        self.msgid = None
+        self.pages = 0
+        self.done = False
+        self.truncated = False
+        self.error = None
+
+    def __iter__(self):
+        n = 0
+        while True:
+            if n < len(self.fetched):
+                yield self.fetched[n]
+                n += 1
+            elif not self.fetchMore():
+                return
+
+    # All the entries the search returns
+    #
+    def entries(self):
+        return list(self)
+
+    def startPage(self):
+        controls = list(self.serverctrls)
+        if self.page_size:
+            controls.append(ldap.controls.SimplePagedResultsControl(True, size=self.page_size,
+                                                                    cookie=self.cookie))
+        if self.sort:
+            controls.append(SortRequestControl(self.sort))
+        self.msgid = self.conn.search_ext(self.base, self.scope, self.filterstr, self.attrlist,
+                                          serverctrls=controls)
+        self.results = readResults(self.conn, self.msgid, self.timeout)
+
+    # Read at least one more entry from the server.
+    # Returns False when the search has finished.
+    #
+    def fetchMore(self):
+        while not self.done:
+            if self.results is None:
+                self.startPage()
+            for kind, value in self.results:
+                if kind == 'entry':
+                    self.fetched.append(value)
+                    return True
+                self.results = None
+                self.msgid = None
+                self.pages += 1
+                if kind == 'truncated':
+                    self.done = True
+                    self.truncated = True
+                    self.error = value
+                else:
+                    control = findControl(value, ldap.controls.SimplePagedResultsControl.controlType)
+                    if self.page_size and control and control.cookie:
+                        self.cookie = control.cookie
+                    else:
+                        self.done = True
+                break
+        return False
+
+    # Stop the search early
+    #
+    def abandon(self):
+        if self.msgid is not None:
+            self.conn.abandon(self.msgid)
+        self.msgid = None
+        self.results = None
+        self.done = True
+
+
+class VirtualListView:
+    def __init__(self, conn, base, scope=ldap.SCOPE_SUBTREE, filterstr='(objectClass=*)',
+                 attrlist=None, sort=('cn:caseIgnoreOrderingMatch',), page_size=15, timeout=-1):
+        self.conn = conn
+        self.base = base
+        self.scope = scope
+        self.filterstr = filterstr
+        self.attrlist = attrlist
+        self.sort = list(sort)
+        self.page_size = page_size
+        self.timeout = timeout
+        self.refresh()
+
+    # Forget everything fetched so far
+    #
+    def refresh(self):
+        self.windows = {}
+        self.content_count = 0
+        self.context_id = None
+        self.truncated = False
+
+    def fetch(self, vlv):
+        controls = [ SortRequestControl(self.sort), vlv ]
+        msgid = self.conn.search_ext(self.base, self.scope, self.filterstr, self.attrlist,
+                                     serverctrls=controls)
+        entries = []
+        position = None
+        for kind, value in readResults(self.conn, msgid, self.timeout):
+            if kind == 'entry':
+                entries.append(value)
+            elif kind == 'truncated':
+                self.truncated = True
+            else:
+                control = findControl(value, VLVResponseControl.controlType)
+                if control:
+                    self.content_count = control.contentCount
+                    self.context_id = control.contextID
+                    position = control.targetPosition
+        return position, entries
+
+    # The page_size entries starting at offset (the first entry is 1)
+    #
+    def page(self, offset):
+        offset = max(1, offset)
+        if offset not in self.windows:
+            position, entries = self.fetch(VLVRequestControl(0, self.page_size - 1, offset,
+                                                             self.content_count, None,
+                                                             self.context_id))
+            self.windows[offset] = entries
+        return self.windows[offset]
+
+    # The page starting at the first entry that sorts at or after value.
+    # Returns (offset, entries).
+    #
+    def pageAt(self, value):
+        position, entries = self.fetch(VLVRequestControl(0, self.page_size - 1, value=value,
+                                                         context_id=self.context_id))
+        if position is not None:
+            self.windows.setdefault(position, entries)
+        return position, entries
+
+    # Every page in turn
+    #
+    def pages(self):
+        offset = 1
+        while True:
+            entries = self.page(offset)
+            if not entries:
+                return
+            yield offset, entries
+            offset += len(entries)
+            if self.content_count and offset > self.content_count:
+                return
@@ -0,0 +1,207 @@
+"""Find out which ACL clauses cost the most
+
+usage: profile-acls.py [-n clients] [-t seconds] [-p port] [-m mode] [-k]
+
+The ACLs in devslapd/slapd.conf.acls are evaluated for every attribute of
+every entry that a search returns, and the set= clauses make slapd fetch
+more entries internally each time. This runs the ldapbench workload
+against a private server once with the ACLs as they are, and then again
+for each 'access to' block with that block changed:
+
+	-m remove	the block is left out altogether
+	-m rewrite	set="..." clauses in the block become 'users', which
+			grants the same access without evaluating the set
+	-m both		(default) rewrite blocks that have set= clauses,
+			remove the others
+
+The difference in slapd CPU time per operation and in median latency
+is reported as the cost of the block, most expensive first. Changing
+the ACLs changes what the workload can see, so treat small numbers with
+suspicion and use a longer run (-t) if the ranking is unstable.
+
+Every variant runs on a fresh copy of a database loaded with the usual
+test data, so runs do not disturb each other or the development server.
+"""
+
+import os
+import re
+import sys
+import shutil
+import getopt
+import tempfile
+from slapdinstance import SlapdInstance, devslapd_dir
+import ldapbench
+
+acl_file = os.path.join(devslapd_dir, 'slapd.conf.acls')
+
+########################################################################
+# Taking the ACL file apart
+########################################################################
+
+# Split the ACL file into statements.
+# A statement is a line starting in column 1 plus any following lines
+# that start with white space (the slapd.conf continuation rule).
+# Returns a list of (first line number, [lines]).
+#
+def statements( lines ):
+    result = []
+    for number, line in enumerate(lines):
+        if line[:1] in (' ', '\t') and result and line.strip():
+            result[-1][1].append(line)
+        else:
+            result.append( (number + 1, [ line ]) )
+    return result
+
+def isAccess( lines ):
+    return lines[0].split()[:1] == [ 'access' ]
+
+def hasSet( lines ):
+    return [ line for line in lines if 'set="' in line ]
+
+# One-line description of an access block
+#
+def describe( lines ):
+    return ' '.join(lines[0].split())
+
+# Build the variants to try: (description, kind, line number, text)
+#
+def variants( mode ):
+    lines = open(acl_file).readlines()
+    parts = statements(lines)
+    result = []
+    for index, (number, block) in enumerate(parts):
+        if not isAccess(block):
+            continue
+        if mode == 'rewrite' or (mode == 'both' and hasSet(block)):
+            if not hasSet(block):
+                continue
+            changed = [ re.sub(r'set="[^"]*"', 'users', line) for line in block ]
+            kind = 'rewrite'
+        else:
+            changed = []
+            kind = 'remove'
+        text = ''.join( [ ''.join(b) for n, b in parts[:index] ] + changed +
+                        [ ''.join(b) for n, b in parts[index + 1:] ] )
+        result.append( (describe(block), kind, number, text) )
+    return result
+
+########################################################################
+# Measuring
+########################################################################
+
+# CPU seconds used so far by a process (Linux only)
+#
+def cpuTime( pid ):
+    try:
+        fields = open('/proc/%d/stat' % pid).read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+    except (IOError, IndexError, ValueError):
+        return None
+
+# Run the workload against a copy of the loaded database using the given ACLs
+#
+def measure( workdir, port, template, acl_text, clients, duration ):
+    os.makedirs(workdir)
+    acl_copy = os.path.join(workdir, 'slapd.conf.acls')
+    open(acl_copy, 'w').write(acl_text)
+
+    server = SlapdInstance(workdir, port, acl_file=acl_copy)
+    shutil.copytree(template.dbdir, server.dbdir)
+    server.start()
+    try:
+        cpu_before = cpuTime(server.pid())
+        summary = ldapbench.runBenchmark(server.url, clients, duration,
+                                         rootDN=server.rootDN, rootPW=server.rootPW)
+        cpu_after = cpuTime(server.pid())
+    finally:
+        server.stop()
+
+    overall = summary['results'].get('all', {})
+    ops = overall.get('count', 0)
+    cpu = None
+    if cpu_before is not None and cpu_after is not None and ops:
+        cpu = (cpu_after - cpu_before) * 1000.0 / ops
+    return {
+        'ops_per_sec': overall.get('ops_per_sec', 0),
+        'p50_ms': overall.get('p50_ms'),
+        'errors': overall.get('errors', 0),
+        'cpu_ms_per_op': cpu,
+    }
+
+def difference( base, value ):
+    if base is None or value is None:
+        return None
+    return base - value
+
+def fmt( value, width=9 ):
+    if value is None:
+        return '%*s' % (width, '-')
+    return '%*.3f' % (width, value)
+
+def main():
+    clients = 8
+    duration = 10
+    port = 1450
+    mode = 'both'
+    keep = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'n:t:p:m:k')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-n':
+            clients = int(value)
+        elif opt == '-t':
+            duration = float(value)
+        elif opt == '-p':
+            port = int(value)
+        elif opt == '-m':
+            mode = value
+        elif opt == '-k':
+            keep = True
+    if mode not in ('remove', 'rewrite', 'both'):
+        sys.stderr.write('unknown mode %s\n%s' % (mode, __doc__))
+        return 2
+
+    topdir = tempfile.mkdtemp(prefix='acl-profile-')
+    try:
+        # Load the test data once and copy the database for each run
+        template = SlapdInstance(os.path.join(topdir, 'template'), port)
+        template.start()
+        template.load()
+        template.stop()
+
+        sys.stderr.write('Measuring the unchanged ACLs\n')
+        baseline = measure(os.path.join(topdir, 'baseline'), port, template,
+                           open(acl_file).read(), clients, duration)
+
+        rows = []
+        for n, (description, kind, number, text) in enumerate(variants(mode)):
+            sys.stderr.write('Measuring line %d (%s): %s\n' % (number, kind, description))
+            result = measure(os.path.join(topdir, 'variant-%d' % n), port, template,
+                             text, clients, duration)
+            rows.append( (difference(baseline['cpu_ms_per_op'], result['cpu_ms_per_op']),
+                          difference(baseline['p50_ms'], result['p50_ms']),
+                          number, kind, description, result) )
+    finally:
+        if not keep:
+            shutil.rmtree(topdir, True)
+
+    print 'Baseline: %.1f ops/sec, p50 %s ms, %s CPU ms/op, %d errors' % (
+        baseline['ops_per_sec'], fmt(baseline['p50_ms'], 0),
+        fmt(baseline['cpu_ms_per_op'], 0), baseline['errors'])
+    print
+    print '%4s %5s %-8s %9s %9s %9s %6s  %s' % ('rank', 'line', 'change', 'cpu cost',
+                                               'p50 cost', 'ops/sec', 'errors', 'access block')
+    rows.sort(key=lambda row: (row[0] is None, -(row[0] or 0), -(row[1] or 0)))
+    for rank, (cpu_cost, latency_cost, number, kind, description, result) in enumerate(rows):
+        print '%4d %5d %-8s %s %s %9.1f %6d  %s' % (rank + 1, number, kind,
+                                                  fmt(cpu_cost), fmt(latency_cost),
+                                                  result['ops_per_sec'], result['errors'],
+                                                  description)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,425 @@
+"""A copy of the people, tags and tables subtrees kept in the process
+
+Most of what the site reads from LDAP changes rarely: profiles, tags and
+the text tables. LocalReplica follows those subtrees with the Content
+Synchronization operation (RFC 4533, the one slapd's syncrepl consumers
+use) in refreshAndPersist mode, bound as the replicator account, and
+keeps them in a ditmodel.DIT with the same indexes as the server. Reads
+are then answered from memory:
+
+	replica = LocalReplica('ldap://localhost:1389/', statefile='replica.state')
+	replica.start()
+	replica.wait(30)
+	replica.search(people_node, ldap.SCOPE_SUBTREE, '(uid=gerv)')
+
+Each subtree has its own connection and background thread. The first
+time, the server sends every entry (the refresh phase) and then keeps
+the connection open and sends each change as it is made (the persist
+phase). wait() returns once all of the subtrees have been refreshed.
+
+With a statefile the entries and the synchronization cookies are saved
+there after the refresh and then at most every save_interval seconds
+while changes arrive, and when the replica stops. A restart loads the
+file and gives the cookies back to the server, which then sends only
+what changed in the meantime (and the entryUUIDs of the rest, so that
+entries deleted meanwhile can be dropped).
+
+If the connection fails the thread reconnects every retry seconds and
+carries on from its cookie; the last error for each subtree is kept in
+'errors'. Reads go on being answered from the copy in the meantime,
+which may then be out of date.
+
+The replicator can read everything, including things that most users
+cannot. userPassword is never kept. Reads made with a requester DN are
+filtered through aclengine.AclPolicy as slapd would filter them (a search
+filter cannot test attributes the requester may not search), but the
+policy can only see the replicated subtrees: group and set clauses that
+refer to entries elsewhere (such as the groups in ou=system) do not
+match. Without a requester the caller is trusted to show only what the
+user may see.
+
+memberOf arrives from the server with the entries, so the DIT does not
+compute it.
+
+Other indexes can be kept up to date from the same changes with
+addListener() (uniqueness.UniquenessIndex does this).
+"""
+
+import os
+import time
+import cPickle
+import threading
+import ldap
+from ldap.ldapobject import SimpleLDAPObject
+from ldap.syncrepl import SyncreplConsumer
+from ldapfilter import normaliseDN, splitDN, parseFilter
+from ditmodel import DIT, NoSuchObject, parentDN, attrName
+from aclengine import AclPolicy
+
+people_node = 'ou=people,dc=mozillians,dc=org'
+tags_node = 'ou=tags,dc=mozillians,dc=org'
+tables_node = 'ou=tables,dc=mozillians,dc=org'
+replicated_subtrees = [ people_node, tags_node, tables_node ]
+
+# The replication account from ../migrations/02-accounts.ldif-dist
+replicator_dn = 'uid=replicator,ou=accounts,ou=system,dc=mozillians,dc=org'
+
+# The user attributes, and memberOf which the overlay keeps
+replicated_attrs = [ '*', 'memberOf' ]
+# Attributes that are not kept, in lower case
+private_attrs = frozenset([ 'userpassword' ])
+
+# Bumped when the layout of the state file changes
+state_version = 1
+
+# The entries beneath (and including) ndn, parents before children
+#
+def subtreeOf( dit, ndn ):
+    found = dit.walk(ndn, ldap.SCOPE_SUBTREE)
+    found.sort(key=lambda dn: dn.count(','))
+    return found
+
+########################################################################
+# The connections
+########################################################################
+
+# One synchronized subtree. The callbacks are made by syncrepl_poll()
+# as messages arrive and are passed on to the replica.
+#
+class SubtreeSync(SimpleLDAPObject, SyncreplConsumer):
+    def __init__(self, replica, base, url):
+        SimpleLDAPObject.__init__(self, url)
+        self.replica = replica
+        self.base = base
+
+    def syncrepl_get_cookie(self):
+        return self.replica.cookies.get(self.base)
+
+    def syncrepl_set_cookie(self, cookie):
+        self.replica.setCookie(self.base, cookie)
+
+    def syncrepl_entry(self, dn, attrs, uuid):
+        self.replica.entryChanged(self.base, dn, attrs, uuid)
+
+    def syncrepl_delete(self, uuids):
+        self.replica.entriesDeleted(uuids)
+
+    def syncrepl_present(self, uuids, refreshDeletes=False):
+        self.replica.entriesPresent(self.base, uuids, refreshDeletes)
+
+    def syncrepl_refreshdone(self):
+        self.replica.refreshDone(self.base)
+
+########################################################################
+# The replica
+########################################################################
+
+class LocalReplica:
+    def __init__(self, url, dn=replicator_dn, password='secret', bases=replicated_subtrees,
+                 statefile=None, save_interval=30, retry=5, policy=None, clock=time.time):
+        self.url = url
+        self.dn = dn
+        self.password = password
+        self.bases = list(bases)
+        self.statefile = statefile
+        self.save_interval = save_interval
+        self.retry = retry
+        self.policy = policy
+        self.clock = clock
+
+        self.lock = threading.RLock()
+        self.dit = DIT(None, False)
+        self.uuids = {}
+        self.ndns = {}
+        self.cookies = {}
+        self.present = dict( [ (base, set()) for base in self.bases ] )
+        self.refreshed = set()
+        self.ready = threading.Event()
+        self.changes = 0
+        self.saved = clock()
+        self.stopping = threading.Event()
+        self.threads = []
+        self.errors = {}
+        # Told of each change: see addListener()
+        self.listeners = []
+        if statefile:
+            self.load()
+
+    ####################################################################
+    # Following the server
+    ####################################################################
+
+    def connect(self, base):
+        conn = SubtreeSync(self, base, self.url)
+        conn.simple_bind_s(self.dn, self.password)
+        return conn
+
+    # Follow one subtree until stop() is called
+    #
+    def follow(self, base):
+        while not self.stopping.isSet():
+            conn = None
+            try:
+                conn = self.connect(base)
+                self.refreshStarted(base)
+                msgid = conn.syncrepl_search(base, ldap.SCOPE_SUBTREE, mode='refreshAndPersist',
+                                             attrlist=replicated_attrs)
+                while not self.stopping.isSet():
+                    try:
+                        if not conn.syncrepl_poll(msgid=msgid, timeout=1, all=0):
+                            break
+                    except ldap.TIMEOUT:
+                        pass
+                    self.saveIfDue()
+            except ldap.LDAPError, e:
+                # Kept for the caller to see; the thread carries on trying
+                self.errors[base] = e
+            if conn is not None:
+                try:
+                    conn.unbind_s()
+                except ldap.LDAPError:
+                    pass
+            self.stopping.wait(self.retry)
+
+    def start(self):
+        for base in self.bases:
+            thread = threading.Thread(target=self.follow, args=(base,),
+                                      name='replica ' + base)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Wait until every subtree has been refreshed. Returns False on timeout.
+    #
+    def wait(self, timeout=None):
+        self.ready.wait(timeout)
+        return self.ready.isSet()
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.statefile:
+            self.save()
+
+    ####################################################################
+    # Applying changes
+    ####################################################################
+
+    # A new synchronization search is being made: any entryUUIDs listed
+    # by an earlier one are out of date
+    #
+    def refreshStarted(self, base):
+        with self.lock:
+            self.present[base] = set()
+
+    def setCookie(self, base, cookie):
+        with self.lock:
+            self.cookies[base] = cookie
+
+    # An entry was added or changed (the server sends all of it), or
+    # renamed, which the entryUUID shows
+    #
+    def entryChanged(self, base, dn, attrs, uuid):
+        attrs = dict( [ (name, values) for name, values in attrs.items()
+                        if name.lower() not in private_attrs ] )
+        ndn = normaliseDN(dn)
+        with self.lock:
+            self.present[base].add(uuid)
+            old = self.uuids.get(uuid)
+            if old is not None and old != ndn:
+                self.moveSubtree(old, dn)
+            entry = self.dit.entries.get(ndn)
+            if entry is None:
+                self.dit.add(dn, attrs)
+            else:
+                modlist = [ (2, name, values) for name, values in attrs.items() ]
+                keys = set( [ name.lower() for name in attrs ] )
+                modlist.extend( [ (2, attrName(key), []) for key in entry.attrs
+                                  if key not in keys ] )
+                self.dit.modify(dn, modlist)
+            self.uuids[uuid] = ndn
+            self.ndns[ndn] = uuid
+            self.changes += 1
+            for listener in self.listeners:
+                listener.entryChanged(dn, attrs)
+
+    # Give the entries beneath old their new DNs as well
+    #
+    def moveSubtree(self, old, dn):
+        depth = len(splitDN(old))
+        moved = []
+        for ndn in subtreeOf(self.dit, old):
+            entry = self.dit.entries[ndn]
+            rdns = splitDN(entry.dn)[:-depth]
+            moved.append( (','.join(rdns + [ dn ]), entry.asDict(), self.ndns.get(ndn)) )
+        self.removeSubtree(old)
+        for newdn, attrs, uuid in moved:
+            self.dit.add(newdn, attrs)
+            for listener in self.listeners:
+                listener.entryChanged(newdn, attrs)
+            if uuid is not None:
+                self.uuids[uuid] = normaliseDN(newdn)
+                self.ndns[normaliseDN(newdn)] = uuid
+
+    # Remove an entry and anything beneath it, children first
+    #
+    def removeSubtree(self, ndn):
+        for child in reversed(subtreeOf(self.dit, ndn)):
+            self.dit.delete(child)
+            uuid = self.ndns.pop(child, None)
+            if uuid is not None:
+                self.uuids.pop(uuid, None)
+            for listener in self.listeners:
+                listener.entryRemoved(child)
+
+    # Call listener.entryChanged(dn, attrs) for each entry now held and
+    # then for each one added or changed, and listener.entryRemoved(ndn)
+    # for each one that goes. They are called with the lock held.
+    #
+    def addListener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+            for entry in self.dit.entries.values():
+                listener.entryChanged(entry.dn, entry.asDict())
+
+    def entriesDeleted(self, uuids):
+        with self.lock:
+            for uuid in uuids:
+                ndn = self.uuids.get(uuid)
+                if ndn is not None and ndn in self.dit.entries:
+                    self.removeSubtree(ndn)
+                self.uuids.pop(uuid, None)
+            self.changes += 1
+
+    # During a refresh the server lists the entryUUIDs of the entries
+    # that are unchanged. At the end of that (uuids None) anything it
+    # did not list has gone, unless the server sent the deletes itself.
+    #
+    def entriesPresent(self, base, uuids, refreshDeletes=False):
+        with self.lock:
+            if uuids is not None:
+                self.present[base].update(uuids)
+                return
+            if not refreshDeletes:
+                nbase = normaliseDN(base)
+                gone = [ uuid for uuid, ndn in self.uuids.items()
+                         if self.dit.inScope(ndn, nbase, ldap.SCOPE_SUBTREE)
+                         and uuid not in self.present[base] ]
+                self.entriesDeleted(gone)
+            self.present[base] = set()
+
+    def refreshDone(self, base):
+        with self.lock:
+            self.refreshed.add(base)
+            if self.refreshed.issuperset(self.bases):
+                self.ready.set()
+        if self.statefile:
+            self.save()
+
+    ####################################################################
+    # The state file
+    ####################################################################
+
+    def save(self):
+        with self.lock:
+            entries = [ (self.ndns.get(ndn), self.dit.entries[ndn].dn, self.dit.entries[ndn].asDict())
+                        for base in self.bases
+                        for ndn in subtreeOf(self.dit, normaliseDN(base))
+                        if ndn in self.dit.entries ]
+            state = { 'version': state_version, 'url': self.url,
+                      'cookies': dict(self.cookies), 'entries': entries }
+            self.changes = 0
+            self.saved = self.clock()
+        temp = self.statefile + '.tmp'
+        out = open(temp, 'wb')
+        cPickle.dump(state, out, cPickle.HIGHEST_PROTOCOL)
+        out.close()
+        os.rename(temp, self.statefile)
+
+    def saveIfDue(self):
+        if (self.statefile and self.changes and
+            self.clock() - self.saved >= self.save_interval):
+            self.save()
+
+    # Start from the saved copy, if it was made from the same server.
+    # Anything else means a full refresh.
+    #
+    def load(self):
+        try:
+            state = cPickle.load(open(self.statefile, 'rb'))
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return False
+        if state.get('version') != state_version or state.get('url') != self.url:
+            return False
+        with self.lock:
+            for uuid, dn, attrs in state['entries']:
+                entry = self.dit.add(dn, attrs)
+                if uuid is not None:
+                    self.uuids[uuid] = entry.ndn
+                    self.ndns[entry.ndn] = uuid
+            self.cookies = dict( [ (base, cookie) for base, cookie in state['cookies'].items()
+                                   if base in self.bases ] )
+        return True
+
+    ####################################################################
+    # Reading
+    ####################################################################
+
+    def attributes(self, entry, attrlist, requester):
+        if requester is None:
+            return entry.asDict(attrlist)
+        if self.policy is None:
+            self.policy = AclPolicy()
+        attrs = self.policy.visible(self.dit, requester, entry.dn)
+        if attrs is None or attrlist is None or '*' in attrlist:
+            return attrs
+        wanted = set( [ name.lower() for name in attrlist ] )
+        return dict( [ (name, values) for name, values in attrs.items()
+                       if name.lower() in wanted ] )
+
+    # One entry's attributes, or None if it is not in the replica
+    # (or requester may not read it)
+    #
+    def get(self, dn, attrlist=None, requester=None):
+        with self.lock:
+            entry = self.dit.get(dn)
+            if entry is None:
+                return None
+            return self.attributes(entry, attrlist, requester)
+
+    # Would the ACLs let requester make this modify, going by the
+    # entries in the replica? (see aclengine.AclPolicy.canModify)
+    #
+    def canModify(self, requester, dn, modlist):
+        with self.lock:
+            if self.policy is None:
+                self.policy = AclPolicy()
+            return self.policy.canModify(self.dit, requester, dn, modlist)
+
+    # Search like search_s. Raises ldap.NO_SUCH_OBJECT if base is not
+    # in the replica. For a requester, the filter only matches through
+    # attributes they may search, as in slapd.
+    #
+    def search(self, base, scope, filterstr='(objectClass=*)', attrlist=None, requester=None):
+        f = parseFilter(filterstr)
+        with self.lock:
+            try:
+                found = self.dit.search(base, scope, f)
+            except NoSuchObject:
+                raise ldap.NO_SUCH_OBJECT({ 'desc': 'No such object', 'matched': parentDN(base) })
+            if requester is not None:
+                if self.policy is None:
+                    self.policy = AclPolicy()
+                found = [ entry for entry in found
+                          if self.policy.filterMatches(self.dit, requester, f, entry) is True ]
+            result = []
+            for entry in found:
+                attrs = self.attributes(entry, attrlist, requester)
+                if attrs is not None:
+                    result.append( (entry.dn, attrs) )
+            return result
+
+    def __len__(self):
+        return len(self.dit)
@@ -0,0 +1,210 @@
+"""Measure replication lag and read scale-out on the development servers
+
+usage: replication-lag.py [-r repeats] [-n clients] [-t seconds] [-w timeout]
+                          [-o results.json] [-L] [-B]
+
+Expects ../devslapd/bin/x-start-ldap to have started the main server
+(the provider) and its local replicas (the consumers; 'consumers' and
+'consumerport' in ../devslapd/vars say how many and where).
+
+Lag: writes a new marker value into the description of ou=people on the
+provider as the rootDN, then polls each consumer, bound as the
+replicator, until the value shows up there. This is repeated -r times
+(default 20) and the minimum, median and maximum lag are reported for
+each consumer, along with whether its contextCSN has caught up with the
+provider's once all the changes are in. The original description is put
+back afterwards.
+
+Scale-out: runs the read-only ldapbench workload with -n clients (default
+12) for -t seconds (default 10), first all against the provider and then
+spread across the provider and the consumers, and compares the
+throughput.
+
+-L and -B run only the lag or only the benchmark. -o saves the figures
+as JSON.
+"""
+
+import sys
+import time
+import json
+import getopt
+import ldap
+from slapdinstance import readVars
+import ldapbench
+
+people_node = 'ou=people,dc=mozillians,dc=org'
+ldap_suffix = 'dc=mozillians,dc=org'
+
+# The replication account from ../migrations/02-accounts.ldif-dist
+replicator_dn = 'uid=replicator,ou=accounts,ou=system,dc=mozillians,dc=org'
+replicator_pw = 'secret'
+
+# How often to look for the marker on the consumers
+poll_interval = 0.002
+
+# The provider's URL and those of the consumers, from vars
+#
+def serverUrls( settings ):
+    provider = settings['serverurl']
+    port = int(settings.get('consumerport') or 1390)
+    consumers = [ 'ldap://:%d/' % (port + n) for n in range(int(settings.get('consumers') or 0)) ]
+    return provider, consumers
+
+def contextCSN( conn ):
+    result = conn.search_s(ldap_suffix, ldap.SCOPE_BASE, '(objectClass=*)', [ 'contextCSN' ])
+    return sorted(result[0][1].get('contextCSN', []))
+
+def readMarker( conn ):
+    result = conn.search_s(people_node, ldap.SCOPE_BASE, '(objectClass=*)', [ 'description' ])
+    return result[0][1].get('description', [ None ])[0]
+
+# Write a marker on the provider and time how long each consumer takes
+# to show it. Returns { consumer url: [lag in seconds, or None on timeout] }
+#
+def measureLag( provider, consumers, settings, repeats=20, timeout=10.0 ):
+    master = ldap.initialize(provider)
+    master.simple_bind_s(settings['manager'], settings['password'])
+    replicas = []
+    for url in consumers:
+        conn = ldap.initialize(url)
+        conn.simple_bind_s(replicator_dn, replicator_pw)
+        replicas.append( (url, conn) )
+
+    original = master.search_s(people_node, ldap.SCOPE_BASE, '(objectClass=*)',
+                               [ 'description' ])[0][1].get('description')
+    lags = dict( [ (url, []) for url in consumers ] )
+    try:
+        for n in range(repeats):
+            marker = 'replication-lag %d %.6f' % (n, time.time())
+            master.modify_s(people_node, [ (ldap.MOD_REPLACE, 'description', marker) ])
+            written = time.time()
+            waiting = list(replicas)
+            while waiting and time.time() - written < timeout:
+                for url, conn in list(waiting):
+                    if readMarker(conn) == marker:
+                        lags[url].append(time.time() - written)
+                        waiting.remove( (url, conn) )
+                if waiting:
+                    time.sleep(poll_interval)
+            for url, conn in waiting:
+                lags[url].append(None)
+    finally:
+        if original:
+            master.modify_s(people_node, [ (ldap.MOD_REPLACE, 'description', original) ])
+        else:
+            master.modify_s(people_node, [ (ldap.MOD_DELETE, 'description', None) ])
+
+    # Let the restore reach the replicas, then compare where each has got to
+    deadline = time.time() + timeout
+    wanted = contextCSN(master)
+    csn = {}
+    for url, conn in replicas:
+        while True:
+            csn[url] = contextCSN(conn) == wanted
+            if csn[url] or time.time() > deadline:
+                break
+            time.sleep(poll_interval)
+        conn.unbind_s()
+    master.unbind_s()
+    return lags, csn
+
+def lagSummary( values ):
+    seen = sorted( [ v for v in values if v is not None ] )
+    if not seen:
+        return { 'min_ms': None, 'median_ms': None, 'max_ms': None,
+                 'timeouts': len(values) }
+    return {
+        'min_ms': round(seen[0] * 1000, 2),
+        'median_ms': round(seen[len(seen) // 2] * 1000, 2),
+        'max_ms': round(seen[-1] * 1000, 2),
+        'timeouts': len(values) - len(seen),
+    }
+
+# Read throughput against the provider alone and across all the servers
+#
+def measureScaleOut( provider, consumers, clients, duration ):
+    results = {}
+    for name, urls in (('provider', [ provider ]), ('all', [ provider ] + consumers)):
+        sys.stderr.write('Reading from %s\n' % ', '.join(urls))
+        summary = ldapbench.runBenchmark(urls, clients, duration, mix=ldapbench.read_mix)
+        overall = summary['results'].get('all', {})
+        results[name] = {
+            'servers': len(urls),
+            'ops_per_sec': overall.get('ops_per_sec', 0),
+            'p95_ms': overall.get('p95_ms'),
+            'errors': overall.get('errors', 0),
+        }
+    return results
+
+def printResults( results, stream=sys.stdout ):
+    if 'lag' in results:
+        stream.write('%-22s %8s %10s %8s %8s  %s\n' % ('consumer', 'min ms', 'median ms', 'max ms',
+                                                     'timeouts', 'contextCSN'))
+        for url in sorted(results['lag']):
+            lag = results['lag'][url]
+            stream.write('%-22s %8s %10s %8s %8d  %s\n' % (
+                url, lag['min_ms'], lag['median_ms'], lag['max_ms'], lag['timeouts'],
+                lag['in_step'] and 'matches' or 'behind'))
+    if 'scale_out' in results:
+        if 'lag' in results:
+            stream.write('\n')
+        for name in ('provider', 'all'):
+            figures = results['scale_out'][name]
+            stream.write('%d server(s): %8.1f ops/sec  p95 %s ms  %d errors\n' % (
+                figures['servers'], figures['ops_per_sec'], figures['p95_ms'], figures['errors']))
+        alone = results['scale_out']['provider']['ops_per_sec']
+        if alone:
+            stream.write('Speed-up: %.2fx\n' % (results['scale_out']['all']['ops_per_sec'] / alone))
+
+def main():
+    settings = readVars()
+    repeats = 20
+    clients = 12
+    duration = 10
+    timeout = 10.0
+    output = None
+    lag = bench = True
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'r:n:t:w:o:LB')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-r':
+            repeats = int(value)
+        elif opt == '-n':
+            clients = int(value)
+        elif opt == '-t':
+            duration = float(value)
+        elif opt == '-w':
+            timeout = float(value)
+        elif opt == '-o':
+            output = value
+        elif opt == '-L':
+            bench = False
+        elif opt == '-B':
+            lag = False
+
+    provider, consumers = serverUrls(settings)
+    if not consumers:
+        sys.stderr.write('No consumers are configured in vars\n')
+        return 1
+
+    results = {}
+    if lag:
+        lags, csn = measureLag(provider, consumers, settings, repeats, timeout)
+        results['lag'] = {}
+        for url in consumers:
+            results['lag'][url] = lagSummary(lags[url])
+            results['lag'][url]['in_step'] = csn[url]
+    if bench:
+        results['scale_out'] = measureScaleOut(provider, consumers, clients, duration)
+
+    printResults(results)
+    if output:
+        json.dump(results, open(output, 'w'), indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
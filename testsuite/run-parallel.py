@@ -0,0 +1,235 @@
+"""Run the LDAP ACL tests in parallel
+
+Each worker process gets a slapd of its own, built from the devslapd
+configuration on a port of its own and loaded with the usual test data.
+The workers take tests one at a time from a shared queue, so the run
+finishes when the slowest worker runs out of tests rather than when the
+worker with the unluckiest share does.
+
+usage: run-parallel.py [-j workers] [-p first-port] [-k] [test-name ...]
+
+Test names are given the way unittest expects them, e.g.
+LdapUserTests or LdapUserTests.test_T0015_anon_read_suffix
+"""
+
+import os
+import sys
+import imp
+import time
+import Queue
+import shutil
+import getopt
+import tempfile
+import unittest
+import threading
+import traceback
+import multiprocessing
+from slapdinstance import SlapdInstance
+
+# The test module, which cannot be imported normally because of its name
+test_file = 'test-ldap-acls.py'
+
+# Load a fresh copy of the test module
+#
+def loadTests():
+    return imp.load_source('ldap_acl_tests', test_file)
+
+# List the ids of all the tests we have been asked to run
+#
+def testIds( module, names ):
+    loader = unittest.TestLoader()
+    if names:
+        suite = loader.loadTestsFromNames(names, module)
+    else:
+        suite = loader.loadTestsFromModule(module)
+
+    ids = []
+    def walk( suite ):
+        for test in suite:
+            if isinstance(test, unittest.TestSuite):
+                walk(test)
+            else:
+                ids.append(test.id().split('.', 1)[1])
+    walk(suite)
+    return ids
+
+
+# Collects test outcomes in a form that can be sent back to the parent
+#
+class WorkerResult(unittest.TestResult):
+    def __init__(self):
+        unittest.TestResult.__init__(self)
+        self.problems = []
+
+    def addError(self, test, err):
+        unittest.TestResult.addError(self, test, err)
+        self.problems.append( ('ERROR', test.id(), self._exc_info_to_string(err, test)) )
+
+    def addFailure(self, test, err):
+        unittest.TestResult.addFailure(self, test, err)
+        self.problems.append( ('FAIL', test.id(), self._exc_info_to_string(err, test)) )
+
+
+# Reports each test as it starts and finishes, so that if the process
+# dies the parent knows which test it was running
+#
+def worker( url, tasks, results ):
+    try:
+        module = loadTests()
+        module.ldap_url = url
+        loader = unittest.TestLoader()
+        result = WorkerResult()
+
+        while True:
+            test_id = tasks.get()
+            if test_id is None:
+                break
+            results.put( ('start', url, test_id, []) )
+            before = len(result.problems)
+            loader.loadTestsFromName(test_id, module).run(result)
+            results.put( ('done', url, test_id, result.problems[before:]) )
+
+        if module.connection_cache:
+            module.closeConnectionCache()
+        results.put( ('exit', url, None, []) )
+    except Exception:
+        results.put( ('exit', url, None, [ ('ERROR', url, traceback.format_exc()) ]) )
+
+
+# Collect the results until every worker has finished or died. A test
+# that a dead worker was running counts as an error, as do any tests
+# left over if all the workers die.
+#
+def collect( processes, urls, tasks, results, poll=5 ):
+    run = 0
+    problems = []
+    running = dict.fromkeys(urls)
+    live = dict(zip(urls, processes))
+    # Workers seen to have exited, whose last messages may still be on the way
+    exited = set()
+    while live:
+        try:
+            kind, url, test_id, found = results.get(timeout=poll)
+        except Queue.Empty:
+            for url, process in live.items():
+                if process.is_alive():
+                    continue
+                if url not in exited:
+                    exited.add(url)
+                    continue
+                test_id = running[url] or url
+                if running[url]:
+                    run += 1
+                problems.append( ('ERROR', test_id,
+                                  'worker for %s exited with code %s' % (url, process.exitcode)) )
+                del live[url]
+            continue
+        problems.extend(found)
+        if kind == 'start':
+            running[url] = test_id
+        elif kind == 'done':
+            running[url] = None
+            run += 1
+        else:
+            live.pop(url, None)
+
+    while True:
+        try:
+            test_id = tasks.get(timeout=0.1)
+        except Queue.Empty:
+            break
+        if test_id is not None:
+            problems.append( ('ERROR', test_id, 'not run: no worker left to run it') )
+    return run, problems
+
+
+def main():
+    workers = multiprocessing.cpu_count()
+    first_port = 1400
+    keep = False
+
+    try:
+        opts, names = getopt.getopt(sys.argv[1:], 'j:p:k')
+    except getopt.GetoptError, e:
+        sys.stderr.write("%s\n%s" % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-j':
+            workers = int(value)
+        elif opt == '-p':
+            first_port = int(value)
+        elif opt == '-k':
+            keep = True
+
+    # The tests use relative paths for their data files
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    ids = testIds(loadTests(), names)
+    workers = max(1, min(workers, len(ids)))
+
+    topdir = tempfile.mkdtemp(prefix='ldap-tests-')
+    servers = [ SlapdInstance(os.path.join(topdir, 'worker-%d' % n), first_port + n)
+                for n in range(workers) ]
+
+    # Starting and loading the servers is mostly waiting for other programs
+    errors = []
+    def prepare( server ):
+        try:
+            server.start()
+            server.load()
+        except Exception:
+            errors.append( (server.url, traceback.format_exc()) )
+    threads = [ threading.Thread(target=prepare, args=(server,)) for server in servers ]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        for url, text in errors:
+            sys.stderr.write("Could not start %s:\n%s\n" % (url, text))
+        for server in servers:
+            server.stop()
+        if not keep:
+            shutil.rmtree(topdir, True)
+        return 1
+    sys.stderr.write("Started %d servers in %.1fs\n" % (workers, time.time() - started))
+
+    try:
+        tasks = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        for test_id in ids:
+            tasks.put(test_id)
+        for n in range(workers):
+            tasks.put(None)
+
+        started = time.time()
+        processes = [ multiprocessing.Process(target=worker, args=(server.url, tasks, results))
+                      for server in servers ]
+        for process in processes:
+            process.start()
+
+        run, problems = collect(processes, [ server.url for server in servers ], tasks, results)
+        for process in processes:
+            process.join()
+        elapsed = time.time() - started
+    finally:
+        for server in servers:
+            server.stop()
+        if not keep:
+            shutil.rmtree(topdir, True)
+
+    for kind, test_id, text in problems:
+        sys.stderr.write("=" * 70 + "\n%s: %s\n" % (kind, test_id) + "-" * 70 + "\n%s\n" % text)
+    sys.stderr.write("-" * 70 + "\nRan %d tests in %.3fs on %d workers\n\n" % (run, elapsed, workers))
+
+    if problems:
+        failures = len([ p for p in problems if p[0] == 'FAIL' ])
+        sys.stderr.write("FAILED (failures=%d, errors=%d)\n" % (failures, len(problems) - failures))
+        return 1
+    sys.stderr.write("OK\n")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,623 @@
+"""Check LDIF against the schema without a server
+
+usage: schemacheck.py [-f slapd.conf] [-j jobs] [-m max-problems] file.ldif ...
+
+A bad entry in a big LDIF file is otherwise only found when x-load-ldif
+(or ldifload.py) gets to it, maybe many minutes into the load. Schema
+reads the same definitions as slapd: the schema files included by
+devslapd/slapd.conf, the ditcontentrules and attribute-set object
+classes in slapd.conf.acls, and the system schema that slapd has built
+in (top, objectClass, the operational attributes and so on). Then
+checkEntry() finds what slapd would refuse in an entry:
+
+	objectClass values that are not defined
+	no structural object class, or two that are not in one chain
+	auxiliary classes not listed in the content rule for the
+	    structural class (e.g. anything extra on a mozilliansLink)
+	MUST attributes missing, including the content rule's (e.g. uid
+	    on an inetOrgPerson)
+	attributes that no class or rule allows, or that the rule forbids
+	more than one value of a SINGLE-VALUE attribute
+	values that do not fit the syntax (DN, Directory String and its
+	    length bound, IA5, Printable, Integer, Boolean, Generalized
+	    Time, Numeric String, Country, OID, JPEG)
+	an RDN value that is not in the entry
+
+For change records the attribute names, syntax and SINGLE-VALUE are
+checked for the values given; whole entries are only checked for adds.
+
+checkFiles() splits the files into runs of whole records and checks
+them in a pool of processes, one per core unless -j says otherwise, so
+a 100,000 entry file takes seconds. It prints each problem as
+file:offset: dn: message and exits 1 if there were any.
+
+The standard schema files (core, cosine, inetorgperson, ppolicy) are
+expected in ../schema/std as described in devslapd/README.
+"""
+
+import os
+import re
+import sys
+import getopt
+import multiprocessing
+from ldapfilter import splitDN
+from ldifreader import LdifReader, LdifError, Base64Value
+from aclengine import statements
+from ditmodel import slapd_conf
+
+class SchemaError(ValueError):
+    pass
+
+# What slapd defines itself rather than in the schema files
+system_schema = """
+attributetype ( 2.5.4.0 NAME 'objectClass'
+	EQUALITY objectIdentifierMatch SYNTAX 1.3.6.1.4.1.1466.115.121.1.38 )
+attributetype ( 2.5.4.1 NAME ( 'aliasedObjectName' 'aliasedEntryName' )
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 SINGLE-VALUE )
+attributetype ( 2.5.4.41 NAME 'name'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.15{32768} )
+attributetype ( 2.5.4.49 NAME 'distinguishedName'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 )
+attributetype ( 2.5.21.9 NAME 'structuralObjectClass'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.38 SINGLE-VALUE USAGE directoryOperation )
+attributetype ( 2.5.18.1 NAME 'createTimestamp'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.24 SINGLE-VALUE USAGE directoryOperation )
+attributetype ( 2.5.18.2 NAME 'modifyTimestamp'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.24 SINGLE-VALUE USAGE directoryOperation )
+attributetype ( 2.5.18.3 NAME 'creatorsName'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 SINGLE-VALUE USAGE directoryOperation )
+attributetype ( 2.5.18.4 NAME 'modifiersName'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 SINGLE-VALUE USAGE directoryOperation )
+attributetype ( 2.5.18.9 NAME 'hasSubordinates'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.7 SINGLE-VALUE USAGE directoryOperation )
+attributetype ( 2.5.18.10 NAME 'subschemaSubentry'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 SINGLE-VALUE USAGE directoryOperation )
+attributetype ( 1.3.6.1.1.16.4 NAME 'entryUUID'
+	SYNTAX 1.3.6.1.1.16.1 SINGLE-VALUE USAGE directoryOperation )
+attributetype ( 1.3.6.1.4.1.4203.666.1.7 NAME 'entryCSN'
+	SYNTAX 1.3.6.1.4.1.4203.666.11.2.1 SINGLE-VALUE USAGE directoryOperation )
+attributetype ( 1.3.6.1.4.1.4203.666.1.25 NAME 'contextCSN'
+	SYNTAX 1.3.6.1.4.1.4203.666.11.2.1 USAGE dSAOperation )
+attributetype ( 1.3.6.1.1.20 NAME 'entryDN'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 SINGLE-VALUE USAGE directoryOperation )
+attributetype ( 1.2.840.113556.1.2.102 NAME 'memberOf'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 USAGE dSAOperation )
+attributetype ( 2.16.840.1.113730.3.1.34 NAME 'ref'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.26 USAGE distributedOperation )
+objectclass ( 2.5.6.0 NAME 'top' ABSTRACT MUST objectClass )
+objectclass ( 2.5.6.1 NAME 'alias' SUP top STRUCTURAL MUST aliasedObjectName )
+objectclass ( 2.16.840.1.113730.3.2.6 NAME 'referral' SUP top STRUCTURAL MUST ref )
+objectclass ( 1.3.6.1.4.1.1466.101.120.111 NAME 'extensibleObject' SUP top AUXILIARY )
+"""
+
+########################################################################
+# Syntaxes
+########################################################################
+
+generalized_time_re = re.compile(r'^\d{10}(\d\d(\d\d)?)?([.,]\d+)?(Z|[+-]\d\d(\d\d)?)$')
+printable_re = re.compile(r"^[A-Za-z0-9 '()+,./:=?-]+$")
+oid_re = re.compile(r'^(\d+(\.\d+)+|[A-Za-z][A-Za-z0-9-]*)$')
+
+def isUTF8( value ):
+    try:
+        value.decode('utf-8')
+        return True
+    except UnicodeDecodeError:
+        return False
+
+# DNs without escapes or multi-valued RDNs, which need no more checking
+simple_dn_re = re.compile(r'^[A-Za-z][A-Za-z0-9-]*=[^,+\\"<>;=]+(,[A-Za-z][A-Za-z0-9-]*=[^,+\\"<>;=]+)*$')
+
+def checkDN( value ):
+    if value == '' or simple_dn_re.match(value):
+        return isUTF8(value)
+    for rdn in splitDN(value):
+        for attr, rdnvalue in rdnPairs(rdn):
+            if rdnvalue is None or not oid_re.match(attr):
+                return False
+    return isUTF8(value)
+
+# Each syntax's check, by OID. Values of other syntaxes are not checked.
+syntax_checks = {
+    '1.3.6.1.4.1.1466.115.121.1.7': lambda v: v in ('TRUE', 'FALSE'),
+    '1.3.6.1.4.1.1466.115.121.1.11': lambda v: len(v) == 2 and printable_re.match(v) is not None,
+    '1.3.6.1.4.1.1466.115.121.1.12': checkDN,
+    '1.3.6.1.4.1.1466.115.121.1.15': lambda v: v != '' and isUTF8(v),
+    '1.3.6.1.4.1.1466.115.121.1.24': lambda v: generalized_time_re.match(v) is not None,
+    '1.3.6.1.4.1.1466.115.121.1.26': lambda v: max([ ord(c) for c in v ] or [ 0 ]) < 128,
+    '1.3.6.1.4.1.1466.115.121.1.27': lambda v: re.match(r'^-?\d+$', v) is not None,
+    '1.3.6.1.4.1.1466.115.121.1.28': lambda v: v[:2] == '\xff\xd8',
+    '1.3.6.1.4.1.1466.115.121.1.36': lambda v: re.match(r'^[\d ]+$', v) is not None,
+    '1.3.6.1.4.1.1466.115.121.1.38': lambda v: oid_re.match(v) is not None,
+    '1.3.6.1.4.1.1466.115.121.1.44': lambda v: printable_re.match(v) is not None,
+    '1.3.6.1.4.1.1466.115.121.1.50': lambda v: printable_re.match(v) is not None,
+}
+
+syntax_names = {
+    '1.3.6.1.4.1.1466.115.121.1.7': 'Boolean',
+    '1.3.6.1.4.1.1466.115.121.1.11': 'Country String',
+    '1.3.6.1.4.1.1466.115.121.1.12': 'DN',
+    '1.3.6.1.4.1.1466.115.121.1.15': 'Directory String',
+    '1.3.6.1.4.1.1466.115.121.1.24': 'Generalized Time',
+    '1.3.6.1.4.1.1466.115.121.1.26': 'IA5 String',
+    '1.3.6.1.4.1.1466.115.121.1.27': 'Integer',
+    '1.3.6.1.4.1.1466.115.121.1.28': 'JPEG',
+    '1.3.6.1.4.1.1466.115.121.1.36': 'Numeric String',
+    '1.3.6.1.4.1.1466.115.121.1.38': 'OID',
+    '1.3.6.1.4.1.1466.115.121.1.44': 'Printable String',
+    '1.3.6.1.4.1.1466.115.121.1.50': 'Telephone Number',
+}
+
+# Split an RDN into (attr, value) pairs, undoing the escapes in the values
+#
+def rdnPairs( rdn ):
+    pairs = []
+    for ava in re.split(r'(?<!\\)\+', rdn):
+        if '=' not in ava:
+            pairs.append( (ava.strip(), None) )
+            continue
+        attr, value = ava.split('=', 1)
+        value = re.sub(r'\\([0-9A-Fa-f]{2}|.)',
+                       lambda m: len(m.group(1)) == 2 and chr(int(m.group(1), 16)) or m.group(1),
+                       value.strip())
+        pairs.append( (attr.strip(), value) )
+    return pairs
+
+########################################################################
+# Reading the schema
+########################################################################
+
+# Split a definition into tokens: ( ) $ 'quoted' and words
+#
+def tokens( text ):
+    return re.findall(r"\(|\)|\$|'[^']*'|[^\s()$']+", text)
+
+# Keywords that stand alone, without a value
+flag_keywords = ('OBSOLETE', 'SINGLE-VALUE', 'COLLECTIVE', 'NO-USER-MODIFICATION',
+                 'ABSTRACT', 'STRUCTURAL', 'AUXILIARY')
+
+# Parse '( oid KEYWORD value ... )' into (oid, { KEYWORD: [values] }).
+# Anything after the closing parenthesis is ignored, as slapd does.
+#
+def parseDefinition( text ):
+    words = tokens(text)
+    if len(words) < 2 or words[0] != '(':
+        raise SchemaError('definition does not start with ( oid: %s' % text[:60])
+    oid = words[1]
+    fields = {}
+    n = 2
+    while n < len(words) and words[n] != ')':
+        keyword = words[n].upper()
+        n += 1
+        values = []
+        if keyword in flag_keywords:
+            pass
+        elif n < len(words) and words[n] == '(':
+            n += 1
+            while n < len(words) and words[n] != ')':
+                if words[n] != '$':
+                    values.append(words[n].strip("'"))
+                n += 1
+            n += 1
+        elif n < len(words):
+            values.append(words[n].strip("'"))
+            n += 1
+        fields[keyword] = values
+    if n >= len(words):
+        raise SchemaError('definition of %s has no closing parenthesis' % oid)
+    return oid, fields
+
+class AttributeType:
+    def __init__(self, oid, fields):
+        self.oid = oid
+        self.names = fields.get('NAME', []) or [ oid ]
+        self.name = self.names[0]
+        self.sup = (fields.get('SUP') or [ None ])[0]
+        self.syntax = None
+        self.length = None
+        if fields.get('SYNTAX'):
+            match = re.match(r'^([\d.]+)(\{(\d+)\})?$', fields['SYNTAX'][0])
+            if match:
+                self.syntax = match.group(1)
+                self.length = match.group(3) and int(match.group(3))
+        self.single = 'SINGLE-VALUE' in fields
+        self.operational = (fields.get('USAGE') or [ 'userApplications' ])[0] != 'userApplications'
+
+class ObjectClass:
+    def __init__(self, oid, fields):
+        self.oid = oid
+        self.names = fields.get('NAME', []) or [ oid ]
+        self.name = self.names[0]
+        self.sup = fields.get('SUP', [])
+        self.kind = 'STRUCTURAL'
+        for kind in ('ABSTRACT', 'AUXILIARY'):
+            if kind in fields:
+                self.kind = kind
+        self.must = fields.get('MUST', [])
+        self.may = fields.get('MAY', [])
+
+class ContentRule:
+    def __init__(self, oid, fields):
+        # The oid is that of the structural class the rule applies to
+        self.oid = oid
+        self.name = (fields.get('NAME') or [ oid ])[0]
+        self.aux = fields.get('AUX', [])
+        self.must = fields.get('MUST', [])
+        self.may = fields.get('MAY', [])
+        self.forbidden = fields.get('NOT', [])
+
+class Schema:
+    def __init__(self):
+        # Keyed by lower-case name and by OID
+        self.attributes = {}
+        self.classes = {}
+        # Keyed by the OID of the structural class
+        self.rules = {}
+        self.macros = {}
+        # Answers kept by attribute(), syntax() and contents()
+        self.found = {}
+        self.syntaxes = {}
+        self.content_cache = {}
+        self.readText(system_schema, 'system schema')
+        self.objectclass_oid = self.attribute('objectClass').oid
+
+    # Read the schema in a slapd.conf file and the files it includes
+    #
+    def readConfig(self, filename=slapd_conf):
+        directory = os.path.dirname(os.path.abspath(filename))
+        for number, text in statements(filename):
+            keyword = text.split(None, 1)[0].lower()
+            if keyword == 'include':
+                included = text.split(None, 1)[1].strip()
+                if not os.path.isabs(included):
+                    included = os.path.join(directory, included)
+                if not os.path.exists(included):
+                    raise SchemaError('%s:%d: %s not found (see devslapd/README for '
+                                      'linking the standard schema)' % (filename, number, included))
+                self.readConfig(included)
+            else:
+                self.define(keyword, text, '%s:%d' % (filename, number))
+
+    # Read definitions written as in a schema file
+    #
+    def readText(self, text, where):
+        definitions = []
+        for line in text.split('\n'):
+            if line[:1] in (' ', '\t') and definitions:
+                definitions[-1] += ' ' + line.strip()
+            elif line.strip():
+                definitions.append(line.strip())
+        for definition in definitions:
+            self.define(definition.split(None, 1)[0].lower(), definition, where)
+
+    def define(self, keyword, text, where):
+        if keyword not in ('attributetype', 'objectclass', 'ditcontentrule', 'objectidentifier'):
+            return
+        rest = text.split(None, 1)[1]
+        if keyword == 'objectidentifier':
+            name, oid = rest.split()[:2]
+            self.macros[name] = self.expand(oid)
+            return
+        try:
+            oid, fields = parseDefinition(rest)
+        except SchemaError, e:
+            raise SchemaError('%s: %s' % (where, e))
+        oid = self.expand(oid)
+        if keyword == 'attributetype':
+            item, table = AttributeType(oid, fields), self.attributes
+        elif keyword == 'objectclass':
+            item, table = ObjectClass(oid, fields), self.classes
+        else:
+            self.rules[oid] = ContentRule(oid, fields)
+            return
+        table[oid] = item
+        for name in item.names:
+            table[name.lower()] = item
+
+    def expand(self, oid):
+        if ':' in oid:
+            macro, suffix = oid.split(':', 1)
+            if macro in self.macros:
+                return self.macros[macro] + '.' + suffix
+        return self.macros.get(oid, oid)
+
+    def attribute(self, name):
+        at = self.found.get(name)
+        if at is None:
+            at = self.attributes.get(name.split(';', 1)[0].lower())
+            if at is not None:
+                self.found[name] = at
+        return at
+
+    def objectClass(self, name):
+        return self.classes.get(name.lower())
+
+    # The syntax and length bound of an attribute, from its superiors if need be
+    #
+    def syntax(self, attr):
+        if attr.oid in self.syntaxes:
+            return self.syntaxes[attr.oid]
+        first = attr
+        seen = set()
+        while attr is not None and attr.syntax is None and attr.sup and attr.oid not in seen:
+            seen.add(attr.oid)
+            attr = self.attribute(attr.sup)
+        result = attr is None and (None, None) or (attr.syntax, attr.length)
+        self.syntaxes[first.oid] = result
+        return result
+
+    # A class and all its superclasses
+    #
+    def superclasses(self, oc):
+        found = {}
+        todo = [ oc ]
+        while todo:
+            oc = todo.pop()
+            if oc.oid in found:
+                continue
+            found[oc.oid] = oc
+            for sup in oc.sup:
+                sup = self.objectClass(sup)
+                if sup is not None:
+                    todo.append(sup)
+        return found.values()
+
+    # What a set of objectClass values allows, as (problems, must,
+    # allowed, forbidden, rule name) with attribute type OIDs. allowed
+    # is None for anything (extensibleObject, or classes that are not
+    # known). The same few sets turn up again and again, so the answers
+    # are kept.
+    #
+    def contents(self, names):
+        key = frozenset( [ name.lower() for name in names ] )
+        if key in self.content_cache:
+            return self.content_cache[key]
+
+        problems = []
+        classes = {}
+        for name in names:
+            oc = self.objectClass(name)
+            if oc is None:
+                problems.append('unknown objectClass %s' % name)
+            else:
+                for sup in self.superclasses(oc):
+                    classes[sup.oid] = sup
+        if problems:
+            # slapd stops there, and anything more would be guesswork
+            result = (problems, set(), None, set(), None)
+            self.content_cache[key] = result
+            return result
+        classes = classes.values()
+
+        structural = [ oc for oc in classes if oc.kind == 'STRUCTURAL' ]
+        supers = set()
+        for oc in structural:
+            supers.update( [ sup.oid for sup in self.superclasses(oc) if sup is not oc ] )
+        leaves = [ oc for oc in structural if oc.oid not in supers ]
+        rule = None
+        if not leaves:
+            problems.append('no structural object class')
+        elif len(leaves) > 1:
+            problems.append('invalid structural object class chain (%s)' %
+                            '/'.join(sorted([ oc.name for oc in leaves ])))
+        else:
+            rule = self.rules.get(leaves[0].oid)
+
+        must = set()
+        may = set()
+        forbidden = set()
+        for oc in classes:
+            must.update(oc.must)
+            may.update(oc.may)
+        if rule is not None:
+            allowed = set( [ self.objectClass(name) for name in rule.aux ] )
+            for oc in classes:
+                if oc.kind == 'AUXILIARY' and oc not in allowed:
+                    problems.append('objectClass %s not allowed by %s' % (oc.name, rule.name))
+            must.update(rule.must)
+            may.update(rule.may)
+            forbidden.update(rule.forbidden)
+
+        keys = lambda names: set( [ self.attribute(name) and self.attribute(name).oid or name
+                                    for name in names ] )
+        must = keys(must)
+        allowed = must | keys(may)
+        if [ oc for oc in classes if oc.name == 'extensibleObject' ]:
+            allowed = None
+        result = (problems, must, allowed, keys(forbidden), rule and rule.name)
+        self.content_cache[key] = result
+        return result
+
+    ####################################################################
+    # Checking
+    ####################################################################
+
+    # What is wrong with an entry, as a list of messages
+    #
+    def checkEntry(self, dn, attrs):
+        problems = []
+        present = {}
+        for name, values in attrs.items():
+            at = self.attribute(name)
+            if at is None:
+                problems.append('unknown attribute type %s' % name)
+                continue
+            present.setdefault(at.oid, (at, []))[1].extend(values)
+        problems.extend(self.checkValues(present))
+
+        names = [ str(name) for name in present.get(self.objectclass_oid, (None, []))[1] ]
+        content_problems, must, allowed, forbidden, rule = self.contents(names)
+        problems.extend(content_problems)
+        for oid in sorted(must - set(present)):
+            problems.append('missing required attribute %s' % self.attribute(oid).name)
+        for oid, (at, values) in present.items():
+            if at.operational:
+                continue
+            if oid in forbidden:
+                problems.append('attribute %s not allowed by %s' % (at.name, rule))
+            elif allowed is not None and oid not in allowed:
+                problems.append('attribute %s not allowed' % at.name)
+
+        problems.extend(self.checkRDN(dn, present))
+        return problems
+
+    # Syntax and SINGLE-VALUE of { oid: (attribute type, values) }
+    #
+    def checkValues(self, present):
+        problems = []
+        for oid, (at, values) in present.items():
+            if at.single and len(values) > 1:
+                problems.append('attribute %s is single-valued' % at.name)
+            syntax, length = self.syntax(at)
+            check = syntax_checks.get(syntax)
+            for value in values:
+                if isinstance(value, Base64Value):
+                    value = value.decode()[:2].tobytes()
+                if check and not check(value):
+                    problems.append('%s value %r is not a valid %s' %
+                                    (at.name, value[:40], syntax_names[syntax]))
+                elif length and syntax != '1.3.6.1.4.1.1466.115.121.1.28' and \
+                        len(value.decode('utf-8', 'replace')) > length:
+                    problems.append('%s value is longer than %d characters' % (at.name, length))
+        return problems
+
+    def checkRDN(self, dn, present):
+        if '\\' in dn:
+            rdn = splitDN(dn)[0]
+        else:
+            rdn = dn.split(',', 1)[0]
+        if not rdn.strip():
+            return [ 'empty DN' ]
+        problems = []
+        for attr, value in rdnPairs(rdn):
+            at = self.attribute(attr)
+            if value is None or at is None:
+                problems.append('bad RDN %s' % rdn)
+            elif value.lower() not in [ str(v).lower() for v in present.get(at.oid, (at, []))[1] ]:
+                problems.append('RDN value %s=%s is not in the entry' % (attr, value))
+        return problems
+
+    # What is wrong with a modify record
+    #
+    def checkChanges(self, dn, changes):
+        present = {}
+        problems = []
+        for op, name, values in changes:
+            at = self.attribute(name)
+            if at is None:
+                problems.append('unknown attribute type %s' % name)
+            elif values and op in (0, 2):
+                present.setdefault(at.oid, (at, []))[1].extend(values)
+        return problems + self.checkValues(present)
+
+    # What is wrong with an LDIF record
+    #
+    def checkRecord(self, record):
+        try:
+            if record.changetype == 'add':
+                return self.checkEntry(record.dn, record.entry(frozenset([ 'jpegphoto' ])))
+            if record.changetype == 'modify':
+                return self.checkChanges(record.dn, record.changes())
+            return []
+        except LdifError, e:
+            return [ str(e) ]
+
+def readSchema( filename=slapd_conf ):
+    schema = Schema()
+    schema.readConfig(filename)
+    return schema
+
+########################################################################
+# Checking files in parallel
+########################################################################
+
+# The schema in each worker process
+worker_schema = None
+
+def startWorker( config ):
+    global worker_schema
+    worker_schema = readSchema(config)
+
+# Check the records of one file between two offsets.
+# Returns (records checked, [ (filename, offset, dn, message) ]).
+#
+def checkRun( run ):
+    filename, start, stop, limit = run
+    problems = []
+    count = 0
+    reader = LdifReader(filename)
+    try:
+        try:
+            for record in reader.records(start, stop):
+                count += 1
+                for message in worker_schema.checkRecord(record):
+                    problems.append( (filename, record.start, record.dn, message) )
+                if len(problems) >= limit:
+                    break
+        except LdifError, e:
+            problems.append( (filename, start, '', str(e)) )
+    finally:
+        reader.close()
+    return count, problems
+
+# Check LDIF files with 'jobs' processes (one per core by default).
+# Returns (records checked, problems) with at most about 'limit' problems.
+#
+def checkFiles( files, config=slapd_conf, jobs=None, limit=1000 ):
+    jobs = jobs or multiprocessing.cpu_count()
+    runs = []
+    for filename in files:
+        reader = LdifReader(filename)
+        offsets = reader.boundaries(jobs * 4)
+        reader.close()
+        runs.extend( [ (filename, offsets[n], offsets[n + 1], limit)
+                       for n in range(len(offsets) - 1) ] )
+    if jobs == 1:
+        startWorker(config)
+        results = map(checkRun, runs)
+    else:
+        readSchema(config)      # Fail here rather than in every worker
+        pool = multiprocessing.Pool(jobs, startWorker, (config,))
+        try:
+            results = pool.map(checkRun, runs, 1)
+        finally:
+            pool.close()
+            pool.join()
+    count = sum( [ n for n, problems in results ] )
+    problems = sum( [ problems for n, problems in results ], [] )
+    return count, problems[:limit]
+
+def main():
+    config = slapd_conf
+    jobs = None
+    limit = 1000
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'f:j:m:')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-f':
+            config = value
+        elif opt == '-j':
+            jobs = int(value)
+        elif opt == '-m':
+            limit = int(value)
+    if not args:
+        sys.stderr.write(__doc__)
+        return 2
+
+    try:
+        count, problems = checkFiles(args, config, jobs, limit)
+    except SchemaError, e:
+        sys.stderr.write('%s\n' % e)
+        return 2
+    for filename, offset, dn, message in problems:
+        sys.stdout.write('%s:%d: %s: %s\n' % (filename, offset, dn, message))
+    sys.stderr.write('%d records checked, %d problems%s\n' %
+                     (count, len(problems), len(problems) >= limit and ' (or more)' or ''))
+    return problems and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
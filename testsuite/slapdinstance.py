@@ -0,0 +1,187 @@
+"""Private slapd instances built from the devslapd configuration
+
+Each SlapdInstance gets its own working directory holding a copy of
+devslapd/slapd.conf with every relative path made absolute, its own
+database directory and its own port. Several of them can run side by
+side with the normal development server, so tools that need a server of
+their own (the parallel test runner, profilers, benchmarks) can start one,
+load the usual test data and throw it away afterwards.
+
+The slapd program must be on the PATH, as set up by
+devslapd/setup.sh. Given a logfile, slapd runs in the foreground with
+its 'stats' log written there instead of to syslog.
+"""
+
+import os
+import sys
+import time
+import signal
+import subprocess
+import ldap
+from ditmodel import devslapd_dir, buildFiles
+import ldifload
+
+# Same as the DB_CONFIG written by x-init-db for hdb
+db_config = """# Minimal DB_CONFIG file for development server
+# This is not suitable for production
+
+set_cachesize 0 1000000 1
+set_flags DB_LOG_AUTOREMOVE
+
+# This flag is extremely dangerous to the health of your data
+set_flags DB_TXN_NOSYNC
+"""
+
+# Read the shell-style variable settings in devslapd/vars
+#
+def readVars( directory=devslapd_dir ):
+    settings = {}
+    for line in open(os.path.join(directory, 'vars')):
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        name, value = line.split('=', 1)
+        settings[name.strip()] = value.strip()
+    return settings
+
+# The map size x-init-db would choose for mdb: ten times the LDIF to be
+# loaded, and at least 256MB
+#
+def mdbMapSize( files ):
+    size = sum( [ os.path.getsize(f) for f in files if os.path.exists(f) ] )
+    return max(size * 10, 256 * 1024 * 1024)
+
+
+class SlapdInstance:
+    def __init__(self, workdir, port, devslapd=devslapd_dir, acl_file=None, logfile=None,
+                 backend=None):
+        self.workdir = os.path.abspath(workdir)
+        self.port = port
+        self.devslapd = os.path.abspath(devslapd)
+        self.acl_file = acl_file and os.path.abspath(acl_file)
+        self.logfile = logfile and os.path.abspath(logfile)
+        self.process = None
+        self.url = 'ldap://localhost:%d/' % port
+
+        self.vars = readVars(self.devslapd)
+        self.backend = backend or self.vars.get('backend') or 'hdb'
+        self.rootDN = self.vars['manager']
+        self.rootPW = self.vars['password']
+
+        self.conf = os.path.join(self.workdir, 'slapd.conf')
+        self.pidfile = os.path.join(self.workdir, 'slapd.pid')
+        self.dbdir = os.path.join(self.workdir, 'openldap-db')
+
+    # Resolve a path from slapd.conf relative to the devslapd directory
+    #
+    def absPath(self, path):
+        return os.path.normpath(os.path.join(self.devslapd, path))
+
+    # Copy devslapd/slapd.conf, pointing all file references at the
+    # right places for this instance
+    #
+    def writeConfig(self):
+        if not os.path.isdir(self.dbdir):
+            os.makedirs(self.dbdir)
+
+        out = open(self.conf, 'w')
+        for line in open(os.path.join(self.devslapd, 'slapd.conf')):
+            words = line.split()
+            keyword = words and words[0].lower()
+            if keyword == 'include':
+                path = self.absPath(words[1])
+                if self.acl_file and os.path.basename(path) == 'slapd.conf.acls':
+                    path = self.acl_file
+                elif os.path.basename(path) == 'backend.conf':
+                    path = self.writeBackendConfig()
+                line = 'include\t\t%s\n' % path
+            elif keyword == 'pidfile':
+                line = 'pidfile\t\t%s\n' % self.pidfile
+            elif keyword == 'argsfile':
+                line = 'argsfile\t%s\n' % os.path.join(self.workdir, 'slapd.args')
+            elif keyword == 'directory':
+                line = 'directory\t%s\n' % self.dbdir
+            out.write(line)
+        out.close()
+
+        dbconf = os.path.join(self.dbdir, 'DB_CONFIG')
+        if self.backend == 'hdb' and not os.path.exists(dbconf):
+            open(dbconf, 'w').write(db_config)
+
+    # Write this instance's backend.conf, as x-init-db does
+    #
+    def writeBackendConfig(self):
+        template = open(os.path.join(self.devslapd, 'backend-%s.conf' % self.backend)).read()
+        maxsize = self.vars.get('mdb_maxsize') or mdbMapSize(buildFiles(self.devslapd))
+        path = os.path.join(self.workdir, 'backend.conf')
+        open(path, 'w').write(template.replace('@MAXSIZE@', str(maxsize)))
+        return path
+
+    def start(self, timeout=30):
+        self.writeConfig()
+        command = [ 'slapd',
+                    '-f', self.conf,
+                    '-h', self.url,
+                    '-n', 'slapd-%d' % self.port ]
+        if self.logfile:
+            # -d keeps slapd in the foreground, logging to stderr
+            self.process = subprocess.Popen(command + [ '-d', 'stats' ],
+                                            stderr=open(self.logfile, 'a'))
+        else:
+            subprocess.check_call(command)
+        self.waitUntilReady(timeout)
+
+    # Wait until the server accepts a bind from the rootDN
+    #
+    def waitUntilReady(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                conn = ldap.initialize(self.url)
+                conn.simple_bind_s(self.rootDN, self.rootPW)
+                conn.unbind()
+                return
+            except ldap.SERVER_DOWN:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def pid(self):
+        try:
+            return int(open(self.pidfile).read().strip())
+        except (IOError, ValueError):
+            return None
+
+    def stop(self, timeout=30):
+        pid = self.pid()
+        if pid is None:
+            return
+        os.kill(pid, signal.SIGINT)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process:
+                if self.process.poll() is not None:
+                    self.process = None
+                    return
+            else:
+                try:
+                    os.kill(pid, 0)
+                except OSError:
+                    return
+            time.sleep(0.1)
+        sys.stderr.write("slapd %d did not stop within %d seconds\n" % (pid, timeout))
+
+    # Load LDIF files as x-load-ldif does (carrying on past errors),
+    # with many operations in flight. Returns the loader's report.
+    #
+    def load(self, files=None, connections=2, window=32):
+        if files is None:
+            files = buildFiles(self.devslapd)
+        return ldifload.loadFiles(self.url, self.rootDN, self.rootPW, files,
+                                  connections, window)
+
+    def connect(self, dn=None, password=None):
+        conn = ldap.initialize(self.url)
+        if dn:
+            conn.simple_bind_s(dn, password)
+        return conn
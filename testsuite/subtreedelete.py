@@ -0,0 +1,261 @@
+"""Delete whole subtrees, many entries at a time
+
+usage: subtreedelete.py [-H url] [-D dn] [-w password] [-n connections]
+                        [-W window] [-t auto|yes|no] [-b base -f filter] [dn ...]
+
+LDAP only deletes leaf entries, so removing an entry with children
+means deleting the children first. SubtreeDeleter finds every entry
+beneath each DN it is given with a paged subtree search that asks for
+no attributes, builds the tree of DNs that is really there, and
+deletes it in waves: all the leaves, then the entries whose children
+were all leaves, and so on. The deletes go through ldifload's
+PipelinedLoader, so a window of them is in flight on each connection
+and a parent goes as soon as its own children are gone rather than
+waiting for the whole wave.
+
+With the Tree Delete control (1.2.840.113556.1.4.805) the server
+removes a subtree in one operation, and no search is needed. -t auto
+(the default) uses it if the server lists it in supportedControl;
+OpenLDAP 2.4 does not, so the devslapd server gets the waves.
+
+Entries that are already gone are not errors. An entry that gains a
+child between the search and its delete (NOT_ALLOWED_ON_NONLEAF) is
+searched again and tried once more, up to 'rounds' times.
+
+From the command line the DNs are given as arguments, or found with a
+search under -b for -f, e.g. to purge applicants who were never vouched
+for and whose entries are more than a year old:
+
+	python subtreedelete.py -b ou=people,dc=mozillians,dc=org \\
+	    -f '(&(objectClass=mozilliansPerson)(!(mozilliansVouchedBy=*))(createTimestamp<=20120101000000Z))'
+
+It binds as the rootDN from ../devslapd/vars unless -D and -w are given.
+"""
+
+import sys
+import time
+import getopt
+import collections
+import ldap
+import ldap.controls
+from ldapfilter import normaliseDN, splitDN
+from pagedsearch import PagedSearch
+from ldifload import PipelinedLoader, deleteOperations, printReport
+
+tree_delete_oid = '1.2.840.113556.1.4.805'
+
+# Does the server advertise the Tree Delete control?
+#
+def supportsTreeDelete( conn ):
+    try:
+        res = conn.search_s('', ldap.SCOPE_BASE, '(objectClass=*)', [ 'supportedControl' ])
+    except ldap.LDAPError:
+        return False
+    for dn, attrs in res:
+        if tree_delete_oid in attrs.get('supportedControl', []):
+            return True
+    return False
+
+def parentDN( ndn ):
+    return ','.join(splitDN(ndn)[1:])
+
+########################################################################
+# The tree of DNs
+########################################################################
+
+class DNTree:
+    def __init__(self):
+        # Normalised DN: DN as the server gave it
+        self.names = {}
+
+    def add(self, dn):
+        self.names.setdefault(normaliseDN(dn), dn)
+
+    def __contains__(self, ndn):
+        return ndn in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    # Is ndn in a subtree already held?
+    #
+    def covers(self, ndn):
+        rdns = splitDN(ndn)
+        return [ n for n in range(len(rdns)) if ','.join(rdns[n:]) in self.names ] != []
+
+    # The DNs in waves: first the leaves, then the entries all of whose
+    # children are leaves, and so on up to the roots
+    #
+    def waves(self):
+        children = collections.defaultdict(int)
+        for ndn in self.names:
+            parent = parentDN(ndn)
+            if parent in self.names:
+                children[parent] += 1
+        wave = [ ndn for ndn in self.names if not children[ndn] ]
+        waves = []
+        while wave:
+            waves.append([ self.names[ndn] for ndn in wave ])
+            following = []
+            for ndn in wave:
+                parent = parentDN(ndn)
+                if parent in self.names:
+                    children[parent] -= 1
+                    if not children[parent]:
+                        following.append(parent)
+            wave = following
+        return waves
+
+########################################################################
+# Deleting
+########################################################################
+
+class SubtreeDeleter:
+    def __init__(self, conns, window=32, tree_delete=None, rounds=3, page_size=500):
+        # tree_delete is True, False or None to ask the server
+        self.conns = conns
+        self.window = window
+        self.rounds = rounds
+        self.page_size = page_size
+        if tree_delete is None:
+            tree_delete = supportsTreeDelete(conns[0])
+        self.tree_delete = tree_delete
+        self.counts = collections.defaultdict(int)
+        self.errors = []
+        self.waves = 0
+
+    # Find everything beneath the DNs.
+    # DNs that do not exist are left out.
+    #
+    def scan(self, dns):
+        tree = DNTree()
+        for dn in sorted(dns, key=lambda dn: len(splitDN(normaliseDN(dn)))):
+            if tree.covers(normaliseDN(dn)):
+                continue
+            search = PagedSearch(self.conns[0], dn, ldap.SCOPE_SUBTREE, '(objectClass=*)',
+                                 [ '1.1' ], page_size=self.page_size)
+            try:
+                for found, attrs in search:
+                    tree.add(found)
+            except ldap.NO_SUCH_OBJECT:
+                continue
+            if search.truncated:
+                raise search.error
+        return tree
+
+    def run(self, operations):
+        report = PipelinedLoader(self.conns, self.window).load(operations)
+        for name, count in report['counts'].items():
+            self.counts[name] += count
+        return report['errors']
+
+    # Delete the DNs and everything beneath them.
+    # Returns a report like PipelinedLoader's.
+    #
+    def delete(self, dns):
+        started = time.time()
+        if self.tree_delete:
+            control = ldap.controls.RequestControl(tree_delete_oid, True)
+            self.errors.extend(self.run(deleteOperations(dns, [ control ])))
+        else:
+            for n in range(self.rounds):
+                tree = self.scan(dns)
+                waves = tree.waves()
+                self.waves += len(waves)
+                errors = self.run(deleteOperations(sum(waves, [])))
+                dns = [ dn for kind, dn, error in errors
+                        if isinstance(error, ldap.NOT_ALLOWED_ON_NONLEAF) ]
+                if not dns or n == self.rounds - 1:
+                    self.errors.extend(errors)
+                    break
+                # Tried again below, so only the other errors count
+                self.errors.extend([ (kind, dn, error) for kind, dn, error in errors
+                                     if not isinstance(error, ldap.NOT_ALLOWED_ON_NONLEAF) ])
+                self.counts['failed'] -= len(dns)
+                if not self.counts['failed']:
+                    del self.counts['failed']
+        return self.report(time.time() - started)
+
+    def report(self, seconds):
+        done = sum( [ count for name, count in self.counts.items() if name != 'retried' ] )
+        return {
+            'operations': done,
+            'seconds': round(seconds, 3),
+            'per_second': seconds and round(done / seconds, 1) or None,
+            'counts': dict(self.counts),
+            'errors': self.errors,
+            'waves': self.waves,
+        }
+
+# Delete the subtrees on one connection, raising the first error as
+# delete_s would (entries that are already gone are not errors)
+#
+def deleteSubtrees( conn, dns, window=32, tree_delete=False ):
+    report = SubtreeDeleter([ conn ], window, tree_delete).delete(dns)
+    if report['errors']:
+        kind, dn, error = report['errors'][0]
+        raise error
+    return report
+
+def main():
+    from slapdinstance import readVars
+    settings = readVars()
+    url = settings['serverurl']
+    dn = settings['manager']
+    password = settings['password']
+    connections = 2
+    window = 32
+    tree_delete = None
+    base = None
+    filterstr = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'H:D:w:n:W:t:b:f:')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-H':
+            url = value
+        elif opt == '-D':
+            dn = value
+        elif opt == '-w':
+            password = value
+        elif opt == '-n':
+            connections = int(value)
+        elif opt == '-W':
+            window = int(value)
+        elif opt == '-t':
+            if value not in ('auto', 'yes', 'no'):
+                sys.stderr.write(__doc__)
+                return 2
+            tree_delete = { 'auto': None, 'yes': True, 'no': False }[value]
+        elif opt == '-b':
+            base = value
+        elif opt == '-f':
+            filterstr = value
+    if bool(base) != bool(filterstr) or not (args or base):
+        sys.stderr.write(__doc__)
+        return 2
+
+    conns = []
+    for n in range(connections):
+        conn = ldap.initialize(url)
+        conn.simple_bind_s(dn, password)
+        conns.append(conn)
+    try:
+        dns = list(args)
+        if base:
+            search = PagedSearch(conns[0], base, ldap.SCOPE_SUBTREE, filterstr, [ '1.1' ],
+                                 page_size=500)
+            dns.extend([ found for found, attrs in search ])
+        report = SubtreeDeleter(conns, window, tree_delete).delete(dns)
+    finally:
+        for conn in conns:
+            conn.unbind_s()
+    printReport(report)
+    sys.stdout.write('%d waves\n' % report['waves'])
+    return report['errors'] and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
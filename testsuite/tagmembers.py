@@ -0,0 +1,275 @@
+"""Tag membership without reading the whole member attribute
+
+Each tag is a mozilliansGroup entry and each membership is a value of
+its 'member' attribute, which the memberof overlay mirrors as memberOf
+in the person's entry. A popular tag can have tens of thousands of
+values, so anything that reads 'member' (or rewrites the entry) gets
+slower as the tag grows. The functions here ask for no more than they
+need:
+
+	memberCount(conn, tag)	the number of people with memberOf=tag,
+				from the content count of a one-entry
+				Virtual List View search
+
+	memberPages(conn, tag)	a VirtualListView over those people,
+				sorted by cn, a page at a time
+
+	isMember(conn, tag, dn)	a compare, which reads nothing back
+
+They use the connection they are given, so the ACLs for whoever it is
+bound as apply: Applicants can search membership but not read it.
+The sorted searches need the sssvlv overlay, and 'limits users' in
+devslapd/slapd.conf refuses them for ordinary users once a tag has more
+than 500 members (size.unchecked), so big tags need an account without
+limits such as LDAPAdmin.
+
+MemberBatcher collects the self-adds and self-removes (T10050 and
+T10055) of many users and applies them as one modify per tag, so a busy
+tag is rewritten and the memberof overlay run once per batch rather than
+once per user:
+
+	batcher = MemberBatcher(adminConn, replica)
+	batcher.start()
+	ticket = batcher.add(tag, userDN, userDN)
+	ticket.wait(5)
+
+The connection must be able to write 'member' in any tag (an LDAPAdmin
+account), so the server's ACLs do not protect the tags from the users.
+Instead each request is checked before it is queued: a user may only
+add or remove their own DN, and the ACLs in devslapd/slapd.conf.acls
+must let them make that change themselves, which they do not for a
+controlled tag (one with a manager) unless they are in its manager
+group (T10030). The second argument makes that check with
+canModify(requester, dn, modlist); a replica.LocalReplica does, from
+its copy of the tags and people, and so does an AclCheck over a
+ditmodel.DIT. Each modify carries the
+Permissive Modify control, so adding a member who is already there or
+removing one who is not is not an error and does not spoil the rest of
+the batch. If a batch fails for any other reason its changes are tried
+one at a time so that each request gets its own answer. Requests for
+the same tag and member that are still waiting replace each other: the
+last one wins.
+
+A batch is sent when max_batch requests are waiting or the oldest has
+waited max_delay seconds, or when flush() is called.
+"""
+
+import time
+import threading
+import ldap
+import ldap.controls
+import ldap.filter
+from ldapfilter import normaliseDN
+from pagedsearch import VirtualListView, VLVRequestControl
+from aclengine import AclPolicy
+
+people_node = 'ou=people,dc=mozillians,dc=org'
+
+# Permissive Modify (as used by Active Directory, and understood by slapd)
+permissive_modify_oid = '1.2.840.113556.1.4.1413'
+
+def memberFilter( tag ):
+    return '(memberOf=%s)' % ldap.filter.escape_filter_chars(tag)
+
+# How many people are in a tag, without fetching them
+#
+def memberCount( conn, tag ):
+    view = VirtualListView(conn, people_node, ldap.SCOPE_SUBTREE, memberFilter(tag),
+                           [ '1.1' ], page_size=1)
+    view.fetch(VLVRequestControl(0, 0, 1, 0))
+    return view.content_count
+
+# A VirtualListView of the members of a tag, page_size at a time
+#
+def memberPages( conn, tag, attrlist=None, page_size=15,
+                 sort=('cn:caseIgnoreOrderingMatch',) ):
+    return VirtualListView(conn, people_node, ldap.SCOPE_SUBTREE, memberFilter(tag),
+                           attrlist, sort, page_size)
+
+def isMember( conn, tag, dn ):
+    return bool(conn.compare_s(tag, 'member', dn))
+
+########################################################################
+# Batching membership changes
+########################################################################
+
+class Ticket:
+    def __init__(self, tag, member, adding):
+        self.tag = tag
+        self.member = member
+        self.adding = adding
+        self.error = None
+        self.event = threading.Event()
+
+    def finish(self, error=None):
+        self.error = error
+        self.event.set()
+
+    # Wait for the change to be made. Returns False on timeout and
+    # raises the error if it failed.
+    #
+    def wait(self, timeout=None):
+        self.event.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.event.isSet()
+
+
+# The ACL check for a MemberBatcher from a DIT the caller keeps current
+#
+class AclCheck:
+    def __init__(self, dit, policy=None):
+        self.dit = dit
+        self.policy = policy or AclPolicy()
+
+    def canModify(self, requester, dn, modlist):
+        return self.policy.canModify(self.dit, requester, dn, modlist)
+
+
+class MemberBatcher:
+    def __init__(self, conn, access, max_batch=500, max_delay=0.2, clock=time.time):
+        self.conn = conn
+        self.access = access
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.clock = clock
+        self.condition = threading.Condition()
+        # tag -> { normalised member DN: [ticket, ...] }, the last ticket deciding
+        self.pending = {}
+        self.waiting = 0
+        self.oldest = None
+        self.thread = None
+        self.stopping = False
+        self.batches = 0
+        self.modifies = 0
+
+    def add(self, tag, member, requester):
+        return self.request(tag, member, requester, True)
+
+    def remove(self, tag, member, requester):
+        return self.request(tag, member, requester, False)
+
+    # Queue a change if requester could make it. Returns a Ticket.
+    #
+    def request(self, tag, member, requester, adding):
+        ticket = Ticket(tag, member, adding)
+        if normaliseDN(member) != normaliseDN(requester):
+            ticket.finish(ldap.INSUFFICIENT_ACCESS({ 'desc': 'Insufficient access',
+                                                    'info': 'only your own DN may be changed' }))
+            return ticket
+        if adding:
+            op = ldap.MOD_ADD
+        else:
+            op = ldap.MOD_DELETE
+        if not self.access.canModify(requester, tag, [ (op, 'member', [ member ]) ]):
+            ticket.finish(ldap.INSUFFICIENT_ACCESS({ 'desc': 'Insufficient access' }))
+            return ticket
+        with self.condition:
+            tickets = self.pending.setdefault(normaliseDN(tag), {})
+            tickets.setdefault(normaliseDN(member), []).append(ticket)
+            self.waiting += 1
+            if self.oldest is None:
+                self.oldest = self.clock()
+                self.condition.notify()
+            elif self.waiting >= self.max_batch:
+                self.condition.notify()
+        return ticket
+
+    # Send everything that is waiting
+    #
+    def flush(self):
+        with self.condition:
+            pending = self.pending
+            self.pending = {}
+            self.waiting = 0
+            self.oldest = None
+        for members in pending.values():
+            # The tag's DN as the first request gave it
+            self.apply(members.values()[0][0].tag, members)
+
+    # The modify for one tag: the last request for each member decides
+    #
+    def modlist(self, members):
+        adds = []
+        removes = []
+        for tickets in members.values():
+            last = tickets[-1]
+            if last.adding:
+                adds.append(last.member)
+            else:
+                removes.append(last.member)
+        modlist = []
+        if adds:
+            modlist.append( (ldap.MOD_ADD, 'member', adds) )
+        if removes:
+            modlist.append( (ldap.MOD_DELETE, 'member', removes) )
+        return modlist
+
+    def modify(self, tag, modlist):
+        self.modifies += 1
+        self.conn.modify_ext_s(tag, modlist,
+                               serverctrls=[ ldap.controls.RequestControl(permissive_modify_oid,
+                                                                          True) ])
+
+    def apply(self, tag, members):
+        self.batches += 1
+        try:
+            self.modify(tag, self.modlist(members))
+        except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.NO_SUCH_OBJECT), e:
+            # Nothing more would work one at a time
+            self.finishAll(members, e)
+            return
+        except ldap.LDAPError:
+            for member, tickets in members.items():
+                try:
+                    self.modify(tag, self.modlist({ member: tickets }))
+                except ldap.LDAPError, e:
+                    self.finishAll({ member: tickets }, e)
+                else:
+                    self.finishAll({ member: tickets })
+            return
+        self.finishAll(members)
+
+    def finishAll(self, members, error=None):
+        for tickets in members.values():
+            for ticket in tickets:
+                ticket.finish(error)
+
+    ####################################################################
+    # The background thread
+    ####################################################################
+
+    # Is it time to send a batch?
+    #
+    def due(self):
+        if self.oldest is None:
+            return False
+        return self.waiting >= self.max_batch or self.clock() - self.oldest >= self.max_delay
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopping and not self.due():
+                    if self.oldest is None:
+                        self.condition.wait()
+                    else:
+                        self.condition.wait(self.max_delay - (self.clock() - self.oldest))
+                stopping = self.stopping
+            self.flush()
+            if stopping:
+                return
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='member batcher')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    # Send what is waiting and stop the thread
+    #
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
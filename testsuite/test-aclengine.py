@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+# Tests for the offline ACL engine
+#
+# These need no server: the ACLs are evaluated by aclengine.py against the
+# test data held in memory. The cases follow the ones in test-ldap-acls.py
+# so that the engine and slapd can be seen to agree.
+
+import os
+import tempfile
+import unittest
+from aclengine import AclPolicy, loadTestDIT, showMask
+
+ldap_rootDN = 'cn=root,dc=mozillians,dc=org'
+ldap_suffix = 'dc=mozillians,dc=org'
+ldap_applicant001DN = 'uniqueIdentifier=test001,ou=people,dc=mozillians,dc=org'
+ldap_applicant002DN = 'uniqueIdentifier=test002,ou=people,dc=mozillians,dc=org'
+ldap_mozillian011DN = 'uniqueIdentifier=test011,ou=people,dc=mozillians,dc=org'
+ldap_mozillian012DN = 'uniqueIdentifier=test012,ou=people,dc=mozillians,dc=org'
+ldap_mozillian013DN = 'uniqueIdentifier=test013,ou=people,dc=mozillians,dc=org'
+ldap_link013DN = 'uniqueIdentifier=1309526546.511499282,uniqueIdentifier=test013,ou=people,dc=mozillians,dc=org'
+ldap_replicatorDN = 'uid=replicator,ou=accounts,ou=system,dc=mozillians,dc=org'
+ldap_LDAPAdminDN = 'uid=LDAPAdmin,ou=accounts,ou=system,dc=mozillians,dc=org'
+ldap_regAgentDN = 'uid=regAgent,ou=accounts,ou=system,dc=mozillians,dc=org'
+test_tag_1 = 'uniqueIdentifier=test-tag-001,ou=tags,dc=mozillians,dc=org'
+test_tag_2 = 'uniqueIdentifier=test-tag-002,ou=tags,dc=mozillians,dc=org'
+test_tag_3 = 'uniqueIdentifier=test-tag-003,ou=tags,dc=mozillians,dc=org'
+test_tag_999 = 'uniqueIdentifier=test-tag-999,ou=tags,dc=mozillians,dc=org'
+
+# Loading the DIT is the slow part, so it is shared by all tests
+policy = AclPolicy(rootDN=ldap_rootDN)
+dit = loadTestDIT()
+
+class AclEngineTests(unittest.TestCase):
+
+    def assertMask(self, requester, dn, attr, expected, value=None):
+        mask = showMask(policy.mask(dit, requester, dn, attr, value))
+        self.assertEqual(mask, expected,
+                         "%s on %s of %s: expected %s, got %s" %
+                         (requester or 'anon', attr, dn, expected, mask))
+
+    def test_anon_read_suffix(self):
+        self.assertMask('', ldap_suffix, 'entry', '=rscxd')
+        self.assertMask('', '', 'objectClass', '=rscxd')
+
+    def test_anon_find_user(self):
+        self.assertMask('', ldap_applicant001DN, 'uid', '=scxd')
+        self.assertMask('', ldap_applicant001DN, 'uniqueIdentifier', '=rscxd')
+        self.assertMask('', ldap_applicant001DN, 'cn', '=0')
+        self.assertMask('', ldap_applicant001DN, 'userPassword', '=xd')
+
+    def test_applicant_read_others(self):
+        self.assertMask(ldap_applicant001DN, ldap_mozillian011DN, 'cn', '=0')
+        self.assertMask(ldap_applicant001DN, ldap_mozillian011DN, 'uid', '=scxd')
+
+    def test_mozillian_read_others(self):
+        self.assertMask(ldap_mozillian011DN, ldap_applicant001DN, 'cn', '=rscxd')
+        self.assertFalse(policy.allowed(dit, ldap_mozillian011DN, ldap_applicant001DN, 'cn', 'write'))
+
+    def test_user_modify_self(self):
+        self.assertMask(ldap_applicant001DN, ldap_applicant001DN, 'cn', '=wrscxd')
+        self.assertMask(ldap_applicant001DN, ldap_applicant001DN, 'userPassword', '=w')
+        self.assertTrue(policy.canModify(dit, ldap_applicant001DN, ldap_applicant001DN,
+                                         [ (2, 'cn', [ 'New Name' ]) ]))
+
+    def test_vouching(self):
+        # A Mozillian may add their own DN as a voucher, but no other
+        self.assertTrue(policy.canModify(dit, ldap_mozillian011DN, ldap_applicant001DN,
+                                         [ (0, 'mozilliansVouchedBy', ldap_mozillian011DN) ]))
+        self.assertFalse(policy.canModify(dit, ldap_mozillian011DN, ldap_applicant001DN,
+                                          [ (0, 'mozilliansVouchedBy', ldap_mozillian012DN) ]))
+        self.assertFalse(policy.canModify(dit, ldap_applicant001DN, ldap_applicant002DN,
+                                          [ (0, 'mozilliansVouchedBy', ldap_applicant001DN) ]))
+        self.assertFalse(policy.canModify(dit, ldap_mozillian011DN, ldap_mozillian011DN,
+                                          [ (1, 'mozilliansVouchedBy', None) ]))
+
+    def test_links(self):
+        self.assertMask(ldap_mozillian013DN, ldap_link013DN, 'mozilliansServiceID', '=wrscxd')
+        self.assertMask(ldap_mozillian012DN, ldap_link013DN, 'mozilliansServiceID', '=rscxd')
+        self.assertMask(ldap_applicant001DN, ldap_link013DN, 'mozilliansServiceID', '=0')
+
+    def test_tag_membership(self):
+        # Everyone may add and remove themselves, nobody may add others
+        for user in (ldap_applicant001DN, ldap_mozillian011DN):
+            self.assertTrue(policy.canModify(dit, user, test_tag_3, [ (0, 'member', user) ]))
+            self.assertTrue(policy.canModify(dit, user, test_tag_1, [ (1, 'member', user) ]))
+            self.assertFalse(policy.canModify(dit, user, test_tag_3,
+                                              [ (0, 'member', ldap_mozillian012DN) ]))
+        # Mozillians can read the members, applicants can only search for themselves
+        self.assertMask(ldap_mozillian011DN, test_tag_1, 'member', '=rscxd', ldap_applicant001DN)
+        self.assertMask(ldap_applicant001DN, test_tag_1, 'member', '=wsc', ldap_applicant001DN)
+        self.assertMask(ldap_applicant001DN, test_tag_1, 'member', '=0', ldap_mozillian011DN)
+
+    def test_controlled_tag(self):
+        # Members of the manager tag control the membership
+        self.assertTrue(policy.canModify(dit, ldap_mozillian011DN, test_tag_2,
+                                         [ (0, 'member', ldap_mozillian012DN) ]))
+        self.assertFalse(policy.canModify(dit, ldap_mozillian012DN, test_tag_2,
+                                          [ (0, 'member', ldap_mozillian011DN) ]))
+
+    def test_add_tag(self):
+        tag = { 'objectClass': [ 'mozilliansGroup' ], 'uniqueIdentifier': [ 'test-tag-999' ],
+                'cn': [ 'Test Tag 999' ], 'owner': [ ldap_mozillian011DN ] }
+        self.assertTrue(policy.canAdd(dit, ldap_mozillian011DN, test_tag_999, tag))
+        # Mozillians must make themselves the owner
+        self.assertFalse(policy.canAdd(dit, ldap_mozillian012DN, test_tag_999, tag))
+        tag['owner'] = [ ldap_applicant001DN ]
+        self.assertFalse(policy.canAdd(dit, ldap_applicant001DN, test_tag_999, tag))
+
+    def test_system_accounts(self):
+        self.assertMask(ldap_replicatorDN, ldap_mozillian011DN, 'userPassword', '=rscxd')
+        self.assertMask(ldap_mozillian011DN, ldap_regAgentDN, 'cn', '=0')
+        self.assertMask(ldap_regAgentDN, ldap_regAgentDN, 'userPassword', '=w')
+        self.assertTrue(policy.canDelete(dit, ldap_LDAPAdminDN, ldap_applicant002DN))
+        self.assertFalse(policy.canDelete(dit, ldap_mozillian011DN, ldap_applicant002DN))
+
+    def test_rootDN(self):
+        self.assertTrue(policy.allowed(dit, ldap_rootDN, ldap_regAgentDN, 'userPassword', 'manage'))
+
+    def test_visible(self):
+        entry = policy.visible(dit, '', ldap_applicant001DN)
+        self.assertEqual(sorted(entry.keys()), [ 'uniqueIdentifier' ])
+        self.assertEqual(policy.visible(dit, ldap_mozillian011DN, ldap_regAgentDN), None)
+
+    def test_bare_control(self):
+        # 'by * break' with no access adds nothing, so the read given
+        # by the first clause survives into the next statement
+        fd, filename = tempfile.mkstemp(suffix='.acls')
+        os.write(fd, 'access to dn.subtree="%s"\n'
+                     '\tby users read continue\n'
+                     '\tby * break\n'
+                     'access to *\n'
+                     '\tby users +c\n' % ldap_suffix)
+        os.close(fd)
+        try:
+            bare = AclPolicy(filename)
+        finally:
+            os.unlink(filename)
+        self.assertEqual(showMask(bare.mask(dit, ldap_mozillian011DN, ldap_applicant001DN, 'cn')),
+                         '=rscxd')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+# Tests for the bound connection pools
+#
+# These need no server: the pools are given a factory that makes
+# connections which only record what is done with them.
+
+import unittest
+import ldap
+from connpool import BindPool, ServicePool
+from fakeldap import Clock
+
+ldap_applicant001DN = 'uniqueIdentifier=test001,ou=people,dc=mozillians,dc=org'
+ldap_mozillian011DN = 'uniqueIdentifier=test011,ou=people,dc=mozillians,dc=org'
+ldap_regAgentDN = 'uid=regAgent,ou=accounts,ou=system,dc=mozillians,dc=org'
+
+class FakeConnection:
+    def __init__(self, url):
+        self.url = url
+        self.bound = None
+        self.unbound = False
+        self.sent = []
+
+    def simple_bind_s(self, dn, password):
+        if password not in ('secret', 'changed'):
+            raise ldap.INVALID_CREDENTIALS({'desc': 'Invalid credentials'})
+        self.bound = dn
+
+    def unbind_s(self):
+        self.unbound = True
+
+    def modify_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        self.sent.append( (dn, serverctrls) )
+
+    def passwd_s(self, user, oldpw, newpw, serverctrls=None, clientctrls=None):
+        self.sent.append( (user, serverctrls) )
+
+
+class ConnPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.pool = BindPool('ldap://localhost/', size=2, idle_timeout=60,
+                             factory=FakeConnection, clock=self.clock)
+
+    def test_reuse(self):
+        with self.pool.connection(ldap_applicant001DN, 'secret') as first:
+            pass
+        with self.pool.connection(ldap_applicant001DN.upper(), 'secret') as second:
+            self.assertTrue(first is second)
+        self.assertEqual(self.pool.binds, 1)
+
+    def test_wrong_password(self):
+        with self.pool.connection(ldap_applicant001DN, 'secret'):
+            pass
+        self.assertRaises(ldap.INVALID_CREDENTIALS, self.pool.get, ldap_applicant001DN, 'guess')
+        self.assertEqual(self.pool.binds, 1)
+
+    def test_lru_eviction(self):
+        conns = [ self.pool.get(dn, 'secret') for dn in
+                  (ldap_applicant001DN, ldap_mozillian011DN, ldap_regAgentDN) ]
+        for conn in conns:
+            self.pool.put(conn, conn.bound, 'secret')
+        self.assertTrue(conns[0].unbound)
+        self.assertEqual(self.pool.evictions, 1)
+        self.assertTrue(self.pool.get(ldap_mozillian011DN, 'secret') is conns[1])
+
+    def test_idle_timeout(self):
+        conn = self.pool.get(ldap_applicant001DN, 'secret')
+        self.pool.put(conn, ldap_applicant001DN, 'secret')
+        self.clock.now += 61
+        self.assertFalse(self.pool.get(ldap_applicant001DN, 'secret') is conn)
+        self.assertTrue(conn.unbound)
+        self.assertEqual(self.pool.expired, 1)
+
+    def test_password_changed(self):
+        idle = self.pool.get(ldap_applicant001DN, 'secret')
+        conn = self.pool.get(ldap_applicant001DN, 'secret')
+        self.pool.put(idle, ldap_applicant001DN, 'secret')
+        conn.passwd_s(None, 'secret', 'changed')
+        self.assertTrue(idle.unbound)
+        # Neither connection is handed back for the old password
+        self.pool.put(conn, ldap_applicant001DN, 'secret')
+        self.assertTrue(conn.unbound)
+        self.assertEqual(len(self.pool.idle), 0)
+
+        # A change made elsewhere is noticed when the new password binds
+        old = self.pool.get(ldap_mozillian011DN, 'secret')
+        self.pool.put(old, ldap_mozillian011DN, 'secret')
+        new = self.pool.get(ldap_mozillian011DN, 'changed')
+        self.assertTrue(old.unbound)
+        self.pool.put(new, ldap_mozillian011DN, 'changed')
+        self.assertTrue(self.pool.get(ldap_mozillian011DN, 'changed') is new)
+
+        # So is a modify of userPassword
+        conn = self.pool.get(ldap_mozillian011DN, 'changed')
+        conn.modify_s(ldap_applicant001DN, [ (ldap.MOD_REPLACE, 'userPassword', 'x') ])
+        self.assertEqual(self.pool.generations[ldap_applicant001DN.lower()], 2)
+
+    def test_dead_connection_dropped(self):
+        try:
+            with self.pool.connection(ldap_applicant001DN, 'secret') as conn:
+                raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        except ldap.SERVER_DOWN:
+            pass
+        self.assertTrue(conn.unbound)
+        self.assertEqual(len(self.pool.idle), 0)
+
+    def test_proxied_authz(self):
+        service = ServicePool('ldap://localhost/', ldap_regAgentDN, 'secret', size=2,
+                              factory=FakeConnection)
+        conns = [ service.actingAs(dn).conn for dn in
+                  (ldap_applicant001DN, ldap_mozillian011DN, ldap_applicant001DN) ]
+        self.assertTrue(conns[2] is conns[0])
+        self.assertEqual([ c.bound for c in conns ], [ ldap_regAgentDN ] * 3)
+
+        service.actingAs(ldap_mozillian011DN).modify_s(ldap_mozillian011DN, [])
+        dn, controls = conns[1].sent[0]
+        self.assertEqual(controls[0].controlType, '2.16.840.1.113730.3.4.18')
+        self.assertEqual(controls[0].encodedControlValue, 'dn:' + ldap_mozillian011DN)
+
+        # The _ext variants carry the control too, and nothing is sent without it
+        proxied = service.actingAs(ldap_applicant001DN)
+        proxied.modify_ext_s(ldap_applicant001DN, [])
+        dn, controls = conns[0].sent[0]
+        self.assertEqual(controls[0].encodedControlValue, 'dn:' + ldap_applicant001DN)
+        self.assertRaises(AttributeError, getattr, proxied, 'simple_bind_s')
+        self.assertRaises(AttributeError, getattr, proxied, 'extop_s')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Tests for the in-memory DIT
+#
+# These need no server. Searches that use the indexes are checked against
+# the same searches on a DIT without indexes, which has to walk the tree.
+
+import unittest
+from ldapfilter import parseFilter
+from ditmodel import DIT, Base64Value, buildFiles, NoSuchObject
+from ditmodel import SCOPE_BASE, SCOPE_ONELEVEL, SCOPE_SUBTREE
+
+ldap_suffix = 'dc=mozillians,dc=org'
+people_node = 'ou=people,dc=mozillians,dc=org'
+ldap_applicant001DN = 'uniqueIdentifier=test001,ou=people,dc=mozillians,dc=org'
+ldap_mozillian011DN = 'uniqueIdentifier=test011,ou=people,dc=mozillians,dc=org'
+test_tag_1 = 'uniqueIdentifier=test-tag-001,ou=tags,dc=mozillians,dc=org'
+
+files = buildFiles() + [ 'setup.ldif' ]
+
+indexed = DIT()
+indexed.loadLdif(*files)
+unindexed = DIT({}, False)
+unindexed.loadLdif(*files)
+
+class DitModelTests(unittest.TestCase):
+
+    def searchBoth(self, base, scope, filterstr):
+        found = [ e.ndn for e in indexed.search(base, scope, filterstr) ]
+        expected = [ e.ndn for e in unindexed.search(base, scope, filterstr) ]
+        self.assertEqual(found, expected, "%s differs with indexes" % filterstr)
+        return found
+
+    def test_search_matches_walk(self):
+        for filterstr in [ '(objectClass=mozilliansGroup)',
+                           '(uid=test001)',
+                           '(cn=*Mozillian*)',
+                           '(&(objectClass=inetOrgPerson)(sn=01*))',
+                           '(|(uid=test011)(uniqueIdentifier=test-tag-001))',
+                           '(&(cn=*)(!(mozilliansVouchedBy=*)))',
+                           '(member=' + ldap_mozillian011DN + ')' ]:
+            self.searchBoth(ldap_suffix, SCOPE_SUBTREE, filterstr)
+            self.searchBoth(people_node, SCOPE_ONELEVEL, filterstr)
+
+    def test_scopes(self):
+        self.assertEqual(self.searchBoth(ldap_applicant001DN, SCOPE_BASE, '(objectClass=*)'),
+                         [ ldap_applicant001DN.lower() ])
+        self.assertEqual(len(self.searchBoth(ldap_suffix, SCOPE_ONELEVEL, '(objectClass=*)')), 4)
+        self.assertRaises(NoSuchObject, indexed.search, 'ou=nowhere,' + ldap_suffix)
+
+    def test_uid_index(self):
+        self.assertEqual(indexed.candidates(parseFilter('(uid=test001)')),
+                         set([ ldap_applicant001DN.lower() ]))
+        self.assertEqual(unindexed.candidates(parseFilter('(uid=test001)')), None)
+
+    def test_lazy_binary(self):
+        entry = [ e for e in indexed.entries.values() if 'jpegphoto' in e.attrs ][0]
+        self.assertTrue(isinstance(entry.attrs['jpegphoto'][0], Base64Value))
+        self.assertTrue(entry.get('jpegPhoto')[0].startswith('\xff\xd8'))
+        self.assertFalse(isinstance(entry.attrs['jpegphoto'][0], Base64Value))
+
+    def test_interned_names(self):
+        first = [ k for k in indexed.get(ldap_applicant001DN).attrs if k == 'cn' ][0]
+        second = [ k for k in indexed.get(ldap_mozillian011DN).attrs if k == 'cn' ][0]
+        self.assertTrue(first is second)
+
+    def test_memberof(self):
+        dit = DIT()
+        dit.loadLdif(*files)
+        self.assertEqual(dit.get(ldap_mozillian011DN).get('memberOf'), [ test_tag_1 ])
+        self.assertEqual([ e.dn for e in dit.search(people_node, SCOPE_SUBTREE,
+                                                    '(memberOf=%s)' % test_tag_1) ],
+                         [ ldap_applicant001DN, ldap_mozillian011DN ])
+        dit.modify(test_tag_1, [ (1, 'member', [ ldap_mozillian011DN ]) ])
+        self.assertEqual(dit.get(ldap_mozillian011DN).get('memberOf'), [])
+        dit.delete(test_tag_1)
+        self.assertEqual(dit.get(ldap_applicant001DN).get('memberOf'), [])
+        self.assertEqual(dit.search(people_node, SCOPE_SUBTREE, '(memberOf=%s)' % test_tag_1), [])
+
+if __name__ == '__main__':
+    unittest.main()
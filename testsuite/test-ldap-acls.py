@@ -12,11 +12,15 @@ Andrew Findlay
 """
 
 import sys
+import atexit
 import unittest
 import re
 import ldap
-import ldap.modlist
-from ldif import LDIFParser
+from ldapfixtures import ConnectionCache, ChangeJournal, LdifSnapshot, journalFactory
+# Utility functions for looking at search results
+from ldapresult import getAttrNames, getAttrValueList, getAttrValue, attrValueMatch
+from pagedsearch import PagedSearch
+from asyncsearch import fetchProfile
 
 ########################################################################
 # Configuration
@@ -98,105 +102,66 @@ setup_ldif = 'setup.ldif'
 global entry_list
 entry_list = []
 
-########################################################################
-# Utility functions
-########################################################################
+# Bound connections are shared by all tests in a run
+connection_cache = None
 
-# Get list of attributes in result
-#
-def getAttrNames ( ldap_result ):
-    # ldap_result has the form:
-    # (dn, dict)
-    # where dict has a list of values for each named attribute
-
-    return ldap_result[1].keys()
-
-# Get list of values for attribute
-# If there is no such attribute then we return an empty list
-#
-def getAttrValueList( ldap_result, attrname ):
-    # ldap_result has the form:
-    # (dn, dict)
-    # where dict has a list of values for each named attribute
-
-    # First problem: dictionary keys are case-sensitive.
-    #                Attribute names are not.
-    myattr = None
-    for k in ldap_result[1].keys():
-    	if k.lower() == attrname.lower():
-	    myattr = k
-    return ldap_result[1].get(myattr,[])
-
-# Get the first value of an attribute
-# If there is no such attribute then we return None
-#
-def getAttrValue( ldap_result, attrname ):
-    # ldap_result has the form:
-    # (dn, dict)
-    # where dict has a list of values for each named attribute
-    attr_list = getAttrValueList( ldap_result, attrname )
-    if not attr_list:
-	return None
-    else:
-	return attr_list[0]
-
-# Check for a value of an attribute that matches a given pattern
-#
-def attrValueMatch( ldap_result, attrname, pattern ):
-    attr_list = getAttrValueList( ldap_result, attrname )
-    if not attr_list:
-	return None
-    else:
-        for val in attr_list:
-	    # print "TESTING:", val
-	    if re.search(pattern,val):
-		return True
-    return False
-
-# Load an LDIF file
-# Used for setting up test cases
-#
-class LdifLoader(LDIFParser):
-    def handle(self,dn,entry):
-        # print dn
-	# Try to delete the entry before adding it, just in case...
-	try:
-	    self.ldap_handle.delete_s(dn)
-	except ldap.NO_SUCH_OBJECT:
-	    pass
-	# We need to delete this later
-	entry_list.append(dn)
-	# Add the entry
-	self.ldap_handle.add_s(dn,ldap.modlist.addModlist(entry))
+# Records the entries changed by each test so that only those are restored
+change_journal = ChangeJournal()
 
+# The contents of setup_ldif, loaded once per run
+setup_snapshot = None
 
 ########################################################################
 # Common test-fixture code
 ########################################################################
 
+def getConnectionCache():
+    global connection_cache
+
+    # Created on first use so that ldap_url can be changed before the tests run
+    if connection_cache is None:
+	connection_cache = ConnectionCache(ldap_url, journalFactory(change_journal))
+	atexit.register(closeConnectionCache)
+    return connection_cache
+
+def closeConnectionCache():
+    # Leave the server as we found it
+    if setup_snapshot:
+	setup_snapshot.unload(connection_cache.get('rootDN', ldap_rootDN, ldap_rootPW))
+	setup_snapshot.report()
+    connection_cache.report()
+    connection_cache.closeAll()
+
+# The test data is loaded by the first test to run.
+# After that each test puts back whatever it changed.
+#
+def getSetupSnapshot(ldap_conn):
+    global setup_snapshot
+
+    if setup_snapshot is None:
+	setup_snapshot = LdifSnapshot(setup_ldif, change_journal)
+	setup_snapshot.load(ldap_conn)
+    return setup_snapshot
+
 def setUpCommon(self):
     # Set up the connections, and by doing so implement test_T0005_anon_bind
+    # Each principal is only bound once per run: see ldapfixtures.ConnectionCache
     try:
-	self.ldap_anon = ldap.initialize(ldap_url)
+	cache = getConnectionCache()
+
+	self.ldap_anon = cache.get('anon')
 
-	self.ldap_rootDN = ldap.initialize(ldap_url)
-	self.ldap_rootDN.simple_bind_s(ldap_rootDN,ldap_rootPW)
+	self.ldap_rootDN = cache.get('rootDN', ldap_rootDN, ldap_rootPW)
 
-	ldifparser = LdifLoader(open(setup_ldif, 'r'), None)
-	ldifparser.ldap_handle = self.ldap_rootDN
-	ldifparser.parse()
+	getSetupSnapshot(self.ldap_rootDN)
 
-	self.ldap_applicant001 = ldap.initialize(ldap_url)
-	self.ldap_applicant001.simple_bind_s(ldap_applicant001DN,ldap_applicant001PW)
+	self.ldap_applicant001 = cache.get('applicant001', ldap_applicant001DN, ldap_applicant001PW)
 
-	self.ldap_mozillian011 = ldap.initialize(ldap_url)
-	self.ldap_mozillian011.simple_bind_s(ldap_mozillian011DN,ldap_mozillian011PW)
+	self.ldap_mozillian011 = cache.get('mozillian011', ldap_mozillian011DN, ldap_mozillian011PW)
 
-	self.ldap_mozillian012 = ldap.initialize(ldap_url)
-	self.ldap_mozillian012.simple_bind_s(ldap_mozillian012DN,ldap_mozillian012PW)
+	self.ldap_mozillian012 = cache.get('mozillian012', ldap_mozillian012DN, ldap_mozillian012PW)
 
-	self.ldap_sys999 = ldap.initialize(ldap_url)
-	self.ldap_sys999.simple_bind_s(ldap_sys999DN,ldap_sys999PW)
+	self.ldap_sys999 = cache.get('sys999', ldap_sys999DN, ldap_sys999PW)
 
     except ldap.LDAPError:
 		self.fail( "LDAP connection setup error " + str(sys.exc_info()[0]) )
@@ -205,25 +170,14 @@ def setUpCommon(self):
 def tearDownCommon(self):
     global entry_list
 
-    # We delete the longest DNs first to avoid trying to delete
-    # non-leaf objects
-    for dn in sorted(entry_list, key=len, reverse=True):
-	# print dn
-	# It is OK to ignore an error if we are deleting something that
-	# has gone already
-	try:
-	    self.ldap_rootDN.delete_s(dn)
-	except ldap.NO_SUCH_OBJECT:
-	    pass
-	
+    # Delete anything the test added and put back any test data it changed.
+    # Entries on entry_list are deleted even if the journal missed them.
+    setup_snapshot.restore(self.ldap_rootDN, entry_list)
+
     # We have deleted everything that was on the list
     entry_list = []
 
-    self.ldap_anon.unbind()
-    self.ldap_rootDN.unbind()
-    self.ldap_applicant001.unbind()
-    self.ldap_mozillian011.unbind()
-    self.ldap_sys999.unbind()
+    # The connections stay open for the next test
 
 
 # Changing password
@@ -373,6 +327,20 @@ class LdapUserTests(unittest.TestCase):
         except ldap.LDAPError:
 	    self.fail( "Anon cannot search under "+people_node+" " + str(sys.exc_info()[0]) )
 
+    def test_T0031_anon_search_multi_partial(self):
+	# As T0030, but reading the results as they arrive keeps the 2 entries
+	# that the server sends before it reports the size limit
+	try:
+	    search = PagedSearch(self.ldap_anon, people_node, ldap.SCOPE_SUBTREE,
+				 filterstr='(uid=test00*)', page_size=0)
+	    res = search.entries()
+        except ldap.LDAPError:
+	    self.fail( "Anon cannot search under "+people_node+" " + str(sys.exc_info()[0]) )
+
+	self.assertEqual( len(res), 2,
+		"Anon search for (uid=test00*) should return 2 entries before the limit. We got "+str(len(res)) )
+	self.assertTrue( search.truncated, "Anon search for (uid=test00*) should be reported as truncated" )
+
     def test_T0040_anon_fake_vouch_for_applicant(self):
 	# Anon should not be able to put a DN into
 	# an applicant's mozilliansVouchedBy attribute
@@ -583,6 +551,35 @@ class LdapUserTests(unittest.TestCase):
 	    self.fail( "Mozillian cannot search under "+people_node+" " + str(sys.exc_info()[0]) )
 
 
+    def test_T0032_mozillian_paged_search_multi(self):
+	# Mozillian reading a search a page at a time
+	# Each page is within the size limit; the server may still stop the
+	# search early, but nothing it sent is lost
+	try:
+	    search = PagedSearch(self.ldap_mozillian011, people_node, ldap.SCOPE_SUBTREE,
+				 filterstr='(uid=test*)', attrlist=['uid'], page_size=3)
+	    res = search.entries()
+        except ldap.LDAPError:
+	    self.fail( "Mozillian cannot do a paged search under "+people_node+" " + str(sys.exc_info()[0]) )
+
+	self.assertTrue( len(res) > 3,
+		"Paged search for (uid=test*) should return more than one page. We got "+str(len(res)) )
+	self.assertEqual( len(res), len(set([ dn.lower() for dn, attrs in res ])),
+		"Paged search returned the same entry more than once" )
+	self.assertEqual( search.entries(), res, "Repeating a paged search should not change the results" )
+
+    def test_T0033_mozillian_fetch_profile(self):
+	# Mozillian reading their own entry, links and tags in one go
+	try:
+	    profile = fetchProfile(self.ldap_mozillian011, ldap_mozillian011DN)
+        except ldap.LDAPError:
+	    self.fail( "Mozillian cannot fetch own profile " + str(sys.exc_info()[0]) )
+
+	self.assertEqual( profile['entry'].dn.lower(), ldap_mozillian011DN.lower(),
+		"Profile lookup should return the Mozillian's own entry" )
+	self.assertTrue( test_tag_1.lower() in [ dn.lower() for dn, attrs in profile['tags'] ],
+		"Profile lookup should find the tags the Mozillian is in" )
+
     def test_T9020_mozillian_read_table(self):
         try:
 	    res = self.ldap_mozillian011.search_s(
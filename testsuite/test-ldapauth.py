@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# Tests for logging in by uid
+#
+# These need no server: the connections only know the fixture users'
+# uids and passwords and count the requests made of them. SASL usernames
+# are mapped to entries with the authz-regexp rules in devslapd/slapd.conf.
+
+import re
+import shlex
+import unittest
+import ldap
+from ldapfilter import normaliseDN
+from ditmodel import slapd_conf
+from fakeldap import Clock
+from ldapauth import Authenticator
+
+ldap_applicant001DN = 'uniqueIdentifier=test001,ou=people,dc=mozillians,dc=org'
+ldap_mozillian011DN = 'uniqueIdentifier=test011,ou=people,dc=mozillians,dc=org'
+ldap_mozillian012DN = 'uniqueIdentifier=test012,ou=people,dc=mozillians,dc=org'
+ldap_regAgentDN = 'uid=regAgent,ou=accounts,ou=system,dc=mozillians,dc=org'
+
+# uid -> (DN, password), as the server sees it
+users = {}
+
+def invalid():
+    return ldap.INVALID_CREDENTIALS({'desc': 'Invalid credentials'})
+
+# The authz-regexp rules as (pattern, base, scope, filter)
+#
+def authzRules():
+    rules = []
+    text = re.sub(r'\n[ \t]+', ' ', open(slapd_conf).read())
+    for line in text.splitlines():
+        if line.startswith('authz-regexp'):
+            keyword, pattern, url = shlex.split(line)
+            base, attrs, scope, filterstr = url[len('ldap:///'):].split('?')
+            rules.append( (pattern, base, scope, filterstr) )
+    return rules
+
+rules = authzRules()
+
+# The entry that slapd would find for a SASL username, or None.
+# Cyrus SASL splits a realm off at the '@'.
+#
+def mapUsername( name ):
+    if '@' in name:
+        user, realm = name.rsplit('@', 1)
+        authc = 'uid=%s,cn=%s,cn=plain,cn=auth' % (user, realm)
+    else:
+        authc = 'uid=%s,cn=plain,cn=auth' % name
+    for pattern, base, scope, filterstr in rules:
+        match = re.match(pattern, authc)
+        if match:
+            uid = re.sub(r'\$(\d)', lambda m: match.group(int(m.group(1))), filterstr)[5:-1]
+            return findUid(base, scope, uid)
+    return None
+
+# What a search for uid finds (only the scopes the rules use)
+#
+def findUid( base, scope, uid ):
+    if uid not in users:
+        return None
+    dn = users[uid][0]
+    if scope in ('one', ldap.SCOPE_ONELEVEL) and \
+            normaliseDN(dn).split(',', 1)[1] != normaliseDN(base):
+        return None
+    return dn
+
+class FakeConnection:
+    def __init__(self):
+        self.bound = None
+        self.requests = 0
+        self.binds = 0
+
+    def simple_bind_s(self, dn, password):
+        self.requests += 1
+        self.binds += 1
+        for user_dn, user_pw in users.values():
+            if user_dn == dn and user_pw == password:
+                self.bound = dn
+                return
+        raise invalid()
+
+    def sasl_interactive_bind_s(self, who, auth):
+        self.requests += 1
+        self.binds += 1
+        dn = mapUsername(auth.cb_value_dict[ldap.sasl.CB_AUTHNAME])
+        password = auth.cb_value_dict[ldap.sasl.CB_PASS]
+        if dn is None or (dn, password) not in users.values():
+            raise invalid()
+        self.bound = dn
+
+    def whoami_s(self):
+        self.requests += 1
+        return 'dn:' + self.bound
+
+    def search_s(self, base, scope, filterstr, attrlist=None):
+        self.requests += 1
+        dn = findUid(base, scope, filterstr[len('(uid='):-1])
+        if dn is None:
+            return []
+        return [ (dn, { 'uniqueIdentifier': [ 'x' ] }) ]
+
+
+class LdapAuthTests(unittest.TestCase):
+
+    def setUp(self):
+        users.clear()
+        users['test001'] = (ldap_applicant001DN, 'secret')
+        users['test011'] = (ldap_mozillian011DN, 'secret')
+        self.clock = Clock()
+        self.auth = Authenticator(ttl=60, clock=self.clock)
+
+    def test_sasl_then_direct(self):
+        conn = FakeConnection()
+        self.assertEqual(self.auth.login(conn, 'test001', 'secret'), ldap_applicant001DN)
+        conn = FakeConnection()
+        self.assertEqual(self.auth.login(conn, 'TEST001', 'secret'), ldap_applicant001DN)
+        self.assertEqual(conn.requests, 1)
+        self.assertEqual(self.auth.hits, 1)
+
+    def test_wrong_password(self):
+        self.assertRaises(ldap.INVALID_CREDENTIALS,
+                          self.auth.login, FakeConnection(), 'test001', 'guess')
+        self.auth.login(FakeConnection(), 'test001', 'secret')
+        # One failed bind, as without the cache, and the DN stays cached
+        conn = FakeConnection()
+        self.assertRaises(ldap.INVALID_CREDENTIALS, self.auth.login, conn, 'test001', 'guess')
+        self.assertEqual(conn.binds, 1)
+        self.assertEqual(self.auth.lookup('test001'), ldap_applicant001DN)
+        self.assertRaises(ldap.INVALID_CREDENTIALS,
+                          self.auth.login, FakeConnection(), 'test001', '')
+
+    def test_uid_moved(self):
+        self.auth.login(FakeConnection(), 'test001', 'secret')
+        # test001 is renamed, and test011 takes the uid without us hearing about it
+        users['test001'] = (ldap_mozillian011DN, 'secret')
+        self.assertEqual(self.auth.login(FakeConnection(), 'test001', 'secret'),
+                         ldap_mozillian011DN)
+        self.assertEqual(self.auth.stale, 1)
+
+    def test_modify_invalidates(self):
+        self.auth.login(FakeConnection(), 'test001', 'secret')
+        self.auth.noteModify(ldap_applicant001DN.upper(), [ (ldap.MOD_REPLACE, 'uid', 'newname') ])
+        self.assertEqual(self.auth.lookup('test001'), None)
+        self.auth.login(FakeConnection(), 'test011', 'secret')
+        self.auth.noteModify(ldap_mozillian011DN, [ (ldap.MOD_REPLACE, 'cn', 'Someone') ])
+        self.assertEqual(self.auth.lookup('test011'), ldap_mozillian011DN)
+
+    def test_ttl(self):
+        self.auth.login(FakeConnection(), 'test001', 'secret')
+        self.clock.now += 61
+        self.assertEqual(self.auth.lookup('test001'), None)
+
+    def test_realm(self):
+        # Most uids are mail addresses, which SASL splits at the '@'
+        users['mary@mozilla.com'] = (ldap_mozillian012DN, 'secret')
+        users['mary'] = (ldap_mozillian011DN, 'other')
+        self.assertEqual(self.auth.login(FakeConnection(), 'mary@mozilla.com', 'secret'),
+                         ldap_mozillian012DN)
+        self.assertEqual(self.auth.login(FakeConnection(), 'mary', 'other'), ldap_mozillian011DN)
+
+    def test_people_only(self):
+        # Both ways of logging in find the same entries: not the system accounts
+        users['regAgent'] = (ldap_regAgentDN, 'secret')
+        self.assertRaises(ldap.INVALID_CREDENTIALS,
+                          self.auth.login, FakeConnection(), 'regAgent', 'secret')
+        auth = Authenticator(mode='search', search_conn=FakeConnection())
+        self.assertRaises(ldap.INVALID_CREDENTIALS,
+                          auth.login, FakeConnection(), 'regAgent', 'secret')
+
+    def test_search_mode(self):
+        auth = Authenticator(mode='search', search_conn=FakeConnection())
+        conn = FakeConnection()
+        self.assertEqual(auth.login(conn, 'test011', 'secret'), ldap_mozillian011DN)
+        self.assertRaises(ldap.INVALID_CREDENTIALS, auth.login, conn, 'nobody', 'secret')
+
+if __name__ == '__main__':
+    unittest.main()
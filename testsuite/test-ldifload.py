@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#
+# Tests for the pipelined LDIF loader
+#
+# These need no server: the connection keeps the entries itself and
+# answers each operation only after a few polls, in whatever order the
+# operations become due, as slapd would with several threads.
+
+import os
+import tempfile
+import unittest
+import ldap
+from ldapfilter import normaliseDN
+from fakeldap import AsyncConnection
+from ldifload import PipelinedLoader, Operation, addOperations, deleteOperations
+
+people = 'ou=people,dc=mozillians,dc=org'
+ldap_mozillian011DN = 'uniqueIdentifier=test011,' + people
+ldap_mozillian012DN = 'uniqueIdentifier=test012,' + people
+link_011 = 'uniqueIdentifier=link-1,' + ldap_mozillian011DN
+
+bulk = """dn: %(user)s
+objectClass: mozilliansPerson
+uniqueIdentifier: test011
+cn: Test 011
+
+dn: %(link)s
+objectClass: mozilliansLink
+uniqueIdentifier: link-1
+
+dn: %(user)s
+changetype: modify
+replace: cn
+cn: Test Eleven
+-
+
+dn: %(link)s
+changetype: delete
+
+""" % { 'user': ldap_mozillian011DN, 'link': link_011 }
+
+class FakeConnection(AsyncConnection):
+    def __init__(self, entries=()):
+        AsyncConnection.__init__(self)
+        self.entries = dict( [ (normaliseDN(dn), dict(attrs)) for dn, attrs in entries ] )
+
+    # Later operations are answered sooner, so order is not by luck
+    def queue(self, kind, dn, replies):
+        return AsyncConnection.queue(self, kind, dn, replies, max(1, 4 - len(self.pending)))
+
+    def parentExists(self, ndn):
+        parent = ndn.split(',', 1)[1]
+        if parent != people and parent not in self.entries:
+            raise ldap.NO_SUCH_OBJECT({ 'desc': 'No such object' })
+
+    def add_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        def replies():
+            ndn = normaliseDN(dn)
+            if ndn in self.entries:
+                raise ldap.ALREADY_EXISTS({ 'desc': 'Already exists' })
+            self.parentExists(ndn)
+            self.entries[ndn] = dict(modlist)
+            yield ldap.RES_ADD, []
+        return self.queue('add', dn, replies())
+
+    def modify_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        def replies():
+            entry = self.entries.get(normaliseDN(dn))
+            if entry is None:
+                raise ldap.NO_SUCH_OBJECT({ 'desc': 'No such object' })
+            for op, attr, values in modlist:
+                entry[attr] = values
+            yield ldap.RES_MODIFY, []
+        return self.queue('modify', dn, replies())
+
+    def delete_ext(self, dn, serverctrls=None, clientctrls=None):
+        def replies():
+            ndn = normaliseDN(dn)
+            if ndn not in self.entries:
+                raise ldap.NO_SUCH_OBJECT({ 'desc': 'No such object' })
+            if [ other for other in self.entries if other.endswith(',' + ndn) ]:
+                raise ldap.NOT_ALLOWED_ON_NONLEAF({ 'desc': 'Operation not allowed on non-leaf' })
+            del self.entries[ndn]
+            yield ldap.RES_DELETE, []
+        return self.queue('delete', dn, replies())
+
+
+class LdifLoadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = FakeConnection()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_parent_before_child(self):
+        fd, filename = tempfile.mkstemp(suffix='.ldif')
+        os.write(fd, bulk)
+        os.close(fd)
+        try:
+            report = PipelinedLoader([ self.conn ], window=4).loadFiles([ filename ])
+        finally:
+            os.unlink(filename)
+        self.assertEqual(report['errors'], [])
+        self.assertEqual(report['counts'], { 'add': 2, 'modify': 1, 'delete': 1 })
+        self.assertEqual(self.conn.entries.keys(), [ normaliseDN(ldap_mozillian011DN) ])
+        self.assertEqual(self.conn.entries.values()[0]['cn'], [ 'Test Eleven' ])
+
+    def test_window(self):
+        entries = [ ('uniqueIdentifier=test%03d,%s' % (n, people), { 'cn': [ str(n) ] })
+                    for n in range(50) ]
+        report = PipelinedLoader([ self.conn ], window=8).load(addOperations(entries))
+        self.assertEqual(report['operations'], 50)
+        self.assertEqual(len(self.conn.entries), 50)
+        self.assertEqual(self.conn.most, 8)
+
+    def test_already_exists(self):
+        self.conn.entries[normaliseDN(ldap_mozillian011DN)] = { 'cn': [ 'old' ] }
+        entries = [ (ldap_mozillian011DN, { 'cn': [ 'new' ] }) ]
+        report = PipelinedLoader([ self.conn ]).load(addOperations(entries))
+        self.assertEqual(report['counts'], { 'existing': 1 })
+        report = PipelinedLoader([ self.conn ], replace=True).load(addOperations(entries))
+        self.assertEqual(report['counts'], { 'replaced': 1 })
+        self.assertEqual(self.conn.entries[normaliseDN(ldap_mozillian011DN)]['cn'], [ 'new' ])
+
+    def test_missing_parent(self):
+        # The link comes before its user, so is held back until it is added;
+        # the other link's user never appears
+        orphan = 'uniqueIdentifier=link-2,' + ldap_mozillian012DN
+        operations = [ Operation('add', link_011, [ ('uniqueIdentifier', [ 'link-1' ]) ]),
+                       Operation('add', orphan, [ ('uniqueIdentifier', [ 'link-2' ]) ]),
+                       Operation('add', ldap_mozillian011DN, [ ('cn', [ 'Test 011' ]) ]),
+                       Operation('delete', ldap_mozillian012DN) ]
+        report = PipelinedLoader([ self.conn ], window=1).load(operations)
+        self.assertTrue(normaliseDN(link_011) in self.conn.entries)
+        self.assertEqual(report['counts'], { 'add': 2, 'absent': 1, 'failed': 1, 'retried': 2 })
+        self.assertEqual([ (kind, dn) for kind, dn, error in report['errors'] ],
+                         [ ('add', orphan) ])
+
+    def test_delete_children_first(self):
+        self.conn.entries[normaliseDN(ldap_mozillian011DN)] = {}
+        self.conn.entries[normaliseDN(link_011)] = {}
+        second = FakeConnection()
+        second.entries = self.conn.entries
+        loader = PipelinedLoader([ self.conn, second ])
+        # The delete of the user must wait for its link, on either connection
+        report = loader.load(deleteOperations([ link_011, ldap_mozillian011DN ]))
+        self.assertEqual(report['errors'], [])
+        self.assertEqual(report['counts'], { 'delete': 2 })
+        self.assertEqual(self.conn.entries, {})
+        second.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# Tests for the memory-mapped LDIF reader
+#
+# These need no server. The sample data has folded base64 jpegPhoto
+# values; the other cases are written to a temporary file.
+
+import os
+import base64
+import tempfile
+import unittest
+from ldifreader import LdifReader, LdifError, Base64Value, readEntries
+
+gerv_dn = 'uniqueIdentifier=1,ou=people,dc=mozillians,dc=org'
+
+changes = """version: 1
+
+# A content record, then one of each kind of change
+dn: uid=one,ou=people,dc=mozillians,dc=org
+objectClass: inetOrgPerson
+cn: One
+sn:: w4lsw6h2ZQ==
+description: folded
+  over two lines
+
+dn: uid=one,ou=people,dc=mozillians,dc=org
+changetype: modify
+add: mail
+mail: one@example.org
+mail: uno@example.org
+-
+replace: description
+description: changed
+-
+delete: telephoneNumber
+-
+
+dn:: dWlkPXR3byxvdT1wZW9wbGUsZGM9bW96aWxsaWFucyxkYz1vcmc=
+changetype: modrdn
+newrdn: uid=three
+deleteoldrdn: 0
+newsuperior: ou=tags,dc=mozillians,dc=org
+
+dn: uid=three,ou=tags,dc=mozillians,dc=org
+control: 1.2.840.113556.1.4.805 true
+changetype: delete
+
+"""
+
+# As slapcat writes it: no version line, comments and operational attributes
+slapcat = """# id=00000001
+dn: dc=mozillians,dc=org
+objectClass: dcObject
+objectClass: organization
+dc: mozillians
+o: Mozillians
+structuralObjectClass: organization
+entryUUID: 4d2c1a7e-0b9a-1031-8a5a-1b2f3c4d5e6f
+entryCSN: 20130101000000.000000Z#000000#000#000000
+
+# id=00000002
+dn: ou=people,dc=mozillians,dc=org
+objectClass: organizationalUnit
+ou: people
+
+"""
+
+class LdifReaderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.files = []
+
+    def tearDown(self):
+        for filename in self.files:
+            os.unlink(filename)
+
+    def write(self, text):
+        fd, filename = tempfile.mkstemp(suffix='.ldif')
+        os.write(fd, text)
+        os.close(fd)
+        self.files.append(filename)
+        return filename
+
+    def test_lazy_photo(self):
+        records = list(LdifReader('mozillians-sample-data.ldif'))
+        self.assertEqual(len(records), 11)
+        gerv = [ r for r in records if r.dn == gerv_dn ][0]
+        lazy = gerv.entry(frozenset([ 'jpegphoto' ]))
+        photo = lazy['jpegPhoto'][0]
+        self.assertTrue(isinstance(photo, Base64Value))
+        self.assertTrue(isinstance(photo.decode(), memoryview))
+        self.assertEqual(photo.decode()[:2].tobytes(), '\xff\xd8')
+        # Without lazy it is decoded, to the same bytes
+        self.assertEqual(gerv.entry()['jpegPhoto'][0], str(photo))
+        self.assertEqual(base64.b64decode(str(photo.encoded())), str(photo))
+
+    def test_unfolded_value_is_not_copied(self):
+        filename = self.write('dn: cn=x\njpegPhoto:: /9j/4AAQ\n')
+        value = list(LdifReader(filename))[0].entry(frozenset([ 'jpegphoto' ]))['jpegPhoto'][0]
+        self.assertTrue(isinstance(value.encoded(), buffer))
+        self.assertEqual(value.decode().tobytes(), '\xff\xd8\xff\xe0\x00\x10')
+
+    def test_change_records(self):
+        records = list(LdifReader(self.write(changes)))
+        self.assertEqual([ r.changetype for r in records ], [ 'add', 'modify', 'modrdn', 'delete' ])
+        entry = records[0].entry()
+        self.assertEqual(entry['sn'], [ '\xc3\x89l\xc3\xa8ve' ])
+        self.assertEqual(entry['description'], [ 'folded over two lines' ])
+        self.assertEqual(records[1].changes(), [
+            (0, 'mail', [ 'one@example.org', 'uno@example.org' ]),
+            (2, 'description', [ 'changed' ]),
+            (1, 'telephoneNumber', None) ])
+        self.assertEqual(records[2].dn, 'uid=two,ou=people,dc=mozillians,dc=org')
+        self.assertEqual(records[2].rename(),
+                         ('uid=three', False, 'ou=tags,dc=mozillians,dc=org'))
+        self.assertRaises(LdifError, records[3].entry)
+
+    def test_folded_comment(self):
+        # The continuation belongs to the comment, not to cn
+        filename = self.write('dn: cn=a\ncn: a\n# a comment\n  that wraps\nsn: b\n')
+        entry = list(LdifReader(filename))[0].entry()
+        self.assertEqual(entry['cn'], [ 'a' ])
+        self.assertEqual(entry['sn'], [ 'b' ])
+
+    def test_crlf(self):
+        text = changes.replace('\n', '\r\n')
+        records = list(LdifReader(self.write(text)))
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[0].entry()['description'], [ 'folded over two lines' ])
+        self.assertEqual(records[1].changes()[1], (2, 'description', [ 'changed' ]))
+
+    def test_slapcat(self):
+        entries = list(readEntries(self.write(slapcat)))
+        self.assertEqual([ dn for dn, attrs in entries ],
+                         [ 'dc=mozillians,dc=org', 'ou=people,dc=mozillians,dc=org' ])
+        self.assertEqual(entries[0][1]['entryUUID'], [ '4d2c1a7e-0b9a-1031-8a5a-1b2f3c4d5e6f' ])
+        self.assertEqual(list(LdifReader(self.write(''))), [])
+        self.assertRaises(LdifError, list, LdifReader(self.write('cn: no dn\n')))
+
+if __name__ == '__main__':
+    unittest.main()
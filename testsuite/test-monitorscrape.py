@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# Tests for the cn=Monitor scraper
+#
+# These need no server: the entries are what slapd 2.4 returns for the
+# search that the scraper makes.
+
+import json
+import unittest
+from monitorscrape import parseMonitor, rates, openMetrics, jsonSample
+
+def monitorEntries( searches, connections ):
+    return [
+        ('cn=Operations,cn=Monitor',
+         { 'monitorOpInitiated': [ str(searches + 10) ], 'monitorOpCompleted': [ str(searches + 9) ] }),
+        ('cn=Search,cn=Operations,cn=Monitor',
+         { 'monitorOpInitiated': [ str(searches) ], 'monitorOpCompleted': [ str(searches - 1) ] }),
+        ('cn=Bind,cn=Operations,cn=Monitor',
+         { 'monitorOpInitiated': [ '10' ], 'monitorOpCompleted': [ '10' ] }),
+        ('cn=Total,cn=Connections,cn=Monitor', { 'monitorCounter': [ str(connections) ] }),
+        ('cn=Current,cn=Connections,cn=Monitor', { 'monitorCounter': [ '3' ] }),
+        ('cn=Active,cn=Threads,cn=Monitor', { 'monitoredInfo': [ '2' ] }),
+        ('cn=State,cn=Threads,cn=Monitor', { 'monitoredInfo': [ 'running' ] }),
+        ('cn=Read,cn=Waiters,cn=Monitor', { 'monitorCounter': [ '1' ] }),
+        ('cn=Entries,cn=Statistics,cn=Monitor', { 'monitorCounter': [ '500' ] }),
+        ('cn=Database 2,cn=Databases,cn=Monitor',
+         { 'namingContexts': [ 'dc=mozillians,dc=org' ],
+           'olmMDBPagesMax': [ '65536' ], 'olmMDBPagesUsed': [ '1200' ],
+           'olmMDBReadersUsed': [ '4' ] }),
+    ]
+
+class MonitorScrapeTests(unittest.TestCase):
+
+    def test_parse(self):
+        values = parseMonitor(monitorEntries(100, 7))
+        self.assertEqual(values[('slapd_operations_initiated_total', (('op', 'search'),))], 100)
+        self.assertEqual(values[('slapd_operations_completed_total', (('op', 'bind'),))], 10)
+        self.assertEqual(values[('slapd_connections_total', ())], 7)
+        self.assertEqual(values[('slapd_connections_open', ())], 3)
+        self.assertEqual(values[('slapd_threads', (('state', 'active'),))], 2)
+        self.assertEqual(values[('slapd_db_map_pages_used', (('database', 'dc=mozillians,dc=org'),))],
+                         1200)
+        # The totals and the text thread state are left out
+        self.assertEqual(len([ k for k in values if k[0] == 'slapd_threads' ]), 1)
+        self.assertEqual(len([ k for k in values if k[0] == 'slapd_operations_initiated_total' ]), 2)
+
+    def test_rates(self):
+        before = { 'time': 100.0, 'values': parseMonitor(monitorEntries(100, 7)) }
+        after = { 'time': 110.0, 'values': parseMonitor(monitorEntries(150, 2)) }
+        result = rates(before, after)
+        self.assertEqual(result[('slapd_operations_initiated_total', (('op', 'search'),))], 5.0)
+        # Connections went down: slapd restarted and has accepted 2 since
+        self.assertEqual(result[('slapd_connections_total', ())], 0.2)
+        self.assertFalse(('slapd_connections_open', ()) in result)
+
+    def test_openmetrics(self):
+        sample = { 'time': 110.0, 'server': 'ldap://replica1:389/',
+                   'values': parseMonitor(monitorEntries(150, 9)),
+                   'rates': { ('slapd_operations_initiated_total', (('op', 'search'),)): 5.0 } }
+        text = openMetrics([ sample ])
+        lines = text.splitlines()
+        self.assertEqual(lines[-1], '# EOF')
+        self.assertTrue('# TYPE slapd_operations_initiated counter' in lines)
+        self.assertTrue('slapd_operations_initiated_total{server="ldap://replica1:389/",op="search"} 150'
+                        in lines)
+        self.assertTrue('slapd_operations_initiated_per_second{server="ldap://replica1:389/",op="search"} 5'
+                        in lines)
+        self.assertTrue('# TYPE slapd_connections counter' in lines)
+        self.assertTrue('# TYPE slapd_connections_open gauge' in lines)
+        # Every metric family is declared once
+        types = [ l.split()[2] for l in lines if l.startswith('# TYPE ') ]
+        self.assertEqual(len(types), len(set(types)))
+        json.dumps(jsonSample(sample))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# Tests for the local replica
+#
+# These need no server: the synchronization messages are made up from
+# the LDIF files that devslapd loads and given straight to the replica,
+# as syncrepl_poll() would.
+
+import os
+import shutil
+import tempfile
+import unittest
+import ldap
+from ditmodel import buildFiles, readLdif
+from ldapfilter import normaliseDN
+from replica import LocalReplica, replicated_subtrees, people_node, tags_node
+
+ldap_applicant001DN = 'uniqueIdentifier=test001,ou=people,dc=mozillians,dc=org'
+test_tag_1 = 'uniqueIdentifier=test-tag-001,ou=tags,dc=mozillians,dc=org'
+url = 'ldap://localhost:1389/'
+
+# The replicated entries in the test data, as (base, dn, attrs, uuid)
+entries = []
+for filename in buildFiles() + [ 'setup.ldif' ]:
+    for dn, attrs in readLdif(filename):
+        for base in replicated_subtrees:
+            ndn, nbase = normaliseDN(dn), normaliseDN(base)
+            if ndn == nbase or ndn.endswith(',' + nbase):
+                entries.append( (base, dn, attrs, 'uuid-%04d' % len(entries)) )
+
+def uuidOf( dn ):
+    return [ e[3] for e in entries if normaliseDN(e[1]) == normaliseDN(dn) ][0]
+
+def refreshed( **options ):
+    replica = LocalReplica(url, **options)
+    for base, dn, attrs, uuid in entries:
+        replica.entryChanged(base, dn, attrs, uuid)
+    for base in replicated_subtrees:
+        replica.setCookie(base, 'rid=000,csn=' + base)
+        replica.refreshDone(base)
+    return replica
+
+class ReplicaTests(unittest.TestCase):
+
+    def test_refresh(self):
+        replica = refreshed()
+        self.assertTrue(replica.wait(0))
+        self.assertEqual(len(replica), len(entries))
+        found = replica.search(people_node, ldap.SCOPE_SUBTREE, '(uid=test001)')
+        self.assertEqual([ dn for dn, attrs in found ], [ ldap_applicant001DN ])
+        # Passwords are not kept
+        self.assertFalse([ dn for dn, attrs in replica.search(people_node, ldap.SCOPE_SUBTREE,
+                                                              '(userPassword=*)') ])
+        self.assertEqual(replica.get(ldap_applicant001DN, [ 'uid' ]), { 'uid': [ 'test001' ] })
+        # Filtered by the ACLs when asked for a particular user
+        self.assertFalse('mail' in (replica.get(ldap_applicant001DN, requester='') or {}))
+        self.assertTrue('mail' in replica.get(ldap_applicant001DN, requester=ldap_applicant001DN))
+        self.assertRaises(ldap.NO_SUCH_OBJECT, replica.search, 'ou=system,dc=mozillians,dc=org',
+                          ldap.SCOPE_SUBTREE)
+
+    def test_filter_needs_search_access(self):
+        # An applicant cannot find another user by their hidden mail address
+        replica = refreshed()
+        other = 'uniqueIdentifier=test002,ou=people,dc=mozillians,dc=org'
+        mail = '(mail=test001@mozillians.org)'
+        found = replica.search(people_node, ldap.SCOPE_SUBTREE, mail)
+        self.assertEqual([ dn for dn, attrs in found ], [ ldap_applicant001DN ])
+        self.assertEqual(replica.search(people_node, ldap.SCOPE_SUBTREE, mail, requester=other), [])
+        # Nor by negating it: Undefined stays Undefined
+        self.assertEqual(replica.search(people_node, ldap.SCOPE_SUBTREE,
+                                        '(&(uid=test001)(!%s))' % mail, requester=other), [])
+        # The user can search their own
+        found = replica.search(people_node, ldap.SCOPE_SUBTREE, mail, requester=ldap_applicant001DN)
+        self.assertEqual([ dn for dn, attrs in found ], [ ldap_applicant001DN ])
+
+    def test_changes(self):
+        replica = refreshed()
+        uuid = uuidOf(ldap_applicant001DN)
+        attrs = replica.get(ldap_applicant001DN)
+        del attrs['cn']
+        attrs['displayName'] = [ 'Changed' ]
+        replica.entryChanged(people_node, ldap_applicant001DN, attrs, uuid)
+        self.assertEqual(replica.get(ldap_applicant001DN, [ 'cn', 'displayName' ]),
+                         { 'displayName': [ 'Changed' ] })
+        self.assertEqual(len(replica.search(people_node, ldap.SCOPE_SUBTREE, '(displayName=Changed)')), 1)
+
+        # A rename arrives as the entry under its new DN with the same entryUUID
+        renamed = 'uniqueIdentifier=renamed,ou=tags,dc=mozillians,dc=org'
+        attrs = replica.get(test_tag_1)
+        attrs['uniqueIdentifier'] = [ 'renamed' ]
+        replica.entryChanged(tags_node, renamed, attrs, uuidOf(test_tag_1))
+        self.assertEqual(replica.get(test_tag_1), None)
+        self.assertTrue(replica.get(renamed))
+
+        replica.entriesDeleted([ uuid, uuidOf(test_tag_1) ])
+        self.assertEqual(replica.get(ldap_applicant001DN), None)
+        self.assertEqual(replica.get(renamed), None)
+
+    def test_present_phase(self):
+        replica = refreshed()
+        # Resuming from a cookie: the server lists the unchanged entries
+        # and everything else has been deleted meanwhile
+        replica.refreshStarted(people_node)
+        kept = [ uuid for base, dn, attrs, uuid in entries
+                 if base == people_node and normaliseDN(dn) != normaliseDN(ldap_applicant001DN) ]
+        replica.entriesPresent(people_node, kept[:5])
+        replica.entriesPresent(people_node, kept[5:])
+        replica.entriesPresent(people_node, None, False)
+        self.assertEqual(replica.get(ldap_applicant001DN), None)
+        self.assertEqual(len(replica), len(entries) - 1)
+        # The other subtrees are left alone
+        self.assertTrue(replica.get(test_tag_1))
+
+    def test_statefile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            statefile = os.path.join(directory, 'replica.state')
+            replica = refreshed(statefile=statefile)
+            replica.entriesDeleted([ uuidOf(test_tag_1) ])
+            replica.save()
+
+            restarted = LocalReplica(url, statefile=statefile)
+            self.assertEqual(len(restarted), len(entries) - 1)
+            self.assertEqual(restarted.cookies[people_node], 'rid=000,csn=' + people_node)
+            self.assertEqual(restarted.uuids[uuidOf(ldap_applicant001DN)],
+                             normaliseDN(ldap_applicant001DN))
+            # Not ready until the server has been asked what changed
+            self.assertFalse(restarted.wait(0))
+
+            # A copy of some other server is not used
+            other = LocalReplica('ldap://elsewhere:389/', statefile=statefile)
+            self.assertEqual(len(other), 0)
+            self.assertEqual(other.cookies, {})
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+# Tests for checking LDIF against the schema
+#
+# These need no server. The standard schema is not part of this tree,
+# so the few standard definitions that the entries here use are written
+# to a temporary directory with a slapd.conf that includes them and the
+# Mozillians schema and content rules.
+
+import os
+import shutil
+import tempfile
+import unittest
+from ditmodel import devslapd_dir
+from schemacheck import readSchema, checkFiles, SchemaError
+
+schema_dir = os.path.join(devslapd_dir, '..', 'schema')
+
+standard = """
+attributetype ( 2.5.4.3 NAME ( 'cn' 'commonName' ) SUP name )
+attributetype ( 2.5.4.4 NAME ( 'sn' 'surname' ) SUP name )
+attributetype ( 2.5.4.42 NAME ( 'givenName' 'gn' ) SUP name )
+attributetype ( 2.5.4.13 NAME 'description'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.15{1024} )
+attributetype ( 2.5.4.31 NAME 'member' SUP distinguishedName )
+attributetype ( 2.5.4.32 NAME 'owner' SUP distinguishedName )
+attributetype ( 2.5.4.35 NAME 'userPassword'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.40{128} )
+attributetype ( 2.5.4.6 NAME ( 'c' 'countryName' ) SUP name
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.11 SINGLE-VALUE )
+attributetype ( 0.9.2342.19200300.100.1.1 NAME ( 'uid' 'userid' )
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.15{256} )
+attributetype ( 0.9.2342.19200300.100.1.3 NAME ( 'mail' 'rfc822Mailbox' )
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.26{256} )
+attributetype ( 0.9.2342.19200300.100.1.10 NAME 'manager'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 )
+attributetype ( 0.9.2342.19200300.100.1.44 NAME 'uniqueIdentifier'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.15{256} )
+attributetype ( 0.9.2342.19200300.100.1.60 NAME 'jpegPhoto'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.28 )
+attributetype ( 2.16.840.1.113730.3.1.241 NAME 'displayName'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.15 SINGLE-VALUE )
+attributetype ( 1.3.6.1.4.1.250.1.57 NAME 'labeledURI'
+	SYNTAX 1.3.6.1.4.1.1466.115.121.1.15 )
+objectclass ( 2.5.6.6 NAME 'person' SUP top STRUCTURAL
+	MUST ( sn $ cn ) MAY ( userPassword $ description ) )
+objectclass ( 2.5.6.7 NAME 'organizationalPerson' SUP person STRUCTURAL )
+objectclass ( 2.16.840.1.113730.3.2.2 NAME 'inetOrgPerson'
+	SUP organizationalPerson STRUCTURAL
+	MAY ( givenName $ displayName $ jpegPhoto $ mail $ uid $ labeledURI $ manager ) )
+"""
+
+config = """
+include %(std)s
+include %(schema)s/table.schema
+include %(schema)s/mozillians.schema
+include %(devslapd)s/slapd.conf.acls
+"""
+
+person = """dn: uniqueIdentifier=test011,ou=people,dc=mozillians,dc=org
+objectClass: inetOrgPerson
+objectClass: mozilliansPerson
+uniqueIdentifier: test011
+uid: test011
+cn: Test 011
+sn: 011
+displayName: Test Eleven
+mail: test011@mozillians.org
+mozilliansDateStarted: 20110615000000Z
+mozilliansVouchedBy: uniqueIdentifier=test012,ou=people,dc=mozillians,dc=org
+c: GB
+
+"""
+
+link = """dn: uniqueIdentifier=link-1,uniqueIdentifier=test011,ou=people,dc=mozillians,dc=org
+objectClass: mozilliansLink
+uniqueIdentifier: link-1
+mozilliansServiceURI: irc://irc.mozilla.org/
+mozilliansServiceID: test011
+
+"""
+
+class SchemaCheckTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='schemacheck-')
+        std = self.write('std.schema', standard)
+        self.config = self.write('slapd.conf', config % { 'std': std,
+            'schema': os.path.abspath(schema_dir), 'devslapd': os.path.abspath(devslapd_dir) })
+        self.schema = readSchema(self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        filename = os.path.join(self.directory, name)
+        open(filename, 'w').write(text)
+        return filename
+
+    def check(self, text, remove=(), add=()):
+        lines = [ line for line in text.strip().split('\n') if line not in remove ]
+        dn = lines[0].split(': ', 1)[1]
+        attrs = {}
+        for line in lines[1:] + list(add):
+            attr, value = line.split(': ', 1)
+            attrs.setdefault(attr, []).append(value)
+        return self.schema.checkEntry(dn, attrs)
+
+    def test_good_entries(self):
+        self.assertEqual(self.check(person), [])
+        self.assertEqual(self.check(link), [])
+
+    def test_content_rules(self):
+        self.assertEqual(self.check(person, remove=[ 'uid: test011' ]),
+                         [ 'missing required attribute uid' ])
+        self.assertEqual(self.check(link, add=[ 'objectClass: mozilliansObject' ]),
+                         [ 'objectClass mozilliansObject not allowed by dcrMozilliansLink' ])
+        self.assertEqual(self.check(link, add=[ 'objectClass: mozilliansGroup',
+                                                'cn: x', 'displayName: x' ]),
+                         [ 'invalid structural object class chain (mozilliansGroup/mozilliansLink)' ])
+
+    def test_attributes(self):
+        problems = self.check(person, add=[ 'displayName: Another', 'shoeSize: 9',
+                                            'mozilliansServiceID: x' ],
+                              remove=[ 'mozilliansDateStarted: 20110615000000Z' ])
+        self.assertEqual(sorted(problems), [ 'attribute displayName is single-valued',
+                                             'attribute mozilliansServiceID not allowed',
+                                             'unknown attribute type shoeSize' ])
+
+    def test_syntax(self):
+        problems = self.check(person, add=[ 'mozilliansVisibility: %s' % ('x' * 65) ],
+                              remove=[ 'c: GB', 'mozilliansDateStarted: 20110615000000Z' ])
+        self.assertEqual(problems, [ 'mozilliansVisibility value is longer than 64 characters' ])
+        problems = self.check(person, add=[ 'c: GBR', 'mozilliansDateStarted: last June' ],
+                              remove=[ 'c: GB', 'mozilliansDateStarted: 20110615000000Z' ])
+        self.assertEqual(sorted(problems),
+                         [ "c value 'GBR' is not a valid Country String",
+                           "mozilliansDateStarted value 'last June' is not a valid Generalized Time" ])
+        self.assertEqual(self.check(person, remove=[ 'uniqueIdentifier: test011' ],
+                                    add=[ 'uniqueIdentifier: test099' ]),
+                         [ 'RDN value uniqueIdentifier=test011 is not in the entry' ])
+
+    def test_files_in_parallel(self):
+        people = [ person.replace('test011', 'test%05d' % n) for n in range(200) ]
+        people[150] = people[150].replace('uid: test00150\n', '')
+        filename = self.write('people.ldif', 'version: 1\n\n' + ''.join(people) + link)
+        for jobs in (1, 3):
+            count, problems = checkFiles([ filename ], self.config, jobs)
+            self.assertEqual(count, 201)
+            self.assertEqual([ (dn, message) for f, offset, dn, message in problems ],
+                             [ ('uniqueIdentifier=test00150,ou=people,dc=mozillians,dc=org',
+                                'missing required attribute uid') ])
+
+    def test_missing_include(self):
+        self.write('slapd.conf', 'include %s/nothing.schema\n' % self.directory)
+        self.assertRaises(SchemaError, readSchema, os.path.join(self.directory, 'slapd.conf'))
+
+if __name__ == '__main__':
+    unittest.main()
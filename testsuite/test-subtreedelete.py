@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# Tests for deleting subtrees in waves
+#
+# These need no server: the connection keeps the DNs itself, answers
+# searches beneath them and refuses to delete an entry with children,
+# as slapd does.
+
+import unittest
+import ldap
+from ldapfilter import normaliseDN
+from fakeldap import AsyncConnection
+from subtreedelete import SubtreeDeleter, DNTree, deleteSubtrees, tree_delete_oid
+
+people = 'ou=people,dc=mozillians,dc=org'
+ldap_mozillian011DN = 'uniqueIdentifier=test011,' + people
+ldap_mozillian012DN = 'uniqueIdentifier=test012,' + people
+links_011 = [ 'uniqueIdentifier=link-%d,%s' % (n, ldap_mozillian011DN) for n in range(20) ]
+deep_011 = 'cn=deeper,' + links_011[0]
+
+class FakeConnection(AsyncConnection):
+    def __init__(self, dns, controls=()):
+        AsyncConnection.__init__(self)
+        self.entries = dict( [ (normaliseDN(dn), dn) for dn in dns ] )
+        self.controls = list(controls)
+        self.searches = 0
+        # Added when the first search has finished, as if by someone else
+        self.late = []
+
+    def beneath(self, ndn):
+        return [ other for other in self.entries if other.endswith(',' + ndn) ]
+
+    def search_s(self, base, scope, filterstr, attrlist):
+        return [ ('', { 'supportedControl': self.controls }) ]
+
+    def search_ext(self, base, scope, filterstr, attrlist, serverctrls=None):
+        self.searches += 1
+        ndn = normaliseDN(base)
+        if ndn in self.entries:
+            found = [ (self.entries[n], {}) for n in [ ndn ] + self.beneath(ndn) ]
+        else:
+            found = None
+        def replies():
+            if found is None:
+                raise ldap.NO_SUCH_OBJECT({ 'desc': 'No such object' })
+            yield ldap.RES_SEARCH_ENTRY, found
+            for dn in self.late:
+                self.entries[normaliseDN(dn)] = dn
+            self.late = []
+            yield ldap.RES_SEARCH_RESULT, []
+        return self.queue('search', base, replies())
+
+    def delete_ext(self, dn, serverctrls=None, clientctrls=None):
+        tree = [ c.controlType for c in serverctrls or [] ] == [ tree_delete_oid ]
+        def replies():
+            ndn = normaliseDN(dn)
+            if ndn not in self.entries:
+                raise ldap.NO_SUCH_OBJECT({ 'desc': 'No such object' })
+            if tree:
+                for other in self.beneath(ndn):
+                    del self.entries[other]
+            elif self.beneath(ndn):
+                raise ldap.NOT_ALLOWED_ON_NONLEAF({ 'desc': 'Operation not allowed on non-leaf' })
+            del self.entries[ndn]
+            yield ldap.RES_DELETE, []
+        return self.queue('delete', dn, replies())
+
+
+class SubtreeDeleteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = FakeConnection([ people, ldap_mozillian011DN, ldap_mozillian012DN,
+                                     deep_011 ] + links_011)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_waves(self):
+        tree = DNTree()
+        for dn in [ ldap_mozillian011DN, deep_011 ] + links_011:
+            tree.add(dn)
+        waves = tree.waves()
+        self.assertEqual(len(waves), 3)
+        self.assertEqual(sorted(waves[0]), sorted([ deep_011 ] + links_011[1:]))
+        self.assertEqual(waves[1:], [ [ links_011[0] ], [ ldap_mozillian011DN ] ])
+
+    def test_delete_subtree(self):
+        deleter = SubtreeDeleter([ self.conn ], window=8, tree_delete=False)
+        # The link is inside the subtree, and the third user does not exist
+        report = deleter.delete([ links_011[3], ldap_mozillian011DN,
+                                  'uniqueIdentifier=test013,' + people ])
+        self.assertEqual(report['errors'], [])
+        self.assertEqual(report['counts'], { 'delete': 22 })
+        self.assertEqual(report['waves'], 3)
+        self.assertEqual(self.conn.searches, 2)
+        self.assertEqual(self.conn.most, 8)
+        self.assertEqual(sorted(self.conn.entries),
+                         sorted([ normaliseDN(people), normaliseDN(ldap_mozillian012DN) ]))
+
+    def test_child_added_meanwhile(self):
+        self.conn.late = [ 'cn=late,' + ldap_mozillian012DN ]
+        report = deleteSubtrees(self.conn, [ ldap_mozillian012DN ])
+        self.assertEqual(report['counts'], { 'delete': 2 })
+        self.assertEqual(self.conn.searches, 2)
+        self.assertFalse(normaliseDN(ldap_mozillian012DN) in self.conn.entries)
+
+    def test_tree_delete(self):
+        conn = FakeConnection(self.conn.entries.values(), [ tree_delete_oid ])
+        report = SubtreeDeleter([ conn ]).delete([ ldap_mozillian011DN ])
+        self.assertEqual(report['counts'], { 'delete': 1 })
+        self.assertEqual(conn.searches, 0)
+        self.assertEqual(len(conn.entries), 2)
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Tests for batching tag membership changes
+#
+# These need no server: the connection keeps the tags' members itself
+# and records each modify, applying them as slapd would with the
+# Permissive Modify control.
+
+import unittest
+import ldap
+from ditmodel import buildFiles, readLdif
+from replica import LocalReplica, replicated_subtrees
+from tagmembers import MemberBatcher, permissive_modify_oid
+
+ldap_applicant001DN = 'uniqueIdentifier=test001,ou=people,dc=mozillians,dc=org'
+ldap_mozillian011DN = 'uniqueIdentifier=test011,ou=people,dc=mozillians,dc=org'
+ldap_mozillian012DN = 'uniqueIdentifier=test012,ou=people,dc=mozillians,dc=org'
+test_tag_1 = 'uniqueIdentifier=test-tag-001,ou=tags,dc=mozillians,dc=org'
+test_tag_2 = 'uniqueIdentifier=test-tag-002,ou=tags,dc=mozillians,dc=org'
+
+# The tags and people in the test data, for the ACL checks.
+# test-tag-002 is controlled by the members of test-tag-001.
+replica = LocalReplica('ldap://localhost:1389/')
+for filename in buildFiles() + [ 'setup.ldif' ]:
+    for dn, attrs in readLdif(filename):
+        for base in replicated_subtrees:
+            if dn.lower().endswith(base.lower()):
+                replica.entryChanged(base, dn, attrs, 'uuid-%04d' % len(replica))
+
+class FakeConnection:
+    def __init__(self):
+        self.members = { test_tag_1: set([ ldap_applicant001DN ]), test_tag_2: set() }
+        self.modifies = []
+        # Members whose DN the server will not accept
+        self.refused = set()
+
+    def modify_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        self.modifies.append( (dn, modlist) )
+        assert [ c.controlType for c in serverctrls ] == [ permissive_modify_oid ]
+        for op, attr, values in modlist:
+            if self.refused.intersection(values):
+                raise ldap.OBJECT_CLASS_VIOLATION({ 'desc': 'Object class violation' })
+        for op, attr, values in modlist:
+            if op == ldap.MOD_ADD:
+                self.members[dn].update(values)
+            else:
+                self.members[dn].difference_update(values)
+
+
+class TagMembersTests(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = FakeConnection()
+        self.batcher = MemberBatcher(self.conn, replica)
+
+    def test_one_modify_per_tag(self):
+        tickets = [ self.batcher.add(test_tag_1, dn, dn)
+                    for dn in (ldap_mozillian011DN, ldap_mozillian012DN, ldap_applicant001DN) ]
+        tickets.append(self.batcher.add(test_tag_2, ldap_mozillian011DN, ldap_mozillian011DN))
+        self.batcher.flush()
+        self.assertEqual(len(self.conn.modifies), 2)
+        for ticket in tickets:
+            self.assertTrue(ticket.wait(0))
+        self.assertEqual(self.conn.members[test_tag_1],
+                         set([ ldap_applicant001DN, ldap_mozillian011DN, ldap_mozillian012DN ]))
+        self.assertEqual(self.conn.members[test_tag_2], set([ ldap_mozillian011DN ]))
+
+    def test_last_request_wins(self):
+        self.batcher.add(test_tag_1, ldap_mozillian011DN, ldap_mozillian011DN)
+        self.batcher.remove(test_tag_1, ldap_mozillian011DN.upper(), ldap_mozillian011DN)
+        self.batcher.remove(test_tag_1, ldap_applicant001DN, ldap_applicant001DN)
+        self.batcher.flush()
+        self.assertEqual(len(self.conn.modifies), 1)
+        dn, modlist = self.conn.modifies[0]
+        self.assertEqual([ (op, sorted(values)) for op, attr, values in modlist ],
+                         [ (ldap.MOD_DELETE, sorted([ ldap_mozillian011DN.upper(),
+                                                      ldap_applicant001DN ])) ])
+        self.assertEqual(self.conn.members[test_tag_1], set())
+
+    def test_own_dn_only(self):
+        ticket = self.batcher.add(test_tag_1, ldap_mozillian011DN, ldap_applicant001DN)
+        self.assertRaises(ldap.INSUFFICIENT_ACCESS, ticket.wait, 0)
+        self.batcher.flush()
+        self.assertEqual(self.conn.modifies, [])
+
+    def test_controlled_tag(self):
+        # Only the manager group's members may add themselves (T10030)
+        allowed = self.batcher.add(test_tag_2, ldap_mozillian011DN, ldap_mozillian011DN)
+        refused = self.batcher.add(test_tag_2, ldap_mozillian012DN, ldap_mozillian012DN)
+        self.assertRaises(ldap.INSUFFICIENT_ACCESS, refused.wait, 0)
+        self.batcher.flush()
+        self.assertTrue(allowed.wait(0))
+        self.assertEqual(self.conn.members[test_tag_2], set([ ldap_mozillian011DN ]))
+
+    def test_failed_batch(self):
+        self.conn.refused.add(ldap_mozillian012DN)
+        good = self.batcher.add(test_tag_1, ldap_mozillian011DN, ldap_mozillian011DN)
+        bad = self.batcher.add(test_tag_1, ldap_mozillian012DN, ldap_mozillian012DN)
+        self.batcher.flush()
+        # The batch, then each change by itself
+        self.assertEqual(len(self.conn.modifies), 3)
+        self.assertTrue(good.wait(0))
+        self.assertRaises(ldap.OBJECT_CLASS_VIOLATION, bad.wait, 0)
+        self.assertTrue(ldap_mozillian011DN in self.conn.members[test_tag_1])
+
+    def test_background_thread(self):
+        batcher = MemberBatcher(self.conn, replica, max_batch=2, max_delay=10)
+        batcher.start()
+        first = batcher.add(test_tag_1, ldap_mozillian011DN, ldap_mozillian011DN)
+        second = batcher.add(test_tag_1, ldap_mozillian012DN, ldap_mozillian012DN)
+        # max_batch requests are waiting, so they go without the delay
+        self.assertTrue(first.wait(5))
+        self.assertTrue(second.wait(5))
+        third = batcher.remove(test_tag_1, ldap_applicant001DN, ldap_applicant001DN)
+        batcher.stop()
+        self.assertTrue(third.wait(0))
+        self.assertEqual(len(self.conn.members[test_tag_1]), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# Tests for the uniqueness index
+#
+# These need no server: the index is filled from the LDIF files that
+# devslapd loads, and writes go to a connection that only records them.
+
+import unittest
+import ldap
+from ditmodel import buildFiles, readLdif
+from replica import LocalReplica, people_node, tags_node
+from uniqueness import UniquenessIndex, readUniqueRules, clash_info
+
+ldap_applicant001DN = 'uniqueIdentifier=test001,ou=people,dc=mozillians,dc=org'
+ldap_mozillian011DN = 'uniqueIdentifier=test011,ou=people,dc=mozillians,dc=org'
+test_tag_998 = 'uniqueIdentifier=test-tag-998,ou=tags,dc=mozillians,dc=org'
+test_tag_999 = 'uniqueIdentifier=test-tag-999,ou=tags,dc=mozillians,dc=org'
+
+entries = []
+for filename in buildFiles() + [ 'setup.ldif' ]:
+    entries.extend(readLdif(filename))
+
+def tag( name ):
+    return [ ('objectClass', 'mozilliansGroup'),
+             ('uniqueIdentifier', 'test-tag-' + name),
+             ('displayName', 'Test Tag 999') ]
+
+class RecordingConnection:
+    def __init__(self, refuse=False):
+        self.refuse = refuse
+        self.sent = []
+
+    def add_s(self, dn, modlist):
+        self.write('add', dn)
+
+    def modify_s(self, dn, modlist):
+        self.write('modify', dn)
+
+    def write(self, kind, dn):
+        if self.refuse:
+            raise ldap.CONSTRAINT_VIOLATION({ 'desc': 'Constraint violation', 'info': clash_info })
+        self.sent.append( (kind, dn) )
+
+class UniquenessTests(unittest.TestCase):
+
+    def setUp(self):
+        self.index = UniquenessIndex()
+        for dn, attrs in entries:
+            self.index.entryChanged(dn, attrs)
+
+    def test_rules(self):
+        rules = readUniqueRules()
+        self.assertEqual([ (rule.nbase, rule.attrs) for rule in rules ],
+                         [ ('dc=mozillians,dc=org', [ 'uid', 'uniqueidentifier' ]),
+                           ('ou=tags,dc=mozillians,dc=org', [ 'displayname' ]) ])
+
+    def test_T9010_uid_clash(self):
+        modlist = [ (ldap.MOD_REPLACE, 'uid', 'test002') ]
+        self.assertRaises(ldap.CONSTRAINT_VIOLATION, self.index.checkModify,
+                          ldap_mozillian011DN, modlist)
+        # Case and spacing do not make a value different
+        self.assertTrue(self.index.clashes(ldap_mozillian011DN, { 'uid': [ ' TEST002' ] }))
+        # Keeping one's own uid is not a clash, nor is a new one
+        self.index.checkModify(ldap_applicant001DN, [ (ldap.MOD_REPLACE, 'uid', 'test001') ])
+        self.index.checkModify(ldap_mozillian011DN, [ (ldap.MOD_REPLACE, 'uid', 'nobody-has-this') ])
+        # Removing values cannot clash
+        self.index.checkModify(ldap_mozillian011DN, [ (ldap.MOD_DELETE, 'uid', 'test002') ])
+
+    def test_T10062_tag_clash(self):
+        conn = RecordingConnection()
+        self.index.add_s(conn, test_tag_999, tag('999'))
+        self.assertRaises(ldap.CONSTRAINT_VIOLATION, self.index.add_s, conn, test_tag_998, tag('998'))
+        self.assertEqual(conn.sent, [ ('add', test_tag_999) ])
+        # displayName only has to be unique among the tags
+        self.assertEqual(self.index.clashes(ldap_mozillian011DN, { 'displayName': 'Test Tag 999' }), [])
+
+        # Once the first tag changes its name the second one can have it
+        self.index.modify_s(conn, test_tag_999, [ (ldap.MOD_REPLACE, 'displayName', 'Renamed') ])
+        self.index.add_s(conn, test_tag_998, tag('998'))
+        self.assertEqual(self.index.counts, { 'checked': 4, 'caught': 1, 'passed': 3 })
+
+    def test_server_catches(self):
+        # A clash the index could not know about is counted when the server refuses
+        conn = RecordingConnection(refuse=True)
+        self.assertRaises(ldap.CONSTRAINT_VIOLATION, self.index.add_s, conn, test_tag_999, tag('999'))
+        self.assertEqual(self.index.counts['missed'], 1)
+        self.assertEqual(self.index.clashes(test_tag_998, dict(tag('998'))), [])
+
+    def test_follow_replica(self):
+        index = UniquenessIndex()
+        replica = LocalReplica('ldap://localhost:1389/')
+        replica.entryChanged(people_node, ldap_applicant001DN,
+                             { 'uniqueIdentifier': [ 'test001' ], 'uid': [ 'test001' ] }, 'uuid-1')
+        index.follow(replica)
+        self.assertTrue(index.clashes(ldap_mozillian011DN, { 'uid': [ 'test001' ] }))
+
+        # The uid is given up, so can be taken
+        replica.entryChanged(people_node, ldap_applicant001DN,
+                             { 'uniqueIdentifier': [ 'test001' ], 'uid': [ 'other' ] }, 'uuid-1')
+        self.assertEqual(index.clashes(ldap_mozillian011DN, { 'uid': [ 'test001' ] }), [])
+        self.assertTrue(index.clashes(ldap_mozillian011DN, { 'uid': [ 'other' ] }))
+
+        replica.entryChanged(tags_node, test_tag_999, dict(tag('999')), 'uuid-2')
+        self.assertTrue(index.clashes(test_tag_998, dict(tag('998'))))
+        replica.entriesDeleted([ 'uuid-1', 'uuid-2' ])
+        self.assertEqual(index.clashes(test_tag_998, dict(tag('998'))), [])
+        self.assertEqual(len(index), 0)
+
+if __name__ == '__main__':
+    unittest.main()
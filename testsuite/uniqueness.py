@@ -0,0 +1,342 @@
+"""Check uid, uniqueIdentifier and tag displayName clashes before writing
+
+usage: uniqueness.py [-H url] [-D dn] [-w password] file.ldif ...
+
+The unique overlay (see the unique_uri lines in devslapd/slapd.conf)
+refuses an add or modify that would give an attribute a value some
+other entry in its scope already has: uid and uniqueIdentifier across
+the whole suffix, displayName among the tags (T9010, T10062). It finds
+out with an internal subtree search for each value on each write, and
+the client only learns of the clash from the failed write.
+
+UniquenessIndex holds a 64-bit hash of every such value, with the entry
+that has it, so a registration agent or a bulk import can find a clash
+before sending anything:
+
+	index = UniquenessIndex()
+	index.scan(conn)                # one paged search per unique_uri
+	index.follow(replica)           # then kept current by a LocalReplica
+	...
+	index.checkAdd(dn, modlist)     # raises ldap.CONSTRAINT_VIOLATION
+	index.add_s(conn, dn, modlist)  # checks, then adds
+
+Values are compared as caseIgnoreMatch does (case and repeated spaces
+do not matter). Changes to an entry's own values are not clashes.
+
+The replica only follows people, tags and tables, so the values of
+other entries (the system accounts' uids) are only as fresh as the last
+scan(). The index can also be wrong for a moment after someone else's
+write, until the replica hears of it, and two different values could in
+principle share a hash; either way the server still has the last word.
+add_s() and modify_s() count how often the index caught a clash and how
+often only the server did, and report() shows it.
+
+From the command line the add records in the LDIF files are checked
+against the server's entries and against each other, as an import would
+see them.
+"""
+
+import sys
+import struct
+import getopt
+import hashlib
+import threading
+import collections
+import ldap
+from ldapfilter import normaliseDN
+from ldifreader import LdifReader
+from pagedsearch import PagedSearch
+from ditmodel import slapd_conf
+
+# What the unique overlay says
+clash_info = 'some attributes not unique'
+
+########################################################################
+# The overlay configuration
+########################################################################
+
+class UniqueRule:
+    def __init__(self, base, attrs, scope=ldap.SCOPE_SUBTREE, filterstr=None):
+        self.base = base
+        self.nbase = normaliseDN(base)
+        # Lower-case attribute names
+        self.attrs = [ attr.lower() for attr in attrs ]
+        self.scope = scope
+        self.filterstr = filterstr
+
+    def covers(self, ndn):
+        if self.scope == ldap.SCOPE_BASE:
+            return ndn == self.nbase
+        if not self.nbase:
+            return True
+        if self.scope == ldap.SCOPE_ONELEVEL:
+            return ndn.split(',', 1)[1:] == [ self.nbase ]
+        return ndn == self.nbase or ndn.endswith(',' + self.nbase)
+
+    def __repr__(self):
+        return '<UniqueRule %s %s>' % (self.base, ','.join(self.attrs))
+
+scopes = { 'base': ldap.SCOPE_BASE, 'one': ldap.SCOPE_ONELEVEL, 'sub': ldap.SCOPE_SUBTREE }
+
+# The unique_uri lines of a slapd.conf
+#
+def readUniqueRules( filename=slapd_conf ):
+    rules = []
+    for line in open(filename):
+        words = line.split()
+        if len(words) < 2 or words[0].lower() != 'unique_uri':
+            continue
+        uri = words[-1]
+        if not uri.startswith('ldap:///'):
+            continue
+        parts = (uri[len('ldap:///'):].split('?') + [ '' ] * 4)[:4]
+        base, attrs, scope, filterstr = parts
+        rules.append(UniqueRule(base, [ a for a in attrs.split(',') if a ],
+                                scopes.get(scope.lower(), ldap.SCOPE_SUBTREE), filterstr or None))
+    return rules
+
+########################################################################
+# The index
+########################################################################
+
+# The form in which caseIgnoreMatch compares values
+#
+def valueKey( value ):
+    return ' '.join(value.lower().split())
+
+class UniquenessIndex:
+    def __init__(self, rules=None):
+        if rules is None:
+            rules = readUniqueRules()
+        self.rules = rules
+        # (rule, attribute) pairs, numbered
+        self.keys = [ (n, attr) for n, rule in enumerate(rules) for attr in rule.attrs ]
+        self.lock = threading.RLock()
+        # Hash of (key number, value): normalised DN of the entry with it
+        self.owners = {}
+        # Normalised DN: tuple of (key number, hash) that it holds
+        self.held = {}
+        self.counts = collections.defaultdict(int)
+
+    def __len__(self):
+        return len(self.owners)
+
+    def digest(self, keyid, value):
+        return struct.unpack('<q', hashlib.md5('%d:%s' % (keyid, valueKey(value))).digest()[:8])[0]
+
+    # The (key number, hash, attr, value) of the values of attrs that
+    # must be unique for an entry at ndn
+    #
+    def digests(self, ndn, attrs):
+        found = []
+        for name, values in attrs.items():
+            attr = name.split(';', 1)[0].lower()
+            if isinstance(values, basestring):
+                values = [ values ]
+            for keyid, (n, key) in enumerate(self.keys):
+                if key == attr and self.rules[n].covers(ndn):
+                    for value in values or []:
+                        found.append( (keyid, self.digest(keyid, value), name, value) )
+        return found
+
+    ####################################################################
+    # Keeping up to date
+    ####################################################################
+
+    # An entry now has these attributes (all of them)
+    #
+    def entryChanged(self, dn, attrs):
+        ndn = normaliseDN(dn)
+        with self.lock:
+            self.hold(ndn, [ (keyid, digest) for keyid, digest, name, value
+                             in self.digests(ndn, attrs) ])
+
+    def entryRemoved(self, ndn):
+        with self.lock:
+            self.hold(ndn, [])
+
+    def hold(self, ndn, pairs):
+        for keyid, digest in self.held.pop(ndn, ()):
+            if self.owners.get(digest) == ndn:
+                del self.owners[digest]
+        for keyid, digest in pairs:
+            self.owners[digest] = ndn
+        if pairs:
+            self.held[ndn] = tuple(pairs)
+
+    # Load the values from the server with one paged search per rule
+    #
+    def scan(self, conn, page_size=500):
+        for rule in self.rules:
+            filterstr = rule.filterstr or \
+                '(|%s)' % ''.join([ '(%s=*)' % attr for attr in rule.attrs ])
+            search = PagedSearch(conn, rule.base, rule.scope, filterstr, rule.attrs,
+                                 page_size=page_size)
+            for dn, attrs in search:
+                self.entryChanged(dn, attrs)
+            if search.truncated:
+                raise search.error
+
+    # Follow the changes a replica.LocalReplica sees
+    #
+    def follow(self, replica):
+        replica.addListener(self)
+
+    ####################################################################
+    # Checking
+    ####################################################################
+
+    # The values among attrs that another entry already has, as
+    # (attr, value, DN of the other entry)
+    #
+    def clashes(self, dn, attrs):
+        ndn = normaliseDN(dn)
+        found = []
+        seen = {}
+        with self.lock:
+            for keyid, digest, name, value in self.digests(ndn, attrs):
+                owner = self.owners.get(digest)
+                if owner is not None and owner != ndn:
+                    found.append( (name, value, owner) )
+                elif seen.get(digest, value) != value:
+                    # The same value twice in different forms
+                    found.append( (name, value, ndn) )
+                seen[digest] = value
+        return found
+
+    def check(self, dn, attrs):
+        self.counts['checked'] += 1
+        found = self.clashes(dn, attrs)
+        if found:
+            self.counts['caught'] += 1
+            raise ldap.CONSTRAINT_VIOLATION({ 'desc': 'Constraint violation', 'info': clash_info,
+                                              'clashes': found })
+
+    # Raise ldap.CONSTRAINT_VIOLATION as the server would for an add
+    # with this modlist (as for add_s)
+    #
+    def checkAdd(self, dn, modlist):
+        self.check(dn, dict(modlist))
+
+    # The same for a modify (as for modify_s): the values added or
+    # put in place must not be another entry's
+    #
+    def checkModify(self, dn, modlist):
+        attrs = {}
+        for op, name, values in modlist:
+            if op in (ldap.MOD_ADD, ldap.MOD_REPLACE) and values:
+                if isinstance(values, basestring):
+                    values = [ values ]
+                attrs.setdefault(name, []).extend(values)
+        self.check(dn, attrs)
+
+    # Make a write the server might refuse for uniqueness, counting
+    # the refusals that the index did not catch
+    #
+    def send(self, function, *args):
+        try:
+            function(*args)
+        except ldap.CONSTRAINT_VIOLATION, e:
+            if e.args and clash_info in e.args[0].get('info', ''):
+                self.counts['missed'] += 1
+            raise
+        self.counts['passed'] += 1
+
+    def add_s(self, conn, dn, modlist):
+        self.checkAdd(dn, modlist)
+        self.send(conn.add_s, dn, modlist)
+        self.entryChanged(dn, dict(modlist))
+
+    def modify_s(self, conn, dn, modlist):
+        self.checkModify(dn, modlist)
+        self.send(conn.modify_s, dn, modlist)
+        self.applyModify(dn, modlist)
+
+    # Apply a modify that the server has accepted, without waiting for
+    # the replica to hear of it
+    #
+    def applyModify(self, dn, modlist):
+        ndn = normaliseDN(dn)
+        with self.lock:
+            pairs = list(self.held.get(ndn, ()))
+            for op, name, values in modlist:
+                if isinstance(values, basestring):
+                    values = [ values ]
+                found = [ (keyid, digest) for keyid, digest, n, v
+                          in self.digests(ndn, { name: values or [] }) ]
+                keyids = set( [ keyid for keyid, (n, key) in enumerate(self.keys)
+                                if key == name.split(';', 1)[0].lower() ] )
+                if op == ldap.MOD_REPLACE or (op == ldap.MOD_DELETE and not values):
+                    pairs = [ pair for pair in pairs if pair[0] not in keyids ]
+                elif op == ldap.MOD_DELETE:
+                    pairs = [ pair for pair in pairs if pair not in found ]
+                if op in (ldap.MOD_ADD, ldap.MOD_REPLACE):
+                    pairs.extend(found)
+            self.hold(ndn, pairs)
+
+    # How often a clash was caught here, and how often only by the server
+    #
+    def report(self, stream=sys.stderr):
+        caught = self.counts['caught']
+        missed = self.counts['missed']
+        stream.write('Uniqueness: %d values held, %d checks, %d clashes caught here, '
+                     '%d caught only by the server (%s caught here)\n' %
+                     (len(self), self.counts['checked'], caught, missed,
+                      caught + missed and '%d%%' % (100 * caught // (caught + missed)) or 'none'))
+
+# Check the add records in LDIF files against the index and each other.
+# Returns [ (filename, offset, dn, clashes) ].
+#
+def checkFiles( index, files ):
+    problems = []
+    for filename in files:
+        for record in LdifReader(filename):
+            if record.changetype != 'add':
+                continue
+            entry = record.entry()
+            found = index.clashes(record.dn, entry)
+            if found:
+                problems.append( (filename, record.start, record.dn, found) )
+            else:
+                index.entryChanged(record.dn, entry)
+    return problems
+
+def main():
+    from slapdinstance import readVars
+    settings = readVars()
+    url = settings['serverurl']
+    dn = settings['manager']
+    password = settings['password']
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'H:D:w:')
+    except getopt.GetoptError, e:
+        sys.stderr.write('%s\n%s' % (e, __doc__))
+        return 2
+    for opt, value in opts:
+        if opt == '-H':
+            url = value
+        elif opt == '-D':
+            dn = value
+        elif opt == '-w':
+            password = value
+    if not args:
+        sys.stderr.write(__doc__)
+        return 2
+
+    conn = ldap.initialize(url)
+    conn.simple_bind_s(dn, password)
+    index = UniquenessIndex()
+    index.scan(conn)
+    conn.unbind_s()
+
+    problems = checkFiles(index, args)
+    for filename, offset, entry_dn, found in problems:
+        for attr, value, owner in found:
+            sys.stdout.write('%s:%d: %s: %s=%s is already used by %s\n' %
+                             (filename, offset, entry_dn, attr, value, owner))
+    sys.stderr.write('%d values held, %d entries clash\n' % (len(index), len(problems)))
+    return problems and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())